@@ -1,86 +1,23 @@
-import json
-import re
 import os
+import re
 import urllib.request as request
 import gzip
 import argparse
-import shutil
+import multiprocessing
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-parser = argparse.ArgumentParser(description=
-    "Analyze AncestryDNA raw data.  Outputs plaintext genome analysis and " +
-    "interactive genome-wide visualization of AncestryDNA genomic data\n\n" +
-    "Example:\n" +
-    "python3 analyze_ancestrydna.py --input ~/AncestryDNA.txt",
-    formatter_class=argparse.RawTextHelpFormatter
-)
-parser.add_argument("--input", "-i",
-    help="Input AncestryDNA.txt file",
-    required=True)
-parser.add_argument("--snpedia", "-s",
-    help="Show SNPpedia result.  Default: true",
-    type=bool,
-    default=True)
-args = parser.parse_args()
-
-show_snpedia_results = args.snpedia
+from clinvar_index import get_clinvar_index
+from snpedia_store import get_snpedia_store
+from annots_io import AnnotsWriter
 
 data_dir = "../../data/analysis/"
-if os.path.exists(data_dir) == False:
-    os.mkdir(data_dir)
-
-input_file = args.input
-output_file = data_dir + "genome_analysis.txt"
-
-# Raw sample data from AncestryDNA
-ancestrydna_sample =  open(input_file).readlines()
-
-# Download ClinVar data if not already available
-date = '20170905'
-year = date[:4]
-leaf = 'clinvar_' + date + '.vcf'
-clinvar_vcf_path = data_dir + leaf
-if os.path.exists(clinvar_vcf_path) == False:
-    url = "ftp://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh37/archive_1.0/" + year + "/" + leaf + ".gz"
-    with request.urlopen(url) as response:
-        gzip_file = gzip.GzipFile(fileobj=response)
-        with open(clinvar_vcf_path, "w") as f:
-            for line in gzip_file:
-                f.write(line.decode("utf-8"))
-
-with open(clinvar_vcf_path) as f:
-    clinvar_vcf_file = f.readlines()
-
-# Download SNPedia data if not already available
-snpedia_json_path = data_dir + "snpedia-archive.json"
-if os.path.exists(snpedia_json_path) == False:
-    url = "https://raw.githubusercontent.com/heiner/snpedia-23andme/master/snpedia-archive.json"
-    with request.urlopen(url) as response:
-        data = response.read()
-        with open(snpedia_json_path, "w") as f:
-            f.write(data.decode("utf-8"))
-
-with open(snpedia_json_path) as f:
-    snpedia_json = json.loads(f.read())
-
-output = []
-
-rsids = {}
-
-bed = []
-
-clinallele_re = re.compile("CLNALLE=(-?\d+)")
-disease_re = re.compile("CLNDBN=([^;]*)")
-clinsig_re = re.compile("CLNSIG=([^;]*)")
-clinrevstat_re = re.compile("CLNREVSTAT=([^;]*)")
-clinacc_re = re.compile("CLNACC=([^;]*)")
-gene_re = re.compile("GENEINFO=(\w+)")
-
-num_ancestrydna_rsids = 0
-num_skipped_clinvars = 0
-
-annots = []
-clin_annots = []
+
+# Reference data, loaded once per run by load_references.  Worker processes
+# are forked after loading, so they share it copy-on-write.
+clinvar = None
+snpedia = None
+show_snpedia_results = True
 
 allele_map = {
     "A": 0,
@@ -92,10 +29,14 @@ allele_map = {
     "D": 4 # indel / deletion
 }
 
-seen_chrs = {}
-seen_chrs_clin_annots = {}
-
-clinical_alleles = []
+# 23andMe and VCFs name chromosomes; AncestryDNA numbers them
+chr_numbers = {
+    "X": "23",
+    "Y": "24",
+    "XY": "25",
+    "MT": "26",
+    "M": "26"
+}
 
 clinvar_url = "https://www.ncbi.nlm.nih.gov/clinvar/"
 
@@ -121,18 +62,49 @@ clinsig_labels = {
     255: "Other"
 }
 
-rs_summaries = OrderedDict([
-    ("pathogenic", []),
-    ("likely_pathogenic", []),
-    ("drug_response", [])
-])
-
-if show_snpedia_results:
-    rs_summaries["snpedia"] = []
+def download_clinvar():
+    '''Download ClinVar data if not already available'''
+    date = '20170905'
+    year = date[:4]
+    leaf = 'clinvar_' + date + '.vcf'
+    clinvar_vcf_path = data_dir + leaf
+    if os.path.exists(clinvar_vcf_path) == False:
+        url = "ftp://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh37/archive_1.0/" + year + "/" + leaf + ".gz"
+        with request.urlopen(url) as response:
+            gzip_file = gzip.GzipFile(fileobj=response)
+            with open(clinvar_vcf_path, "w") as f:
+                for line in gzip_file:
+                    f.write(line.decode("utf-8"))
+    return clinvar_vcf_path
+
+def download_snpedia():
+    '''Download SNPedia data if not already available'''
+    snpedia_json_path = data_dir + "snpedia-archive.json"
+    if os.path.exists(snpedia_json_path) == False:
+        url = "https://raw.githubusercontent.com/heiner/snpedia-23andme/master/snpedia-archive.json"
+        with request.urlopen(url) as response:
+            data = response.read()
+            with open(snpedia_json_path, "w") as f:
+                f.write(data.decode("utf-8"))
+    return snpedia_json_path
+
+def load_references(show_snpedia=True):
+    '''Load ClinVar and SNPedia data, once for all samples in a run'''
+    global clinvar, snpedia, show_snpedia_results
+
+    show_snpedia_results = show_snpedia
+
+    # Only records for rsIDs in the sample get parsed, via this index
+    clinvar = get_clinvar_index(download_clinvar())
+
+    # Likewise, only SNPedia comments for sample genotypes get read
+    if show_snpedia_results:
+        snpedia = get_snpedia_store(download_snpedia())
 
 def get_snpedia_comment(name, allele1, allele2):
 
-    if name in snpedia_json and snpedia_json[name]:
+    srs = snpedia.get(name)
+    if srs:
         # SNPedia RS object, e.g.
         a1 = allele1
         a2 = allele2
@@ -142,7 +114,6 @@ def get_snpedia_comment(name, allele1, allele2):
             return []
 
         sample_genotype = a1 + a2
-        srs = snpedia_json[name]
         if srs["original_orientation"] == "minus":
             sample_genotype = complement(a1) + complement(a2)
         if sample_genotype in srs["genotypes"]:
@@ -191,255 +162,432 @@ def convert_to_bed(ancestry_dna_columns):
     bed_line = "\t".join(bed_line)
     return bed_line
 
-# Column headers of VCF file:
-# #CHROM  POS     ID      REF     ALT     QUAL    FILTER  INFO
-#
-# Example line from body of VCF file:
-# 1       169519049       rs6025  T       C       .       .       RS=6025;RSPOS=169519049;RV;dbSNPBuildID=52;SSR=0;SAO=1;VP=0x050168000a0504053f130101;GENEINFO=F5:2153;WGT=1;VC=SNV;PM;PMC;SLO;NSM;REF;ASP;VLD;HD;GNO;KGPhase1;KGPhase3;LSD;MTP;OM;CLNALLE=0,1;CLNHGVS=NC_000001.10:g.169519049T\x3d,NC_000001.10:g.169519049T>C;CLNSRC=OMIM_Allelic_Variant,PharmGKB_Clinical_Annotation|PharmGKB;CLNORIGIN=1,1;CLNSRCID=612309.0001,1183689558|1183689558;CLNSIG=5|255|255|255|5,6;CLNDSDB=MedGen|.|.|MedGen:OMIM:SNOMED_CT|MedGen:OMIM:ORPHA:SNOMED_CT,MedGen;CLNDSDBID=C2674152|.|.|C0000809:614389:102878001|C0015499:227400:326:4320005,CN236515;CLNDBN=Thrombophilia_due_to_factor_V_Leiden|Ischemic_stroke\x2c_susceptibility_to|Budd-Chiari_syndrome\x2c_susceptibility_to|Recurrent_abortion|Factor_V_deficiency,hormonal_contraceptives_for_systemic_use_response_-_Toxicity/ADR;CLNREVSTAT=no_criteria|no_criteria|no_criteria|no_criteria|single,exp;CLNACC=RCV000000674.2|RCV000000675.3|RCV000000676.2|RCV000023935.2|RCV000205002.3,RCV000211384.1;CAF=0.00599,0.994;COMMON=1
-#
-# See top of clinvar_vcf_file for description of inner INFO columns
-for line in clinvar_vcf_file:
-
-    # Skip header lines
-    if line[0] == "#":
-        continue
-
-    columns = line.strip().split("\t")
-
-    rsid = columns[2]
-
-    info = columns[7]
-    clinallele_indexes = clinallele_re.search(info).group(1).split(",")
-    diseases = disease_re.search(info).group(1).split(",")
-    clinsigs = clinsig_re.search(info).group(1).split(",")
-    clinrevstats = clinrevstat_re.search(info).group(1).split(",")
-    clinaccs = clinacc_re.search(info).group(1).split(",")
-
-    if clinallele_indexes[0] == "-1":
-        num_skipped_clinvars += 1
-
-    ref = columns[3] # Reference allele, e.g. "A"
-    alt = columns[4].split(",") # Alternate allele(s), e.g. ["T","C"]
-    alleles = alt
-    alleles.insert(0, ref) # Ref + alts, e.g. ["A", "T", "C"]
-
-    gene_group = gene_re.search(info)
-    if gene_group:
-        gene = gene_group.group(1)
-    else:
-        gene = ""
-
-    clinalleles = []
-    if len(clinallele_indexes) > 1:
-        for i in clinallele_indexes:
-            clinalleles.append(int(alleles[i]))
-    else:
-        clinalleles.append(alleles[int(clinallele_indexes[0])])
-
-    tmp = []
-    # Mapping cardinalities:
-    # 1 RS ID : 1+ clinical alleles (one-to-many)
-    # 1 allele : 1+ diseases (one-to-many)
-    # 1 disease : 1 clinical significance (one-to-one)
-    # In other words, each RS ID can have multiple alleles, and each allele
-    # can be associated multiple one of more diseases,
-    # each of which has one clinical significance
-    for i, clinsig_list in enumerate(clinsigs):
-        for j, clinsig in enumerate(clinsig_list.split("|")):
-
-            disease = diseases[i].split("|")[j]
-            disease = disease.replace("_", " ")
-            # TODO: Properly decode non-Python-Unicode Unicode hex codes
-            disease = disease.replace("\\x2c", ",")
-
-            clinacc = clinaccs[i].split("|")[j]
-
-            clinrevstat = clinrevstats[i].split("|")[j]
-
-            tmp.append([int(clinsig), disease, clinrevstat, clinacc])
-    clinsigs = tmp
-
-    rsids[rsid] = {
-        "clinalleles": clinalleles,
-        "clinsigs": clinsigs,
-        "gene": gene
-    }
+def get_vcf_allele(allele, ref):
+    '''Get AncestryDNA-style allele for a VCF allele, e.g. "A", "I" or "D"
+    '''
+    if len(allele) > len(ref):
+        return "I"
+    elif len(allele) < len(ref):
+        return "D"
+    elif len(allele) == 1 and allele in allele_map:
+        return allele
+    # E.g. multi-nucleotide substitutions, "N", or symbolic alleles
+    return None
+
+def convert_vcf_columns(columns):
+    '''Convert VCF columns for one sample into AncestryDNA-style columns
+
+    Returns None for unplaced scaffolds, missing genotypes, and variants
+    that don't fit AncestryDNA's format.
+    '''
+    chr = columns[0]
+    if chr[:3] == "chr":
+        chr = chr[3:]
+    chr = chr_numbers.get(chr, chr)
+    if chr.isdigit() == False:
+        return None
+
+    position = columns[1]
+    name = columns[2].split(";")[0]
+    if name == ".":
+        name = "chr" + chr + ":" + position
+
+    ref = columns[3]
+    alleles = [ref] + columns[4].split(",")
+
+    format_keys = columns[8].split(":")
+    if "GT" not in format_keys:
+        return None
+    genotype = columns[9].split(":")[format_keys.index("GT")]
+
+    sample_alleles = []
+    for allele_index in re.split(r"[/|]", genotype):
+        if allele_index == ".":
+            sample_alleles.append("0")
+            continue
+        allele = get_vcf_allele(alleles[int(allele_index)], ref)
+        if allele is None:
+            return None
+        sample_alleles.append(allele)
+
+    # Haploid calls, e.g. on chrY
+    if len(sample_alleles) == 1:
+        sample_alleles *= 2
+
+    return [name, chr, position, sample_alleles[0], sample_alleles[1]]
+
+def open_sample(input_file):
+    if input_file[-3:] == ".gz":
+        return gzip.open(input_file, "rt")
+    return open(input_file)
+
+def read_sample(input_file):
+    '''Yield AncestryDNA-style columns for each variant in a raw data file
+
+    AncestryDNA rows have separate alleles:
+    rs4477212    1    82154    T    T
 
-for line in ancestrydna_sample:
+    23andMe rows have a combined genotype, and named sex chromosomes:
+    rs4477212    1    82154    TT
+    rs2032651    Y    2657176    A
 
-    if line[0] == "#" or line[:4] == "rsid":
-        continue
+    VCF rows, e.g. from whole-genome sequencing, have allele indexes in the
+    first sample's GT field.  VCFs can be gzipped.
 
-    num_ancestrydna_rsids += 1
+    All are yielded as e.g. ["rs4477212", "1", "82154", "T", "T"], one line
+    at a time and in input order, which need not be sorted.
+    '''
+    with open_sample(input_file) as f:
+        for line in f:
+            if line[0] == "#" or line[:4] == "rsid":
+                continue
+
+            columns = line.strip().split("\t")
+            if len(columns) >= 10:
+                columns = convert_vcf_columns(columns)
+                if columns is None:
+                    continue
+            elif len(columns) == 4:
+                # 23andMe, where "--" is a no-call and haploid calls have
+                # a single allele
+                rsid, chr, position, genotype = columns
+                chr = chr_numbers.get(chr, chr)
+                if genotype == "--":
+                    genotype = "00"
+                elif len(genotype) == 1:
+                    genotype = genotype * 2
+                columns = [rsid, chr, position, genotype[0], genotype[1]]
+
+            yield columns
+
+def analyze_sample(input_file, output_dir):
+    '''Analyze one raw data file, writing results to output_dir'''
+    output_file = output_dir + "genome_analysis.txt"
+
+    output = []
+
+    num_ancestrydna_rsids = 0
+
+    clinical_alleles = []
+
+    rs_summaries = OrderedDict([
+        ("pathogenic", []),
+        ("likely_pathogenic", []),
+        ("drug_response", [])
+    ])
 
-    columns = line.strip().split("\t")
+    if show_snpedia_results:
+        rs_summaries["snpedia"] = []
+
+    # Input needn't be sorted by chromosome, and can be large (e.g. from
+    # whole-genome sequencing), so annotations are bucketed by chromosome
+    # and BED lines are written as they're read
+    annots = AnnotsWriter([
+        "name", "start", "length", "homozygous", "allele1", "allele2", "clinsig"
+    ])
+    clin_annots = AnnotsWriter([
+        "name", "start", "length", "trackIndex"
+    ])
+
+    with annots, clin_annots, open(output_dir + "ancestrydna.bed", "w") as bed_file:
+        for columns in read_sample(input_file):
+
+            num_ancestrydna_rsids += 1
+
+            bed_line = convert_to_bed(columns)
+            bed_file.write(bed_line + "\n")
+
+            name = columns[0] # rsid
+            chr = str(int(columns[1])) # chromosome
+            start = int(columns[2]) # position
+            length = 1 # they're all single nucleotide variants
+            allele1 = columns[3]
+            allele2 = columns[4]
+
+            if chr == "23":
+                chr = "X"
+            elif chr == "24":
+                chr = "Y"
+            elif chr == "25" or chr == "26":
+                continue # TODO: mitochondrial DNA
+
+            homozygous = 0
+            if (allele1 == allele2):
+                homozygous = 1
+
+            if homozygous == 1:
+                # Zygosity
+                zygo = "homozygous"
+            else:
+                zygo = "heterozygous"
+
+            genotype = name + "(" + allele1 + ";" + allele2 + ")"
+
+            clinvar_record = clinvar.get(name)
+            if clinvar_record is None:
+                continue
+
+            clinalleles  = clinvar_record["clinalleles"]
+
+            if show_snpedia_results:
+                snpedia_comment = get_snpedia_comment(name, allele1, allele2)
+                if len(snpedia_comment) > 0:
+                    # SNPedia seems noisier than ClinVar, also much overlap.
+                    rs_summaries["snpedia"].append(
+                        "SNPedia result for " + genotype + ":\n" +
+                            "\t" + snpedia_comment
+                    )
+
+            for i, clinallele in enumerate(clinalleles):
+                if clinallele in set((allele1, allele2)):
+                    #output.append("clinical: " + name)
+                    # TODO: Hom vs. het clinsig
+                    cs_d_crs_ca = clinvar_record["clinsigs"][i]
+                    clinsig = cs_d_crs_ca[0]
+                    disease = cs_d_crs_ca[1]
+                    clinrevstat = cs_d_crs_ca[2]
+                    clinacc = cs_d_crs_ca[3]
+                    if clinsig > 3 and clinsig != 255:
+                        clinical_alleles.append(
+                            name + " "
+                            "chr" + chr + ":" + str(start) + " " +
+                            clinvar_record["gene"]
+                        )
+
+                        cs_label = clinsig_labels[clinsig]
+
+                        rs_summary = (
+                            "\n" + cs_label + ", " + zygo + ": " + genotype + "\n" +
+                                "\tDisease: " + disease + "\n" +
+                                "\tReview status: " + clinrevstat + "\n" +
+                                "\tClinVar record: " + clinvar_url + clinacc
+                        )
+                        key = cs_label.lower().replace(" ", "_")
+                        rs_summaries[key].append(rs_summary)
+
+                    if clinsig in set((0,2,3,4,5)):
+                        track_index = clinsig - 1
+                        # Simplify to "Pathogenic or likely pathogenic" or
+                        # "Benign or likely benign"
+                        if track_index in ((4, 3)):
+                            # Pathogenic or likely pathogenic
+                            track_index = 2
+                        elif track_index == -1:
+                            # Uncertain significance
+                            track_index = 1
+                        elif track_index in ((1, 2)):
+                            # Benign or likely benign
+                            track_index = 0
+                        clin_annot = [name, start, length, track_index]
+                        clin_annots.add(chr, clin_annot)
+                else:
+                    clinsig = -1 # Not in ClinVar
 
-    bed_line = convert_to_bed(columns)
-    bed.append(bed_line)
+                allele1 = allele_map[allele1]
+                allele2 = allele_map[allele2]
 
-    name = columns[0] # rsid
-    chr_index = int(columns[1])
-    chr = str(chr_index) # chromosome
-    start = int(columns[2]) # position
-    length = 1 # they're all single nucleotide variants
-    allele1 = columns[3]
-    allele2 = columns[4]
+                annot = [
+                    name,
+                    start,
+                    length,
+                    homozygous,
+                    allele1,
+                    allele2,
+                    clinsig
+                ]
 
-    if chr == "23":
-    	chr = "X"
-    elif chr == "24":
-    	chr = "Y"
-    elif chr == "25" or chr == "26":
-        continue # TODO: mitochondrial DNA
+                annots.add(chr, annot)
 
-    homozygous = 0
-    if (allele1 == allele2):
-        homozygous = 1
+        annots.write(output_dir + "ancestrydna.json")
+        clin_annots.write(output_dir + "ancestrydna-tracks.json")
 
-    if homozygous == 1:
-        # Zygosity
-        zygo = "homozygous"
-    else:
-        zygo = "heterozygous"
+    output.append("Number variants in AncestryDNA sample:")
+    output.append(str(num_ancestrydna_rsids) + "\n")
 
-    genotype = name + "(" + allele1 + ";" + allele2 + ")"
+    output.append("Number of variants in ClinVar analyzed:")
+    output.append(str(len(clinvar)) + "\n")
 
-    if name not in rsids:
-        continue
+    output.append("Number of skipped clinical variants:")
+    output.append(str(clinvar.num_skipped) + "\n")
 
-    clinalleles  = rsids[name]["clinalleles"]
+    #for rs in clinical_alleles:
+    #    output.append(rs)
 
-    if show_snpedia_results:
-        snpedia_comment = get_snpedia_comment(name, allele1, allele2)
-        if len(snpedia_comment) > 0:
-            # SNPedia seems noisier than ClinVar, also much overlap.
-            rs_summaries["snpedia"].append(
-                "SNPedia result for " + genotype + ":\n" +
-                    "\t" + snpedia_comment
-            )
-
-    for i, clinallele in enumerate(clinalleles):
-        if name in rsids and clinallele in set((allele1, allele2)):
-            #output.append("clinical: " + name)
-            # TODO: Hom vs. het clinsig
-            cs_d_crs_ca = rsids[name]["clinsigs"][i]
-            clinsig = cs_d_crs_ca[0]
-            disease = cs_d_crs_ca[1]
-            clinrevstat = cs_d_crs_ca[2]
-            clinacc = cs_d_crs_ca[3]
-            if clinsig > 3 and clinsig != 255:
-                clinical_alleles.append(
-                    name + " "
-                    "chr" + chr + ":" + str(start) + " " +
-                    rsids[name]["gene"]
-                )
-
-                cs_label = clinsig_labels[clinsig]
-
-                rs_summary = (
-                    "\n" + cs_label + ", " + zygo + ": " + genotype + "\n" +
-                        "\tDisease: " + disease + "\n" +
-                        "\tReview status: " + clinrevstat + "\n" +
-                        "\tClinVar record: " + clinvar_url + clinacc
-                )
-                key = cs_label.lower().replace(" ", "_")
-                rs_summaries[key].append(rs_summary)
-
-            if clinsig in set((0,2,3,4,5)):
-                track_index = clinsig - 1
-                # Simplify to "Pathogenic or likely pathogenic" or
-                # "Benign or likely benign"
-                if track_index in ((4, 3)):
-                    # Pathogenic or likely pathogenic
-                    track_index = 2
-                elif track_index == -1:
-                    # Uncertain significance
-                    track_index = 1
-                elif track_index in ((1, 2)):
-                    # Benign or likely benign
-                    track_index = 0
-                clin_annot = [name, start, length, track_index]
-                if chr in seen_chrs_clin_annots:
-                    clin_annots[chr_index - 1]["annots"].append(clin_annot)
-                else:
-                    clin_annots.append({"chr": chr, "annots": [clin_annot]})
-                    seen_chrs_clin_annots[chr] = 1
-        else:
-            clinsig = -1 # Not in ClinVar
-
-        allele1 = allele_map[allele1]
-        allele2 = allele_map[allele2]
-
-        annot = [
-            name,
-            start,
-            length,
-            homozygous,
-            allele1,
-            allele2,
-            clinsig
-        ]
+    s = rs_summaries
+
+    output.append(
+        "\nClinically significant variants in AncestryDNA sample:\n" +
+            "\tPathogenic: " + str(len(s["pathogenic"])) + "\n"
+            "\tLikely pathogenic: " + str(len(s["likely_pathogenic"])) + "\n"
+            "\tDrug response: " + str(len(s["drug_response"])) + "\n"
+    )
+
+    for key in rs_summaries:
+        for summary in rs_summaries[key]:
+            output.append(summary)
 
-        if chr in seen_chrs:
-            annots[chr_index - 1]["annots"].append(annot)
+    output = "\n".join(output)
+
+    open(output_file, "w").write(output)
+
+    copy_html(output_dir)
+
+    return [input_file, output_dir, num_ancestrydna_rsids]
+
+def copy_html(output_dir):
+    '''Copy visualization pages, pointing them to annotations beside them'''
+    for leaf in ["ancestry.html", "ancestry-tracks.html"]:
+        with open("../../examples/vanilla/" + leaf) as f:
+            html = f.read()
+        html = html.replace("'/ideogram/data/analysis/ancestrydna", "'ancestrydna")
+        with open(output_dir + leaf, "w") as f:
+            f.write(html)
+
+def get_sample_files(inputs):
+    '''Expand input files and directories into a list of raw data files'''
+    sample_files = []
+    for input in inputs:
+        if os.path.isdir(input):
+            for leaf in sorted(os.listdir(input)):
+                path = os.path.join(input, leaf)
+                if os.path.isfile(path) and leaf[0] != ".":
+                    sample_files.append(path)
         else:
-            annots.append({"chr": chr, "annots": [annot]})
-            seen_chrs[chr] = 1
-
-top_annots = {}
-top_annots["keys"] = [
-    "name", "start", "length", "homozygous", "allele1", "allele2", "clinsig"
-]
-top_annots["annots"] = annots
-annots = json.dumps(top_annots)
-open(data_dir + "ancestrydna.json", "w").write(annots)
-
-top_annots = {}
-top_annots["keys"] = [
-    "name", "start", "length", "trackIndex"
-]
-top_annots["annots"] = clin_annots
-annots = json.dumps(top_annots)
-open(data_dir + "ancestrydna-tracks.json", "w").write(annots)
-
-bed = "\n".join(bed)
-open(data_dir + "ancestrydna.bed", "w").write(bed)
-
-output.append("Number variants in AncestryDNA sample:")
-output.append(str(num_ancestrydna_rsids) + "\n")
-
-output.append("Number of variants in ClinVar analyzed:")
-output.append(str(len(rsids)) + "\n")
-
-output.append("Number of skipped clinical variants:")
-output.append(str(num_skipped_clinvars) + "\n")
-
-#for rs in clinical_alleles:
-#    output.append(rs)
-
-s = rs_summaries
-
-output.append(
-    "\nClinically significant variants in AncestryDNA sample:\n" +
-        "\tPathogenic: " + str(len(s["pathogenic"])) + "\n"
-        "\tLikely pathogenic: " + str(len(s["likely_pathogenic"])) + "\n"
-        "\tDrug response: " + str(len(s["drug_response"])) + "\n"
-)
-
-for key in rs_summaries:
-    for summary in rs_summaries[key]:
-        output.append(summary)
-
-output = "\n".join(output)
-
-open(output_file, "w").write(output)
-
-shutil.copy("../../examples/vanilla/ancestry.html", data_dir)
-shutil.copy("../../examples/vanilla/ancestry-tracks.html", data_dir)
-
-print(
-    "\nAnalysis of AncestryDNA data in:\n" +
-    "\t../data/analysis/genome_analysis.txt\n" +
-    "\thttp://localhost/ideogram/data/analysis/ancestry.html\n" +
-    "\thttp://localhost/ideogram/data/analysis/ancestry-tracks.html\n"
-)
+            sample_files.append(input)
+    return sample_files
+
+def get_output_dirs(sample_files, output_dir):
+    '''Get an output directory per sample, e.g. ../../data/analysis/jane/
+
+    A single sample writes directly to output_dir, as in earlier versions.
+    '''
+    if len(sample_files) == 1:
+        return [output_dir]
+
+    output_dirs = []
+    for sample_file in sample_files:
+        sample_name = os.path.splitext(os.path.basename(sample_file))[0]
+        output_dirs.append(os.path.join(output_dir, sample_name, ""))
+
+    if len(set(output_dirs)) < len(output_dirs):
+        raise ValueError(
+            "Input files must have distinct names, as each names an " +
+            "output directory in " + output_dir
+        )
+
+    return output_dirs
+
+def get_mp_context():
+    '''Prefer forking workers, which share loaded reference data
+    copy-on-write rather than each reloading it
+    '''
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def try_analyze_sample(input_file, output_dir):
+    '''Analyze a sample, returning any error rather than raising it
+
+    :return: [input_file, output_dir, num_rsids, error] list
+    '''
+    try:
+        return analyze_sample(input_file, output_dir) + [None]
+    except Exception as e:
+        return [input_file, output_dir, 0, repr(e)]
+
+def analyze_samples(sample_files, output_dirs, processes):
+    '''Analyze samples across processes, returning results in input order
+
+    A sample that fails doesn't stop the others; its result has an error.
+    '''
+    for output_dir in output_dirs:
+        if os.path.exists(output_dir) == False:
+            os.makedirs(output_dir)
+
+    if len(sample_files) == 1 or processes == 1:
+        return list(map(try_analyze_sample, sample_files, output_dirs))
+
+    mp_context = get_mp_context()
+    if mp_context.get_start_method() != "fork":
+        # Spawned workers don't inherit reference data, so avoid them
+        return list(map(try_analyze_sample, sample_files, output_dirs))
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=mp_context
+    ) as pool:
+        futures = [
+            pool.submit(try_analyze_sample, sample_file, output_dir)
+            for sample_file, output_dir in zip(sample_files, output_dirs)
+        ]
+        for sample_file, output_dir, future in zip(
+            sample_files, output_dirs, futures
+        ):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # E.g. the worker process died
+                results.append([sample_file, output_dir, 0, repr(e)])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=
+        "Analyze AncestryDNA or 23andMe raw data.  Outputs plaintext genome " +
+        "analysis and interactive genome-wide visualization of genomic data\n\n" +
+        "Examples:\n" +
+        "python3 analyze_ancestrydna.py --input ~/AncestryDNA.txt\n" +
+        "python3 analyze_ancestrydna.py --input ~/raw_data/ --processes 4",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--input", "-i",
+        help="Input AncestryDNA.txt or 23andMe files, or directories of them." +
+             "  With several samples, each sample's output goes into a " +
+             "directory named after its input file.",
+        nargs="+",
+        required=True)
+    parser.add_argument("--output-dir", "-o",
+        help="Output directory.  Default: " + data_dir,
+        default=data_dir)
+    parser.add_argument("--processes", "-p",
+        help="Number of samples to analyze concurrently.  " +
+             "Default: number of CPUs",
+        type=int,
+        default=os.cpu_count())
+    parser.add_argument("--snpedia", "-s",
+        help="Show SNPpedia result.  Default: true",
+        type=bool,
+        default=True)
+    args = parser.parse_args()
+
+    if os.path.exists(data_dir) == False:
+        os.mkdir(data_dir)
+
+    load_references(args.snpedia)
+
+    sample_files = get_sample_files(args.input)
+    output_dirs = get_output_dirs(sample_files, os.path.join(args.output_dir, ""))
+
+    results = analyze_samples(sample_files, output_dirs, args.processes)
+
+    print("\nAnalysis of raw genomic data in:")
+    num_errors = 0
+    for input_file, output_dir, num_rsids, error in results:
+        if error is not None:
+            num_errors += 1
+            print("\tError analyzing " + input_file + ": " + error)
+            continue
+        print(
+            "\t" + input_file + " (" + str(num_rsids) + " variants):\n" +
+            "\t\t" + output_dir + "genome_analysis.txt\n" +
+            "\t\t" + output_dir + "ancestry.html\n" +
+            "\t\t" + output_dir + "ancestry-tracks.html"
+        )
+
+    if num_errors > 0:
+        raise SystemExit(
+            "Failed to analyze " + str(num_errors) + " of " +
+            str(len(sample_files)) + " samples"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+'''Streaming writers for Ideogram annotation files
+
+Annotation files look like:
+
+{"keys": ["name", "start", "length", ...], "annots": [
+  {"chr": "1", "annots": [["rs6025", 169519049, 1, ...], ...]},
+  ...
+]}
+
+Inputs like whole-genome VCFs and dbVar GVFs have millions of rows, and need
+not be sorted by chromosome.  AnnotsWriter buckets annotations by
+chromosome as they are read, spilling each bucket to a temporary file once
+enough are buffered, then streams the buckets out chromosome by chromosome.
+Memory use is thus bounded by the buffer size, not the input size.
+
+Generators that produce each chromosome's annotations at once, e.g.
+create_annots.py, can instead pass them to write_annots directly.
+
+Huge annotation sets can also be written in a columnar format, which
+clients load into typed arrays rather than parsing millions of small JSON
+arrays.  For an output path like "example.columnar.json", that's:
+
+* example.columnar.json: manifest, with keys, metadata, and per-chromosome
+  annotation counts and byte offsets into the blob
+* example.columnar.bin: blob of little-endian int32 columns.  Each
+  chromosome has one column per key after "name", e.g. all starts, then
+  all lengths, then all track indexes.
+* example.columnar.names.txt: string table of annotation names, one per
+  line, in the same order as annotations in the blob
+
+All keys after "name" must thus have integer values.
+
+EXAMPLES
+
+with AnnotsWriter(["name", "start", "length"]) as writer:
+    for [chr, name, start, length] in rows:
+        writer.add(chr, [name, start, length])
+    writer.write("../../data/annotations/example.json")
+
+annots = read_columnar_annots("../../data/annotations/example.columnar.json")
+'''
+
+from array import array
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+columnar_format = "ideogram-columnar-annots"
+columnar_version = 1
+
+formats = ["json", "columnar"]
+
+def get_annots_path(base_path, format="json"):
+    '''Get output path for a format, e.g. "example.columnar.json"'''
+    if format == "columnar":
+        return base_path + ".columnar.json"
+    return base_path + ".json"
+
+def get_chr_sort_key(chr):
+    '''Sort numbered chromosomes numerically, then named ones, e.g. X, Y'''
+    match = re.match(r"(\d+)(.*)", chr)
+    if match:
+        return (0, int(match.group(1)), match.group(2))
+    return (1, 0, chr)
+
+def write_header(f, keys, metadata=None):
+    f.write("{")
+    if metadata is not None:
+        f.write('"metadata": ' + json.dumps(metadata) + ", ")
+    f.write('"keys": ' + json.dumps(keys) + ', "annots": [')
+
+def write_annots(path, keys, annots_by_chr, metadata=None, format="json"):
+    '''Write annotations to path from an iterable of [chr, annots] lists
+
+    Only one chromosome's annotations need be in memory at a time.  JSON
+    output matches json.dumps of the equivalent annotations object.
+    '''
+    if format == "columnar":
+        with ColumnarWriter(path, keys, metadata) as writer:
+            for chr, annots in annots_by_chr:
+                writer.add_rows(chr, annots)
+        return
+
+    with open(path, "w") as f:
+        write_header(f, keys, metadata)
+        for i, [chr, annots] in enumerate(annots_by_chr):
+            if i > 0:
+                f.write(", ")
+            f.write(json.dumps({"chr": chr, "annots": annots}))
+        f.write("]}")
+
+class AnnotsWriter():
+    '''Buckets annotations by chromosome, and writes them as streamed JSON
+    '''
+
+    def __init__(self, keys, metadata=None, max_buffered=100000):
+        self.keys = keys
+        self.metadata = metadata
+        self.max_buffered = max_buffered
+        self.buffers = {}
+        self.num_buffered = 0
+        self.num_annots = 0
+        self.spill_paths = {}
+        self.tmp_dir = None
+        self.chr_order = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_chrs(self, chrs):
+        '''Include these chromosomes in output, in this order, even if they
+        lack annots.  Other chromosomes follow them, in natural order.
+        '''
+        for chr in chrs:
+            if chr not in self.buffers:
+                self.buffers[chr] = []
+            if chr not in self.chr_order:
+                self.chr_order.append(chr)
+
+    def add(self, chr, annot):
+        '''Add an annotation, i.e. a list of values for keys, on chr'''
+        if chr in self.buffers:
+            self.buffers[chr].append(json.dumps(annot))
+        else:
+            self.buffers[chr] = [json.dumps(annot)]
+        self.num_buffered += 1
+        self.num_annots += 1
+        if self.num_buffered >= self.max_buffered:
+            self.spill()
+
+    def spill(self):
+        '''Append buffered annotations to per-chromosome temporary files'''
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix="annots_")
+
+        for chr, encoded_annots in self.buffers.items():
+            if len(encoded_annots) == 0:
+                continue
+            if chr not in self.spill_paths:
+                path = os.path.join(self.tmp_dir, str(len(self.spill_paths)))
+                self.spill_paths[chr] = path
+                separator = ""
+            else:
+                separator = ", "
+            with open(self.spill_paths[chr], "a") as f:
+                f.write(separator + ", ".join(encoded_annots))
+            self.buffers[chr] = []
+
+        self.num_buffered = 0
+
+    def get_chrs(self):
+        ordered_chrs = set(self.chr_order)
+        other_chrs = [chr for chr in self.buffers if chr not in ordered_chrs]
+        return self.chr_order + sorted(other_chrs, key=get_chr_sort_key)
+
+    def read_chr(self, chr):
+        '''Get one chromosome's annotations, from disk then memory'''
+        encoded_annots = []
+        if chr in self.spill_paths:
+            with open(self.spill_paths[chr]) as spill_file:
+                encoded_annots.append(spill_file.read())
+        if len(self.buffers[chr]) > 0:
+            encoded_annots.append(", ".join(self.buffers[chr]))
+        return json.loads("[" + ", ".join(encoded_annots) + "]")
+
+    def write_chr(self, f, chr):
+        '''Write one chromosome's annotations, from disk then memory'''
+        f.write('{"chr": ' + json.dumps(chr) + ', "annots": [')
+        has_spilled = chr in self.spill_paths
+        if has_spilled:
+            with open(self.spill_paths[chr]) as spill_file:
+                shutil.copyfileobj(spill_file, f)
+        encoded_annots = self.buffers[chr]
+        if len(encoded_annots) > 0:
+            if has_spilled:
+                f.write(", ")
+            f.write(", ".join(encoded_annots))
+        f.write("]}")
+
+    def write(self, path, format="json"):
+        '''Write all annotations to path, one chromosome at a time
+
+        JSON output matches json.dumps of the equivalent annotations object.
+        '''
+        if format == "columnar":
+            with ColumnarWriter(path, self.keys, self.metadata) as writer:
+                for chr in self.get_chrs():
+                    writer.add_rows(chr, self.read_chr(chr))
+            return
+
+        with open(path, "w") as f:
+            write_header(f, self.keys, self.metadata)
+            for i, chr in enumerate(self.get_chrs()):
+                if i > 0:
+                    f.write(", ")
+                self.write_chr(f, chr)
+            f.write("]}")
+
+    def close(self):
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+            self.spill_paths = {}
+
+def encode_int32(values):
+    '''Encode integers, e.g. a list or NumPy array, as little-endian int32'''
+    if hasattr(values, "astype"):
+        # NumPy array, which astype would silently wrap on overflow
+        if len(values) > 0 and (
+            values.min() < -2**31 or values.max() > 2**31 - 1
+        ):
+            raise OverflowError("Value out of int32 range")
+        return values.astype("<i4").tobytes()
+
+    column = array("i", values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+def get_columnar_paths(path):
+    '''Get blob and names paths for a columnar manifest path'''
+    prefix = os.path.splitext(path)[0]
+    return [prefix + ".bin", prefix + ".names.txt"]
+
+class ColumnarWriter():
+    '''Writes annotations as int32 columns, with a string table of names
+
+    Files are written to temporary paths, and replace any earlier output
+    only once all are complete, so a failed write leaves that output intact.
+
+    Example:
+        with ColumnarWriter("example.columnar.json", keys) as writer:
+            writer.add_columns("1", names, [starts, lengths])
+            writer.add_rows("2", [["rs6025", 169519049, 1]])
+    '''
+
+    def __init__(self, path, keys, metadata=None):
+        self.path = path
+        self.keys = keys
+        self.metadata = metadata
+        self.blob_path, self.names_path = get_columnar_paths(path)
+        self.blob = open(self.blob_path + ".tmp", "wb")
+        self.names = open(self.names_path + ".tmp", "w")
+        self.chrs = []
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.blob.close()
+        self.names.close()
+        if exc_type is not None:
+            for path in [self.blob_path, self.names_path]:
+                os.remove(path + ".tmp")
+            return
+        self.write_manifest()
+        # Replace manifest last, as it points into the blob and names
+        for path in [self.blob_path, self.names_path, self.path]:
+            os.replace(path + ".tmp", path)
+
+    def add_columns(self, chr, names, columns):
+        '''Add a chromosome's annotations, as names and one column per key'''
+        count = len(names)
+        if len(columns) != len(self.keys) - 1:
+            raise ValueError(
+                "Expected " + str(len(self.keys) - 1) + " columns, got " +
+                str(len(columns))
+            )
+        for column in columns:
+            if len(column) != count:
+                raise ValueError("Columns must all have one value per name")
+            self.blob.write(encode_int32(column))
+        for name in names:
+            self.names.write(name + "\n")
+
+        self.chrs.append({"chr": chr, "count": count, "offset": self.offset})
+        self.offset += 4 * count * len(columns)
+
+    def add_rows(self, chr, rows):
+        '''Add a chromosome's annotations, as rows like in JSON output'''
+        names = [row[0] for row in rows]
+        columns = [
+            [row[i] for row in rows] for i in range(1, len(self.keys))
+        ]
+        self.add_columns(chr, names, columns)
+
+    def write_manifest(self):
+        manifest = {
+            "format": columnar_format,
+            "version": columnar_version
+        }
+        if self.metadata is not None:
+            manifest["metadata"] = self.metadata
+        manifest["keys"] = self.keys
+        manifest["blob"] = os.path.basename(self.blob_path)
+        manifest["names"] = os.path.basename(self.names_path)
+        manifest["chrs"] = self.chrs
+        with open(self.path + ".tmp", "w") as f:
+            f.write(json.dumps(manifest))
+
+def read_columnar_manifest(path):
+    with open(path) as f:
+        manifest = json.loads(f.read())
+    if (
+        manifest.get("format") != columnar_format or
+        manifest.get("version") != columnar_version
+    ):
+        raise ValueError("Not a version " + str(columnar_version) +
+            " columnar annotations manifest: " + path)
+    return manifest
+
+def read_columnar_chrs(path):
+    '''Yield [chr, names, columns] per chromosome from a columnar manifest
+
+    Columns are int arrays, one per key after "name".
+    '''
+    manifest = read_columnar_manifest(path)
+    dir = os.path.dirname(path)
+    num_columns = len(manifest["keys"]) - 1
+
+    with open(os.path.join(dir, manifest["blob"]), "rb") as blob,\
+        open(os.path.join(dir, manifest["names"])) as names_file:
+        for chr_entry in manifest["chrs"]:
+            count = chr_entry["count"]
+            names = []
+            for i in range(count):
+                name = names_file.readline()
+                if name[-1:] != "\n":
+                    raise ValueError("Names table is too short for " + path)
+                names.append(name[:-1])
+            blob.seek(chr_entry["offset"])
+            columns = []
+            for i in range(num_columns):
+                data = blob.read(4 * count)
+                if len(data) != 4 * count:
+                    raise ValueError("Blob is too short for " + path)
+                column = array("i")
+                column.frombytes(data)
+                if sys.byteorder == "big":
+                    column.byteswap()
+                columns.append(column)
+            yield [chr_entry["chr"], names, columns]
+
+def read_columnar_annots(path):
+    '''Read columnar annotations into the object JSON output would have'''
+    manifest = read_columnar_manifest(path)
+    annots = []
+    for chr, names, columns in read_columnar_chrs(path):
+        rows = [list(row) for row in zip(names, *columns)]
+        annots.append({"chr": chr, "annots": rows})
+
+    top_annots = {}
+    if "metadata" in manifest:
+        top_annots["metadata"] = manifest["metadata"]
+    top_annots["keys"] = manifest["keys"]
+    top_annots["annots"] = annots
+    return top_annots
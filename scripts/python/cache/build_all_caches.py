@@ -0,0 +1,116 @@
+"""Build all Ideogram.js gene-related caches, sharing downloads across them
+
+Gene, synonym, gene structure, and protein caches all need each organism's
+Ensembl GFF and Gene Hints interest ranks.  Building those caches here, in one
+process, downloads each such file exactly once per organism and feeds it to
+every cache builder.
+
+Example:
+python3 cache/build_all_caches.py --output-dir ../../dist/data/cache/ --organism "Homo sapiens" --reuse-downloads
+"""
+
+import argparse
+import os
+import sys
+
+# Enable importing local modules when directly calling as script
+if __name__ == "__main__":
+    cur_dir = os.path.join(os.path.dirname(__file__))
+    sys.path.append(cur_dir + "/..")
+
+from lib import set_offline
+from organisms import assemblies_by_org
+from gene_cache import GeneCache, fetch_gff, fetch_interesting_genes
+from synonym_cache import SynonymCache
+from gene_structure_cache import GeneStructureCache
+
+# Cache types, and the organisms each supports.  Protein caches need manually
+# prepared UniProt topology data, so they are limited to human and mouse.
+cache_types = ["genes", "synonyms", "gene-structures", "proteins"]
+protein_organisms = ["Homo sapiens", "Mus musculus"]
+
+def build_all_caches(output_dir, organisms, types, reuse=False):
+    """Build each requested cache type for each requested organism
+    """
+    builders = {}
+    if "genes" in types:
+        builders["genes"] = GeneCache(output_dir + "genes/", reuse)
+    if "synonyms" in types:
+        builders["synonyms"] = SynonymCache(output_dir + "synonyms/", reuse)
+    if "gene-structures" in types:
+        builders["gene-structures"] = \
+            GeneStructureCache(output_dir + "gene-structures/", reuse)
+    if "proteins" in types:
+        # Imported here, as ProteinCache fetches the InterPro map on init
+        from protein_cache import ProteinCache
+        builders["proteins"] = ProteinCache(output_dir + "proteins/", reuse)
+
+    for organism in organisms:
+        print(f"Building caches for {organism}")
+
+        # Fetch shared inputs once; later builders reuse the memoized copies
+        if "genes" in builders or "gene-structures" in builders:
+            fetch_gff(organism, reuse_gff=reuse)
+        fetch_interesting_genes(organism, reuse)
+
+        for cache_type in cache_types:
+            if cache_type not in builders:
+                continue
+            if cache_type == "proteins" and organism not in protein_organisms:
+                continue
+            builders[cache_type].populate_by_org(organism)
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--output-dir",
+        help=(
+            "Directory to put outcome data, in a subdirectory per cache " +
+            "type.  (default: %(default)s)"
+        ),
+        default="data/"
+    )
+    parser.add_argument(
+        "--organism",
+        help=(
+            "Organism to build caches for; repeatable.  " +
+            "Default: all configured organisms"
+        ),
+        action="append"
+    )
+    parser.add_argument(
+        "--cache-type",
+        help=(
+            "Cache type to build; repeatable.  Default: all of " +
+            ", ".join(cache_types)
+        ),
+        choices=cache_types,
+        action="append"
+    )
+    parser.add_argument(
+        "--reuse-downloads",
+        help=(
+            "Whether to use previously-downloaded raw GFFs and BMTSVs"
+        ),
+        action="store_true"
+    )
+    parser.add_argument(
+        "--offline",
+        help=(
+            "Never use the network; use only previously-downloaded files " +
+            "and interest rank snapshots"
+        ),
+        action="store_true"
+    )
+    args = parser.parse_args()
+    output_dir = args.output_dir
+    organisms = args.organism or list(assemblies_by_org.keys())
+    types = args.cache_type or cache_types
+    reuse = args.reuse_downloads
+    set_offline(args.offline)
+
+    build_all_caches(output_dir, organisms, types, reuse)
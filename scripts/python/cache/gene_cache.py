@@ -8,6 +8,7 @@ import argparse
 import codecs
 import csv
 import gzip
+import hashlib
 import json
 import os
 import re
@@ -19,57 +20,23 @@ if __name__ == "__main__":
     cur_dir = os.path.join(os.path.dirname(__file__))
     sys.path.append(cur_dir + "/..")
 
-from lib import download_gzip
+import lib
+from lib import download_gzip, BgzfWriter
+from organisms import assemblies_by_org, get_organism, memoize_artifact
+
+# Hash-validated snapshots of Gene Hints interest ranks
+rank_snapshot_dir = "data/ranks/"
 
 def fetch_gff(organism, output_dir="data/", reuse_gff=True):
     gcache = GeneCache(output_dir, reuse_gff)
     [gff_path, gff_url] = gcache.fetch_ensembl_gff(organism)
     return [gff_path, gff_url]
 
-# Organisms configured for gene caching, and their genome assembly names
-assemblies_by_org = {
-    "Homo sapiens": "GRCh38",
-    "Mus musculus": "GRCm39",
-    "Danio rerio": "GRCz11",
-    "Gallus gallus": "bGalGal1.mat.broiler.GRCg7b",
-    "Rattus norvegicus": "mRatBN7.2",
-    "Pan troglodytes": "Pan_tro_3.0",
-    "Macaca fascicularis": "Macaca_fascicularis_6.0",
-    "Macaca mulatta": "Mmul_10",
-    "Canis lupus familiaris": "ROS_Cfam_1.0",
-    "Felis catus": "Felis_catus_9.0",
-    "Equus caballus": "EquCab3.0",
-    "Bos taurus": "ARS-UCD1.2",
-    "Sus scrofa": "Sscrofa11.1",
-    # "Anopheles gambiae": "AgamP4.51",
-    "Caenorhabditis elegans": "WBcel235",
-    "Drosophila melanogaster": "BDGP6.46"
-}
-
-ranked_genes_by_organism = {
-    "Homo sapiens": "gene-hints.tsv",
-    "Mus musculus": "pubmed-citations.tsv",
-    "Rattus norvegicus": "pubmed-citations.tsv",
-    "Canis lupus familiaris": "pubmed-citations.tsv",
-    "Felis catus": "pubmed-citations.tsv",
-}
-
-# metazoa = {
-#     "Anopheles gambiae".AgamP4.51.gff3.gz  "
-# }
-
 def get_gff_url(organism):
     """Get URL to GFF file
     E.g. https://ftp.ensembl.org/pub/release-102/gff3/homo_sapiens/Homo_sapiens.GRCh38.102.gff3.gz
     """
-    release = "110"
-    base = f"https://ftp.ensembl.org/pub/release-{release}/gff3/"
-    asm = assemblies_by_org[organism]
-    org_us = organism.replace(" ", "_")
-    org_lcus = org_us.lower()
-
-    url = f"{base}{org_lcus}/{org_us}.{asm}.{release}.gff3.gz"
-    return url
+    return get_organism(organism).gff_url
 
 def parse_gff_info_field(info):
     """Parse a GFF "INFO" field into a dictionary
@@ -179,33 +146,87 @@ def trim_gff(gff_path):
 
     return [slim_genes, prefix]
 
-def fetch_interesting_genes(organism):
-    """Request interest-ranked gene data from Gene Hints"""
-    interesting_genes = []
+def fetch_interesting_genes(organism, reuse=False):
+    """Request interest-ranked gene data from Gene Hints
+
+    Ranks are memoized per process, and cached on disk as hash-validated
+    snapshots.  So building all caches for an organism fetches its ranks at
+    most once, and reuse or offline mode can rebuild caches from a snapshot.
+    Ranks are a tuple, as all cache builders share them.
+    """
+    # Key by `reuse` too, so a non-reusing call can't make later ones fetch
+    return memoize_artifact(
+        ("ranks", organism, bool(reuse)),
+        lambda: load_interesting_genes(organism, reuse)
+    )
+
+def load_interesting_genes(organism, reuse=False):
+    """Read ranks from a valid snapshot if reusing, else download them"""
+    rank_url = get_organism(organism).rank_url
+    if rank_url is None:
+        return None
 
-    if organism not in ranked_genes_by_organism:
+    snapshot_path = rank_snapshot_dir + rank_url.split("/")[-1]
+
+    content = None
+    if reuse or lib.offline:
+        content = read_rank_snapshot(snapshot_path)
+        if content is None and lib.offline:
+            raise FileNotFoundError(
+                f"Offline mode, but no valid rank snapshot at {snapshot_path}"
+            )
+    if content is not None:
+        print(f"Using rank snapshot {snapshot_path}")
+    else:
+        print('url', rank_url)
+        with urllib.request.urlopen(rank_url) as response:
+            content = response.read()
+        write_rank_snapshot(snapshot_path, content, rank_url)
+
+    return tuple(parse_interesting_genes(content.decode("utf-8")))
+
+def read_rank_snapshot(snapshot_path):
+    """Read rank snapshot, if it exists and matches its recorded SHA-256 hash
+    """
+    hash_path = snapshot_path + ".sha256"
+    if not os.path.exists(snapshot_path) or not os.path.exists(hash_path):
+        return None
+    with open(snapshot_path, "rb") as f:
+        content = f.read()
+    with open(hash_path) as f:
+        expected_hash = f.read().split()[0]
+    if hashlib.sha256(content).hexdigest() != expected_hash:
+        print(f"Ignoring rank snapshot with mismatched hash: {snapshot_path}")
         return None
-    base_url = \
-        "https://raw.githubusercontent.com/" +\
-        "broadinstitute/gene-hints/main/data/"
-    org_lch = organism.replace(" ", "-").lower()
-    interesting_file = ranked_genes_by_organism[organism]
-    url = f"{base_url}{org_lch}-{interesting_file}"
-    print('url', url)
-    response = urllib.request.urlopen(url)
-
-    # Stream process the response instead of loading it entirely in memory.
-    # This is faster than that naive approach.
-    # Adapted from https://stackoverflow.com/a/18897408/10564415
-    reader = csv.reader(codecs.iterdecode(response, 'utf-8'), delimiter="\t")
+    return content
+
+def write_rank_snapshot(snapshot_path, content, url):
+    """Atomically write rank snapshot, and a sidecar file with its hash
+    """
+    if not os.path.exists(rank_snapshot_dir):
+        os.makedirs(rank_snapshot_dir)
+    content_hash = hashlib.sha256(content).hexdigest()
+    for [path, data] in [
+        [snapshot_path, content],
+        [snapshot_path + ".sha256", f"{content_hash}  {url}\n".encode()]
+    ]:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+def parse_interesting_genes(content):
+    """Parse Gene Hints TSV content into gene symbols, ordered by rank"""
+    interesting_genes = []
+    reader = csv.reader(content.splitlines(), delimiter="\t")
     for row in reader:
-        if row[0][0] == "#" or len(row) == 0:
+        if len(row) == 0 or row[0][0] == "#":
             continue
         interesting_genes.append(row[0])
 
     return interesting_genes
 
-def sort_by_interest(slim_genes, organism):
+def sort_by_interest(slim_genes, organism, reuse=False, gene_column=4):
     """Sort gene data by general interest or scholarly interest
 
     This uses data from the Gene Hints pipeline:
@@ -215,8 +236,11 @@ def sort_by_interest(slim_genes, organism):
     ranked by PubMed citations.  Sorting genes by interest gives a decent way
     to determine which genes are most important to show, in cases where showing
     many genes would be overwhelming.
+
+    `gene_column` is the index of the gene symbol in each row.  Rows keep
+    their relative order among equally-ranked genes.
     """
-    ranks = fetch_interesting_genes(organism)
+    ranks = fetch_interesting_genes(organism, reuse)
     # print('ranks[:20]')
     # print(ranks[:20])
     # print('slim_genes[:20]')
@@ -224,10 +248,17 @@ def sort_by_interest(slim_genes, organism):
     if ranks is None:
         return slim_genes
 
+    # Look up ranks in a dict, not via `ranks.index`, which scans all ranks
+    # for each gene and makes sorting quadratic.
+    rank_by_gene = {}
+    for (i, gene) in enumerate(ranks):
+        if gene not in rank_by_gene:
+            rank_by_gene[gene] = i
+
     # Sort genes by interest rank, and put unranked genes last
     sorted_genes = sorted(
         slim_genes,
-        key=lambda x: ranks.index(x[4]) if x[4] in ranks else 1E10,
+        key=lambda x: rank_by_gene.get(x[gene_column], 1E10),
     )
 
     return sorted_genes
@@ -249,13 +280,22 @@ class GeneCache():
 
     def fetch_ensembl_gff(self, organism):
         """Download and decompress an organism's GFF file from Ensembl
+
+        Each GFF is fetched once per process, and shared by all cache builders.
         """
+        return memoize_artifact(
+            ("gff", organism),
+            lambda: self.download_ensembl_gff(organism)
+        )
+
+    def download_ensembl_gff(self, organism):
         print(f"Fetching Ensembl GFF for {organism}")
-        url = get_gff_url(organism)
-        gff_dir = self.tmp_dir + "gff3/"
+        org = get_organism(organism)
+        url = org.gff_url
+        gff_path = org.gff_path
+        gff_dir = os.path.dirname(gff_path)
         if not os.path.exists(gff_dir):
             os.makedirs(gff_dir)
-        gff_path = gff_dir + url.split("/")[-1]
         try:
             download_gzip(url, gff_path, cache=self.reuse_gff)
         except urllib.error.HTTPError:
@@ -283,7 +323,7 @@ class GeneCache():
 
         org_lch = organism.lower().replace(" ", "-")
         output_path = f"{self.output_dir}{org_lch}-genes.tsv.gz"
-        with gzip.open(output_path, "wt") as f:
+        with BgzfWriter(output_path) as f:
             f.write(content)
         print(f"Wrote gene cache: {output_path}")
 
@@ -292,7 +332,9 @@ class GeneCache():
         """
         [gff_path, gff_url] = self.fetch_ensembl_gff(organism)
         [slim_genes, prefix] = trim_gff(gff_path)
-        sorted_slim_genes = sort_by_interest(slim_genes, organism)
+        sorted_slim_genes = sort_by_interest(
+            slim_genes, organism, self.reuse_gff
+        )
         self.write(sorted_slim_genes, organism, prefix, gff_url)
 
     def populate(self):
@@ -324,8 +366,17 @@ if __name__ == "__main__":
         ),
         action="store_true"
     )
+    parser.add_argument(
+        "--offline",
+        help=(
+            "Never use the network; use only previously-downloaded GFFs " +
+            "and interest rank snapshots"
+        ),
+        action="store_true"
+    )
     args = parser.parse_args()
     output_dir = args.output_dir
     reuse_gff = args.reuse_gff
+    lib.set_offline(args.offline)
 
     GeneCache(output_dir, reuse_gff).populate()
@@ -18,43 +18,12 @@ if __name__ == "__main__":
     cur_dir = os.path.join(os.path.dirname(__file__))
     sys.path.append(cur_dir + "/..")
 
-from lib import download
-from gene_cache import trim_id, detect_prefix, fetch_gff, parse_gff_info_field, fetch_interesting_genes
-
-# Organisms configured for gene caching, and their genome assembly names
-assemblies_by_org = {
-    "Homo sapiens": "GRCh38",
-    "Mus musculus": "GRCm39",
-    "Danio rerio": "GRCz11",
-    "Gallus gallus": "bGalGal1.mat.broiler.GRCg7b",
-    "Rattus norvegicus": "mRatBN7.2",
-    "Pan troglodytes": "Pan_tro_3.0",
-    "Macaca fascicularis": "Macaca_fascicularis_6.0",
-    "Macaca mulatta": "Mmul_10",
-    "Canis lupus familiaris": "ROS_Cfam_1.0",
-    "Felis catus": "Felis_catus_9.0",
-    "Equus caballus": "EquCab3.0",
-    "Bos taurus": "ARS-UCD1.2",
-    "Sus scrofa": "Sscrofa11.1",
-    # "Anopheles gambiae": "AgamP4.51",
-    "Caenorhabditis elegans": "WBcel235",
-    "Drosophila melanogaster": "BDGP6.46"
-}
-
-ranked_genes_by_organism = {
-    "Homo sapiens": "gene-hints.tsv",
-    "Mus musculus": "pubmed-citations.tsv",
-    "Rattus norvegicus": "pubmed-citations.tsv",
-    "Canis lupus familiaris": "pubmed-citations.tsv",
-    "Felis catus": "pubmed-citations.tsv",
-}
+from lib import download, BgzfWriter, set_offline
+from gene_cache import trim_id, detect_prefix, fetch_gff, parse_gff_info_field, sort_by_interest
+from organisms import assemblies_by_org, get_organism, memoize_artifact
 
 biotypes = {}
 
-# metazoa = {
-#     "Anopheles gambiae".AgamP4.51.bmtsv.gz  "
-# }
-
 def fetch_slim_transcript_ids(organism, output_dir="data/", reuse_bmtsv=True):
     gscache = GeneStructureCache(output_dir, reuse_bmtsv)
     slim_transcripts = gscache.fetch_transcripts(organism)
@@ -70,14 +39,13 @@ def get_bmtsv_url(organism):
     E.g. https://www.ensembl.org/biomart/martservice?query=%3C%21DOCTYPE%20Query%3E%3CQuery%20formatter%3D%22TSV%22%20header%3D%220%22%20uniqueRows%3D%220%22%20count%3D%22%22%20datasetConfigVersion%3D%220.6%22%3E%3CDataset%20name%3D%22hsapiens_gene_ensembl%22%20interface%3D%22default%22%3E%3CFilter%20name%3D%22transcript_is_canonical%22%20excluded%3D%220%22/%3E%3CAttribute%20name%3D%22ensembl_transcript_id%22%20/%3E%3C/Dataset%3E%3C/Query%3E
     """
 
-    # E.g. "Homo sapiens" -> "hsapiens"
-    split_org = organism.split()
-    brief_org = (split_org[0][0] + split_org[1]).lower()
+    # E.g. "Homo sapiens" -> "hsapiens_gene_ensembl"
+    dataset = get_organism(organism).biomart_dataset
 
     query = quote((
         '<!DOCTYPE Query>' +
         '<Query formatter="TSV" header="0" uniqueRows="0" count="" datasetConfigVersion="0.6">' +
-        '<Dataset name="' + brief_org + '_gene_ensembl" interface="default">' +
+        '<Dataset name="' + dataset + '" interface="default">' +
             '<Filter name="transcript_is_canonical" excluded="0"/>' +
             '<Attribute name="ensembl_transcript_id" />' +
         '</Dataset>' +
@@ -354,10 +322,7 @@ def parse_structures(canonical_ids, gff_path, gff_url):
     structures = build_structures(structures_by_id)
     return structures
 
-def sort_structures(structures, organism, canonical_ids):
-    ranks = fetch_interesting_genes(organism)
-    print('ranks[0:10]')
-    print(ranks[0:10])
+def sort_structures(structures, organism, canonical_ids, reuse=False):
     print('structures[0:10]')
     print(structures[0:10])
     sorted_structures = []
@@ -377,9 +342,8 @@ def sort_structures(structures, organism, canonical_ids):
     structures_with_genes = structs
 
     # Sort genes by interest rank, and put unranked genes last
-    sorted_structures_with_genes = sorted(
-        structures_with_genes,
-        key=lambda x: ranks.index(x[0]) if x[0] in ranks else 1E10,
+    sorted_structures_with_genes = sort_by_interest(
+        structures_with_genes, organism, reuse, gene_column=0
     )
 
     sorted_structures = []
@@ -482,14 +446,19 @@ class GeneStructureCache():
 
         org_lch = organism.lower().replace(" ", "-")
         output_path = f"{self.output_dir}{org_lch}-gene-structures.tsv.gz"
-        with gzip.open(output_path, "wt") as f:
+        with BgzfWriter(output_path) as f:
             f.write(content)
         print(f"Wrote gene structure cache: {output_path}")
 
     def fetch_transcript_ids(self, organism):
-        [bmtsv_path, bmtsv_url] = self.fetch_ensembl_biomart_tsv(organism)
-        transcript_ids = parse_bmtsv(bmtsv_path)
-        return [transcript_ids, bmtsv_url]
+        """Get canonical transcript IDs; fetched once per process per organism
+        """
+        def fetch():
+            [bmtsv_path, bmtsv_url] = self.fetch_ensembl_biomart_tsv(organism)
+            transcript_ids = parse_bmtsv(bmtsv_path)
+            return [transcript_ids, bmtsv_url]
+
+        return memoize_artifact(("canonical_transcript_ids", organism), fetch)
 
     def populate_by_org(self, organism):
         """Fill gene caches for a configured organism
@@ -501,7 +470,9 @@ class GeneStructureCache():
 
         structures = parse_structures(canonical_ids, gff_path, gff_url)
 
-        sorted_structures = sort_structures(structures, organism, canonical_ids)
+        sorted_structures = sort_structures(
+            structures, organism, canonical_ids, self.reuse_bmtsv
+        )
         # refined_structures = compress_structures(sorted_structures)
 
         # sorted_slim_genes = sort_by_interest(slim_genes, organism)
@@ -537,8 +508,17 @@ if __name__ == "__main__":
         ),
         action="store_true"
     )
+    parser.add_argument(
+        "--offline",
+        help=(
+            "Never use the network; use only previously-downloaded files " +
+            "and interest rank snapshots"
+        ),
+        action="store_true"
+    )
     args = parser.parse_args()
     output_dir = args.output_dir
     reuse_bmtsv = args.reuse_bmtsv
+    set_offline(args.offline)
 
     GeneStructureCache(output_dir, reuse_bmtsv).populate()
@@ -0,0 +1,112 @@
+"""Registry of organisms configured for Ideogram.js caches
+
+Gene, gene structure, protein, and synonym caches all derive from the same
+Ensembl release, and sort genes by the same Gene Hints interest ranks.  This
+module defines those organisms once, precomputes their URLs and local paths,
+and memoizes fetched artifacts so that cache builders in one process share
+downloads rather than repeating them.
+"""
+
+import threading
+
+# Ensembl release that all caches derive from
+ensembl_release = "110"
+
+# Organisms configured for gene caching, and their genome assembly names
+assemblies_by_org = {
+    "Homo sapiens": "GRCh38",
+    "Mus musculus": "GRCm39",
+    "Danio rerio": "GRCz11",
+    "Gallus gallus": "bGalGal1.mat.broiler.GRCg7b",
+    "Rattus norvegicus": "mRatBN7.2",
+    "Pan troglodytes": "Pan_tro_3.0",
+    "Macaca fascicularis": "Macaca_fascicularis_6.0",
+    "Macaca mulatta": "Mmul_10",
+    "Canis lupus familiaris": "ROS_Cfam_1.0",
+    "Felis catus": "Felis_catus_9.0",
+    "Equus caballus": "EquCab3.0",
+    "Bos taurus": "ARS-UCD1.2",
+    "Sus scrofa": "Sscrofa11.1",
+    # "Anopheles gambiae": "AgamP4.51",
+    "Caenorhabditis elegans": "WBcel235",
+    "Drosophila melanogaster": "BDGP6.46"
+}
+
+ranked_genes_by_organism = {
+    "Homo sapiens": "gene-hints.tsv",
+    "Mus musculus": "pubmed-citations.tsv",
+    "Rattus norvegicus": "pubmed-citations.tsv",
+    "Canis lupus familiaris": "pubmed-citations.tsv",
+    "Felis catus": "pubmed-citations.tsv",
+}
+
+# metazoa = {
+#     "Anopheles gambiae".AgamP4.51.gff3.gz  "
+# }
+
+gene_hints_base_url = \
+    "https://raw.githubusercontent.com/" +\
+    "broadinstitute/gene-hints/main/data/"
+
+class Organism():
+    """Names, URLs, and local paths for one configured organism
+    """
+
+    def __init__(self, name, tmp_dir="data/"):
+        self.name = name
+        self.assembly = assemblies_by_org[name]
+
+        # E.g. "Homo sapiens" -> "homo-sapiens" (LowerCase & Hyphen)
+        self.org_lch = name.lower().replace(" ", "-")
+
+        # E.g. "Homo sapiens" -> "Homo_sapiens" (UnderScore)
+        self.org_us = name.replace(" ", "_")
+
+        # E.g. "Homo sapiens" -> "hsapiens"
+        split_org = name.split()
+        self.brief_org = (split_org[0][0] + split_org[1]).lower()
+        self.biomart_dataset = self.brief_org + "_gene_ensembl"
+
+        # E.g. https://ftp.ensembl.org/pub/release-110/gff3/homo_sapiens/Homo_sapiens.GRCh38.110.gff3.gz
+        release = ensembl_release
+        base = f"https://ftp.ensembl.org/pub/release-{release}/gff3/"
+        org_lcus = self.org_us.lower()
+        self.gff_url = (
+            f"{base}{org_lcus}/{self.org_us}.{self.assembly}.{release}.gff3.gz"
+        )
+        self.gff_path = tmp_dir + "gff3/" + self.gff_url.split("/")[-1]
+
+        # Interest-rank source from Gene Hints, if any
+        self.rank_url = None
+        if name in ranked_genes_by_organism:
+            rank_file = ranked_genes_by_organism[name]
+            self.rank_url = f"{gene_hints_base_url}{self.org_lch}-{rank_file}"
+
+organisms = {}
+
+def get_organism(name):
+    """Get registry entry for a configured organism"""
+    if name not in organisms:
+        organisms[name] = Organism(name)
+    return organisms[name]
+
+artifacts = {}
+artifact_locks = {}
+artifacts_lock = threading.Lock()
+
+def memoize_artifact(key, fetch):
+    """Return artifact for `key`, calling `fetch()` only on first request
+
+    Artifacts (e.g. downloaded GFF paths, interest ranks) are shared by all
+    cache builders in this process.  Concurrent requests for the same key
+    wait for the first fetch to finish, instead of fetching again.
+    """
+    with artifacts_lock:
+        if key not in artifact_locks:
+            artifact_locks[key] = threading.Lock()
+        key_lock = artifact_locks[key]
+
+    with key_lock:
+        if key not in artifacts:
+            artifacts[key] = fetch()
+        return artifacts[key]
@@ -63,45 +63,14 @@ if __name__ == "__main__":
     cur_dir = os.path.join(os.path.dirname(__file__))
     sys.path.append(cur_dir + "/..")
 
-from lib import download, download_gzip
-from gene_cache import trim_id, detect_prefix, fetch_gff, parse_gff_info_field, fetch_interesting_genes
+from lib import download, download_gzip, BgzfWriter, set_offline
+from gene_cache import trim_id, detect_prefix, fetch_gff, parse_gff_info_field, sort_by_interest
+from organisms import assemblies_by_org, get_organism
 from gene_structure_cache import fetch_canonical_transcript_ids
 from compress_transcripts import noncanonical_names
 
-# Organisms configured for gene caching, and their genome assembly names
-assemblies_by_org = {
-    "Homo sapiens": "GRCh38",
-    "Mus musculus": "GRCm39",
-    "Danio rerio": "GRCz11",
-    "Gallus gallus": "bGalGal1.mat.broiler.GRCg7b",
-    "Rattus norvegicus": "mRatBN7.2",
-    "Pan troglodytes": "Pan_tro_3.0",
-    "Macaca fascicularis": "Macaca_fascicularis_6.0",
-    "Macaca mulatta": "Mmul_10",
-    "Canis lupus familiaris": "ROS_Cfam_1.0",
-    "Felis catus": "Felis_catus_9.0",
-    "Equus caballus": "EquCab3.0",
-    "Bos taurus": "ARS-UCD1.2",
-    "Sus scrofa": "Sscrofa11.1",
-    # "Anopheles gambiae": "AgamP4.51",
-    "Caenorhabditis elegans": "WBcel235",
-    "Drosophila melanogaster": "BDGP6.46"
-}
-
-ranked_genes_by_organism = {
-    "Homo sapiens": "gene-hints.tsv",
-    "Mus musculus": "pubmed-citations.tsv",
-    "Rattus norvegicus": "pubmed-citations.tsv",
-    "Canis lupus familiaris": "pubmed-citations.tsv",
-    "Felis catus": "pubmed-citations.tsv",
-}
-
 biotypes = {}
 
-# metazoa = {
-#     "Anopheles gambiae".AgamP4.51.bmtsv.gz  "
-# }
-
 def merge_signalp(
     signalp_path, features_by_transcript, transcript_names_by_id, feature_names_by_id
 ):
@@ -285,10 +254,7 @@ def fetch_interpro_map(proteins_dir, reuse=True):
     interpro_map = merge_pfam_unintegrated(interpro_map)
     return interpro_map
 
-def sort_proteins(proteins, organism, canonical_ids):
-    ranks = fetch_interesting_genes(organism)
-    print('ranks[0:10]')
-    print(ranks[0:10])
+def sort_proteins(proteins, organism, canonical_ids, reuse=False):
     print('proteins[0:10]')
     print(proteins[0:10])
     sorted_proteins = []
@@ -322,9 +288,8 @@ def sort_proteins(proteins, organism, canonical_ids):
     proteins_with_genes = doms
 
     # Sort genes by interest rank, and put unranked genes last
-    trimmed_proteins = sorted(
-        proteins_with_genes,
-        key=lambda d: ranks.index(d[0]) if d[0] in ranks else 1E10,
+    trimmed_proteins = sort_by_interest(
+        proteins_with_genes, organism, reuse, gene_column=0
     )
 
     # structs =
@@ -347,15 +312,14 @@ def get_signalp_url(organism):
     E.g. https://www.ensembl.org/biomart/martservice?query=%3C%3Fxml%20version%3D%221.0%22%20encoding%3D%22UTF-8%22%3F%3E%3C%21DOCTYPE%20Query%3E%3CQuery%20virtualSchemaName%20%3D%20%22default%22%20formatter%20%3D%20%22TSV%22%20header%20%3D%20%220%22%20uniqueRows%20%3D%20%220%22%20count%20%3D%20%22%22%20datasetConfigVersion%20%3D%20%220.6%22%20%3E%3CDataset%20name%20%3D%20%22hsapiens_gene_ensembl%22%20interface%20%3D%20%22default%22%20%3E%3CFilter%20name%20%3D%20%22with_interpro%22%20excluded%20%3D%20%220%22/%3E%3CAttribute%20name%20%3D%20%22ensembl_transcript_id%22%20/%3E%3CAttribute%20name%20%3D%20%22ensembl_peptide_id%22%20/%3E%3CAttribute%20name%20%3D%20%22signalp%22%20/%3E%3CAttribute%20name%20%3D%20%22signalp_start%22%20/%3E%3CAttribute%20name%20%3D%20%22signalp_end%22%20/%3E%3C/Dataset%3E%3C/Query%3E
     """
 
-    # E.g. "Homo sapiens" -> "hsapiens"
-    split_org = organism.split()
-    brief_org = (split_org[0][0] + split_org[1]).lower()
+    # E.g. "Homo sapiens" -> "hsapiens_gene_ensembl"
+    dataset = get_organism(organism).biomart_dataset
 
     query = quote((
         '<?xml version="1.0" encoding="UTF-8"?>'
         '<!DOCTYPE Query>'
         '<Query virtualSchemaName = "default" formatter = "TSV" header = "0" uniqueRows = "0" count = "" datasetConfigVersion = "0.6" >' +
-          '<Dataset name = "' + brief_org + '_gene_ensembl" interface = "default" >' +
+          '<Dataset name = "' + dataset + '" interface = "default" >' +
             '<Filter name = "with_interpro" excluded = "0"/>' +
             '<Attribute name = "ensembl_transcript_id" />' +
             '<Attribute name = "ensembl_peptide_id" />' +
@@ -374,15 +338,14 @@ def get_proteins_url(organism):
     E.g. https://www.ensembl.org/biomart/martservice?query=%3C%3Fxml%20version%3D%221.0%22%20encoding%3D%22UTF-8%22%3F%3E%3C%21DOCTYPE%20Query%3E%3CQuery%20virtualSchemaName%20%3D%20%22default%22%20formatter%20%3D%20%22TSV%22%20header%20%3D%20%220%22%20uniqueRows%20%3D%20%220%22%20count%20%3D%20%22%22%20datasetConfigVersion%20%3D%20%220.6%22%20%3E%3CDataset%20name%20%3D%20%22hsapiens_gene_ensembl%22%20interface%20%3D%20%22default%22%20%3E%3CFilter%20name%20%3D%20%22with_interpro%22%20excluded%20%3D%20%220%22/%3E%3CAttribute%20name%20%3D%20%22ensembl_transcript_id%22%20/%3E%3CAttribute%20name%20%3D%20%22pfam%22%20/%3E%3CAttribute%20name%20%3D%20%22pfam_start%22%20/%3E%3CAttribute%20name%20%3D%20%22pfam_end%22%20/%3E%3C/Dataset%3E%3C/Query%3E
     """
 
-    # E.g. "Homo sapiens" -> "hsapiens"
-    split_org = organism.split()
-    brief_org = (split_org[0][0] + split_org[1]).lower()
+    # E.g. "Homo sapiens" -> "hsapiens_gene_ensembl"
+    dataset = get_organism(organism).biomart_dataset
 
     query = quote((
         '<?xml version="1.0" encoding="UTF-8"?>'
         '<!DOCTYPE Query>'
         '<Query virtualSchemaName = "default" formatter = "TSV" header = "0" uniqueRows = "0" count = "" datasetConfigVersion = "0.6" >' +
-          '<Dataset name = "' + brief_org + '_gene_ensembl" interface = "default" >' +
+          '<Dataset name = "' + dataset + '" interface = "default" >' +
             '<Filter name = "with_interpro" excluded = "0"/>' +
             '<Attribute name = "ensembl_transcript_id" />' +
             '<Attribute name = "ensembl_peptide_id" />' +
@@ -640,7 +603,7 @@ class ProteinCache():
 
         org_lch = organism.lower().replace(" ", "-")
         output_path = f"{self.output_dir}{org_lch}-proteins.tsv.gz"
-        with gzip.open(output_path, "wt") as f:
+        with BgzfWriter(output_path) as f:
             f.write(content)
         print(f"Wrote gene protein cache: {output_path}")
 
@@ -656,7 +619,9 @@ class ProteinCache():
         [proteins, names_by_id] = parse_proteins(
             proteins_path, gff_path, interpro_map, signalp_path, organism
         )
-        sorted_proteins = sort_proteins(proteins, organism, canonical_ids)
+        sorted_proteins = sort_proteins(
+            proteins, organism, canonical_ids, self.reuse_bmtsv
+        )
         sorted_proteins = noncanonical_names(sorted_proteins)
 
         # print('proteins')
@@ -695,8 +660,17 @@ if __name__ == "__main__":
         ),
         action="store_true"
     )
+    parser.add_argument(
+        "--offline",
+        help=(
+            "Never use the network; use only previously-downloaded files " +
+            "and interest rank snapshots"
+        ),
+        action="store_true"
+    )
     args = parser.parse_args()
     output_dir = args.output_dir
     reuse_bmtsv = args.reuse_bmtsv
+    set_offline(args.offline)
 
     ProteinCache(output_dir, reuse_bmtsv).populate()
@@ -12,6 +12,7 @@ import os
 import re
 import sys
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 
 # Enable importing local modules when directly calling as script
@@ -19,50 +20,20 @@ if __name__ == "__main__":
     cur_dir = os.path.join(os.path.dirname(__file__))
     sys.path.append(cur_dir + "/..")
 
-from lib import download
-
-# Organisms configured for gene caching, and their genome assembly names
-assemblies_by_org = {
-    "Homo sapiens": "GRCh38",
-    "Mus musculus": "GRCm39",
-    "Danio rerio": "GRCz11",
-    "Gallus gallus": "bGalGal1.mat.broiler.GRCg7b",
-    "Rattus norvegicus": "mRatBN7.2",
-    "Pan troglodytes": "Pan_tro_3.0",
-    "Macaca fascicularis": "Macaca_fascicularis_6.0",
-    "Macaca mulatta": "Mmul_10",
-    "Canis lupus familiaris": "ROS_Cfam_1.0",
-    "Felis catus": "Felis_catus_9.0",
-    "Equus caballus": "EquCab3.0",
-    "Bos taurus": "ARS-UCD1.2",
-    "Sus scrofa": "Sscrofa11.1",
-    # "Anopheles gambiae": "AgamP4.51",
-    "Caenorhabditis elegans": "WBcel235",
-    "Drosophila melanogaster": "BDGP6.46"
-}
-
-ranked_genes_by_organism = {
-    "Homo sapiens": "gene-hints.tsv",
-    "Mus musculus": "pubmed-citations.tsv",
-    "Rattus norvegicus": "pubmed-citations.tsv",
-    "Canis lupus familiaris": "pubmed-citations.tsv",
-    "Felis catus": "pubmed-citations.tsv",
-}
-
-# metazoa = {
-#     "Anopheles gambiae".AgamP4.51.gff3.gz  "
-# }
+from lib import download, BgzfWriter, set_offline
+from synonym_index import write_synonym_index
+from gene_cache import sort_by_interest
+from organisms import assemblies_by_org, get_organism
 
 def get_bmtsv_url(organism):
     """Get URL to BioMart TSV (BMTSV) file
     """
-    # E.g. "Homo sapiens" -> "hsapiens"
-    split_org = organism.split()
-    brief_org = (split_org[0][0] + split_org[1]).lower()
+    # E.g. "Homo sapiens" -> "hsapiens_gene_ensembl"
+    dataset = get_organism(organism).biomart_dataset
 
     query = quote((
        '<Query formatter="TSV" header="0" uniqueRows="0" count="" datasetConfigVersion="0.6">' +
-            '<Dataset name="' + brief_org + '_gene_ensembl" interface="default">' +
+            '<Dataset name="' + dataset + '" interface="default">' +
                 '<Attribute name="external_gene_name" />' +
                 '<Attribute name="external_synonym" />' +
             '</Dataset>' +
@@ -71,60 +42,6 @@ def get_bmtsv_url(organism):
     url = f"https://www.ensembl.org/biomart/martservice?query={query}"
     return url
 
-def fetch_interesting_genes(organism):
-    """Request interest-ranked gene data from Gene Hints"""
-    interesting_genes = []
-
-    if organism not in ranked_genes_by_organism:
-        return None
-    base_url = \
-        "https://raw.githubusercontent.com/" +\
-        "broadinstitute/gene-hints/main/data/"
-    org_lch = organism.replace(" ", "-").lower()
-    interesting_file = ranked_genes_by_organism[organism]
-    url = f"{base_url}{org_lch}-{interesting_file}"
-    print('url', url)
-    response = urllib.request.urlopen(url)
-
-    # Stream process the response instead of loading it entirely in memory.
-    # This is faster than that naive approach.
-    # Adapted from https://stackoverflow.com/a/18897408/10564415
-    reader = csv.reader(codecs.iterdecode(response, 'utf-8'), delimiter="\t")
-    for row in reader:
-        if row[0][0] == "#" or len(row) == 0:
-            continue
-        interesting_genes.append(row[0])
-
-    return interesting_genes
-
-def sort_by_interest(slim_genes, organism):
-    """Sort gene data by general interest or scholarly interest
-
-    This uses data from the Gene Hints pipeline:
-    https://github.com/broadinstitute/gene-hints
-
-    Human genes are ranked by Wikipedia page views, and non-human genes are
-    ranked by PubMed citations.  Sorting genes by interest gives a decent way
-    to determine which genes are most important to show, in cases where showing
-    many genes would be overwhelming.
-    """
-    ranks = fetch_interesting_genes(organism)
-    # print('ranks[:20]')
-    # print(ranks[:20])
-    # print('slim_genes[:20]')
-    # print(slim_genes[:20])
-    if ranks is None:
-        return slim_genes
-
-    # Sort genes by interest rank, and put unranked genes last
-    sorted_genes = sorted(
-        slim_genes,
-        key=lambda x: ranks.index(x[0]) if x[0] in ranks else 1E10,
-    )
-
-    return sorted_genes
-
-
 class SynonymCache():
     """Convert BioMart TSV files to minimal TSVs
     """
@@ -158,33 +75,28 @@ class SynonymCache():
         return [bmtsv_path, url]
 
     def parse_synonyms(self, bmtsv_path):
+        """Stream BioMart rows from disk, aggregating synonyms by gene
+        """
         synonyms_by_gene = {}
         with open(bmtsv_path) as file:
             reader = csv.reader(file, delimiter="\t")
-            i = 0
+            next(reader, None) # Skip header
             for row in reader:
-                i = i + 1
-                if i == 1:
+                if len(row) < 2:
                     continue
-                [gene, synonym] = row
+                [gene, synonym] = row[:2]
                 if synonym == '':
                     continue
-                # print(gene, synonym)
                 if gene in synonyms_by_gene:
                     synonyms_by_gene[gene].append(synonym)
                 else:
                     synonyms_by_gene[gene] = [synonym]
-        # print('synonyms_by_gene')
-        # print(synonyms_by_gene)
 
-        unique_synonyms_by_gene = {}
-        for gene in synonyms_by_gene:
-            unique_synonyms = list(set(synonyms_by_gene[gene]))
-            if len(unique_synonyms) > 0:
-                unique_synonyms_by_gene[gene] = unique_synonyms
-        synonyms_by_gene = unique_synonyms_by_gene
-
-        synonyms = [[gene] + syns for (gene, syns) in synonyms_by_gene.items()]
+        # Deduplicate synonyms, preserving BioMart order
+        synonyms = [
+            [gene] + list(dict.fromkeys(syns))
+            for (gene, syns) in synonyms_by_gene.items()
+        ]
         return synonyms
 
     def fetch_synonyms(self, organism):
@@ -198,32 +110,49 @@ class SynonymCache():
 
         headers = (
             f"## Ideogram.js gene synonym cache for {organism}\n" +
-            f"# symbol\tsynonyms\n"
+            f"# symbol\tsynonyms"
         )
-        lines = "\n".join(["\t".join(s) for s in synonyms])
-        content = headers + lines
 
         org_lch = organism.lower().replace(" ", "-")
         output_path = f"{self.output_dir}{org_lch}-synonyms.tsv.gz"
-        with gzip.open(output_path, "wt") as f:
-            f.write(content)
+        with BgzfWriter(output_path) as f:
+            f.write(headers)
+            for synonym_row in synonyms:
+                f.write("\n" + "\t".join(synonym_row))
         print(f"Wrote gene synonyms cache: {output_path}")
 
+    def write_index(self, synonyms, organism):
+        """Save search index of lowercase synonyms, for fast alias resolution
+        """
+        org_lch = organism.lower().replace(" ", "-")
+        output_path = f"{self.output_dir}{org_lch}-synonyms-index.tsv.gz"
+        write_synonym_index(synonyms, organism, output_path)
+
     def populate_by_org(self, organism):
         """Fill gene caches for a configured organism
         """
         [synonyms, bmtsv_url] = self.fetch_synonyms(organism)
-        sorted_slim_genes = sort_by_interest(synonyms, organism)
+        sorted_slim_genes = sort_by_interest(
+            synonyms, organism, self.reuse_bmtsv, gene_column=0
+        )
         self.write(sorted_slim_genes, organism)
+        self.write_index(sorted_slim_genes, organism)
 
-    def populate(self):
+    def populate(self, jobs=1):
         """Fill gene caches for all configured organisms
 
-        Consider parallelizing this.
+        Organisms are processed in parallel, `jobs` at a time.
         """
-        for organism in assemblies_by_org:
-        # for organism in ["Homo sapiens"]:
-            self.populate_by_org(organism)
+        organisms = list(assemblies_by_org.keys())
+        if jobs <= 1:
+            for organism in organisms:
+                self.populate_by_org(organism)
+            return
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            # Consume results, to surface any exceptions raised by workers
+            for _ in pool.map(self.populate_by_org, organisms):
+                pass
 
 # Command-line handler
 if __name__ == "__main__":
@@ -245,8 +174,26 @@ if __name__ == "__main__":
         ),
         action="store_true"
     )
+    parser.add_argument(
+        "--jobs",
+        help=(
+            "Number of organisms to process in parallel.  (default: %(default)s)"
+        ),
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--offline",
+        help=(
+            "Never use the network; use only previously-downloaded files " +
+            "and interest rank snapshots"
+        ),
+        action="store_true"
+    )
     args = parser.parse_args()
     output_dir = args.output_dir
     reuse_bmtsv = args.reuse_bmtsv
+    jobs = args.jobs
+    set_offline(args.offline)
 
-    SynonymCache(output_dir, reuse_bmtsv).populate()
+    SynonymCache(output_dir, reuse_bmtsv).populate(jobs)
@@ -0,0 +1,227 @@
+"""Build and query compact search indexes for Ideogram.js gene synonyms
+
+The synonym cache (e.g. homo-sapiens-synonyms.tsv.gz) lists synonyms by gene,
+so resolving an alias to its gene symbol means scanning every row.  This
+module derives a sorted, front-coded table of lowercase synonyms, each mapped
+to the indexes of its genes' rows in the synonym cache.  Clients can then
+resolve an alias, or suggest aliases for a typed prefix, by binary search.
+
+Front coding: keys are split into buckets of BUCKET_SIZE.  The first key of
+each bucket is stored in full.  Each later key is stored as the length of the
+prefix it shares with the previous key, plus the remaining suffix.  Binary
+search runs over the bucket heads, then only one bucket is decoded.
+
+Example, to benchmark lookups against a linear scan:
+python3 cache/synonym_index.py ../../dist/data/cache/synonyms/homo-sapiens-synonyms.tsv.gz
+"""
+
+import argparse
+import bisect
+import gzip
+import os
+import sys
+import time
+
+# Enable importing local modules when directly calling as script
+if __name__ == "__main__":
+    cur_dir = os.path.join(os.path.dirname(__file__))
+    sys.path.append(cur_dir + "/..")
+
+from lib import BgzfWriter
+
+BUCKET_SIZE = 16
+
+def get_shared_prefix_length(a, b):
+    """Get length of the prefix shared by strings `a` and `b`"""
+    max_length = min(len(a), len(b))
+    i = 0
+    while i < max_length and a[i] == b[i]:
+        i += 1
+    return i
+
+def build_entries(synonyms):
+    """Map lowercase synonyms to gene indexes, sorted by synonym
+
+    @param synonyms List of [gene, synonym, ...] rows, in synonym cache order
+    @return Sorted list of [synonym, [gene_index, ...]]
+    """
+    indexes_by_synonym = {}
+    for (gene_index, row) in enumerate(synonyms):
+        for synonym in row[1:]:
+            key = synonym.lower()
+            if key not in indexes_by_synonym:
+                indexes_by_synonym[key] = [gene_index]
+            elif indexes_by_synonym[key][-1] != gene_index:
+                indexes_by_synonym[key].append(gene_index)
+
+    return sorted(indexes_by_synonym.items())
+
+def front_code(entries, bucket_size=BUCKET_SIZE):
+    """Encode sorted [synonym, gene_indexes] entries as front-coded rows"""
+    rows = []
+    prev_key = ""
+    for (i, [key, gene_indexes]) in enumerate(entries):
+        if i % bucket_size == 0:
+            shared = 0 # Bucket heads are stored in full
+        else:
+            shared = get_shared_prefix_length(prev_key, key)
+        gene_indexes = ",".join([str(gi) for gi in gene_indexes])
+        rows.append([str(shared), key[shared:], gene_indexes])
+        prev_key = key
+    return rows
+
+def write_synonym_index(synonyms, organism, output_path):
+    """Write front-coded synonym search index for an organism"""
+    entries = build_entries(synonyms)
+    rows = front_code(entries)
+
+    headers = "\n".join([
+        f"## Ideogram.js gene synonym search index for {organism}",
+        f"## Sorted, front-coded lowercase synonyms; each maps to 0-based",
+        f"## row indexes of genes in the corresponding synonym cache.",
+        f"## bucket size: {BUCKET_SIZE}",
+        f"# shared_prefix_length\tsuffix\tgene_indexes"
+    ])
+    with BgzfWriter(output_path) as f:
+        f.write(headers)
+        for row in rows:
+            f.write("\n" + "\t".join(row))
+    print(f"Wrote gene synonym search index: {output_path}")
+
+class SynonymIndex():
+    """Query a front-coded synonym search index
+
+    Example:
+        index = SynonymIndex.from_file("homo-sapiens-synonyms-index.tsv.gz")
+        index.lookup("p53") # -> [12]
+        index.search_prefix("brc") # -> [["brca1", [4]], ...]
+    """
+
+    def __init__(self, rows, bucket_size=BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.buckets = [
+            rows[i:i + bucket_size] for i in range(0, len(rows), bucket_size)
+        ]
+        self.heads = [bucket[0][1] for bucket in self.buckets]
+
+    @classmethod
+    def from_file(cls, index_path):
+        rows = []
+        bucket_size = BUCKET_SIZE
+        with gzip.open(index_path, "rt") as f:
+            for line in f:
+                if line.startswith("## bucket size:"):
+                    bucket_size = int(line.split(":")[1])
+                if line[0] == "#":
+                    continue
+                [shared, suffix, gene_indexes] = line.rstrip("\n").split("\t")
+                rows.append([int(shared), suffix, gene_indexes])
+        return cls(rows, bucket_size)
+
+    def __len__(self):
+        return sum([len(bucket) for bucket in self.buckets])
+
+    def decode_bucket(self, bucket_index):
+        """Get [synonym, gene_indexes] entries in a bucket"""
+        entries = []
+        prev_key = ""
+        for [shared, suffix, gene_indexes] in self.buckets[bucket_index]:
+            key = prev_key[:int(shared)] + suffix
+            gene_indexes = [int(gi) for gi in gene_indexes.split(",")]
+            entries.append([key, gene_indexes])
+            prev_key = key
+        return entries
+
+    def find_bucket(self, key):
+        """Get index of the bucket that would contain `key`"""
+        return max(bisect.bisect_right(self.heads, key) - 1, 0)
+
+    def lookup(self, synonym):
+        """Get gene indexes for a synonym, or an empty list if not found"""
+        key = synonym.lower()
+        if len(self.buckets) == 0:
+            return []
+        for [entry_key, gene_indexes] in self.decode_bucket(self.find_bucket(key)):
+            if entry_key == key:
+                return gene_indexes
+        return []
+
+    def search_prefix(self, prefix, limit=10):
+        """Get up to `limit` [synonym, gene_indexes] entries starting with prefix
+        """
+        prefix = prefix.lower()
+        results = []
+        bucket_index = self.find_bucket(prefix)
+        while bucket_index < len(self.buckets) and len(results) < limit:
+            for [key, gene_indexes] in self.decode_bucket(bucket_index):
+                if key < prefix:
+                    continue
+                if not key.startswith(prefix):
+                    return results
+                results.append([key, gene_indexes])
+                if len(results) == limit:
+                    break
+            bucket_index += 1
+        return results
+
+def read_synonym_cache(cache_path):
+    """Parse synonym cache into a list of [gene, synonym, ...] rows"""
+    synonyms = []
+    with gzip.open(cache_path, "rt") as f:
+        for line in f:
+            if line[0] == "#":
+                continue
+            synonyms.append(line.rstrip("\n").split("\t"))
+    return synonyms
+
+def benchmark(cache_path, num_queries=2000):
+    """Compare indexed synonym lookup to linear scan of the synonym cache"""
+    synonyms = read_synonym_cache(cache_path)
+    index_path = "data/synonym-index-benchmark.tsv.gz"
+    if not os.path.exists("data/"):
+        os.makedirs("data/")
+    write_synonym_index(synonyms, "benchmark", index_path)
+    index = SynonymIndex.from_file(index_path)
+
+    step = max(len(synonyms) // num_queries, 1)
+    queries = [row[-1] for row in synonyms[::step] if len(row) > 1]
+
+    t0 = time.time()
+    for query in queries:
+        query = query.lower()
+        [
+            i for (i, row) in enumerate(synonyms)
+            if query in [s.lower() for s in row[1:]]
+        ]
+    scan_time = time.time() - t0
+
+    t0 = time.time()
+    for query in queries:
+        index.lookup(query)
+    index_time = time.time() - t0
+
+    print(f"Synonyms indexed: {len(index)}")
+    print(f"Index size: {os.path.getsize(index_path)} bytes (gzipped)")
+    print(f"Cache size: {os.path.getsize(cache_path)} bytes (gzipped)")
+    print(f"Linear scan: {len(queries)} lookups in {scan_time:.3f} s")
+    print(f"Index: {len(queries)} lookups in {index_time:.3f} s")
+
+# Command-line handler
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "cache_path",
+        help="Path to a synonym cache, e.g. homo-sapiens-synonyms.tsv.gz"
+    )
+    parser.add_argument(
+        "--num-queries",
+        help="Number of lookups to time.  (default: %(default)s)",
+        type=int,
+        default=2000
+    )
+    args = parser.parse_args()
+
+    benchmark(args.cache_path, args.num_queries)
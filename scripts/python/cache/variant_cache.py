@@ -7,8 +7,16 @@ python variant_cache.py
 import csv
 import gzip
 import json
+import os
 import sys
 
+# Enable importing local modules when directly calling as script
+if __name__ == "__main__":
+    cur_dir = os.path.join(os.path.dirname(__file__))
+    sys.path.append(cur_dir + "/..")
+
+from lib import BgzfWriter
+
 # Avoid "field larger than field limit (131072)"
 csv.field_size_limit(sys.maxsize)
 
@@ -269,7 +277,7 @@ def write_gene_byte_index(filepath):
 
     with open(f"{filepath}.li", "w") as file:
         file.write(output)
-    with gzip.open(f"{output_path}.li.gz", "wt") as f:
+    with BgzfWriter(f"{output_path}.li.gz") as f:
         f.write(output)
     print(f"Lines byte-indexed, total: {len(gene_variant_byte_index)}")
 
@@ -335,7 +343,7 @@ def cache_variants(output_path):
 
     with open(output_path, "w") as f:
         f.write(content)
-    with gzip.open(f"{output_path}.gz", "wt") as f:
+    with BgzfWriter(f"{output_path}.gz") as f:
         f.write(content)
 
     print('Wrote output to: ' + output_path)
@@ -0,0 +1,229 @@
+'''Compact rsID index into a ClinVar VCF, for fast per-sample lookups
+
+A consumer genotyping file has ~700k SNPs, but only a few thousand of them
+are in ClinVar.  Rather than parsing every ClinVar record for each sample,
+build a sorted array of integer rsIDs and byte offsets into the VCF once per
+ClinVar release, then seek to and parse only the records a sample has.
+
+Index layout, in little-endian byte order:
+
+* Magic bytes: b"CVRSIDX1"
+* uint64: number of indexed rsIDs (n)
+* uint64: number of records in the VCF
+* uint64: number of records without a clinical allele (CLNALLE=-1)
+* uint64[n]: sorted rsID numbers (e.g. 6025 for rs6025)
+* uint64[n]: byte offset of each rsID's record in the VCF
+
+EXAMPLES
+
+index = get_clinvar_index("../../data/analysis/clinvar_20170905.vcf")
+index.get("rs6025") # -> {"clinalleles": ["C"], "clinsigs": [...], ...}
+'''
+
+from array import array
+import bisect
+import os
+import re
+import struct
+import sys
+
+magic = b"CVRSIDX1"
+header_format = "<8sQQQ"
+
+clinallele_re = re.compile(r"CLNALLE=(-?\d+)")
+disease_re = re.compile(r"CLNDBN=([^;]*)")
+clinsig_re = re.compile(r"CLNSIG=([^;]*)")
+clinrevstat_re = re.compile(r"CLNREVSTAT=([^;]*)")
+clinacc_re = re.compile(r"CLNACC=([^;]*)")
+gene_re = re.compile(r"GENEINFO=(\w+)")
+
+def parse_clinvar_record(line):
+    '''Parse a ClinVar VCF body line into [rsid, record]
+
+    Column headers of VCF file:
+    #CHROM  POS     ID      REF     ALT     QUAL    FILTER  INFO
+
+    Example line from body of VCF file:
+    1       169519049       rs6025  T       C       .       .       RS=6025;RSPOS=169519049;RV;dbSNPBuildID=52;SSR=0;SAO=1;VP=0x050168000a0504053f130101;GENEINFO=F5:2153;WGT=1;VC=SNV;PM;PMC;SLO;NSM;REF;ASP;VLD;HD;GNO;KGPhase1;KGPhase3;LSD;MTP;OM;CLNALLE=0,1;CLNHGVS=NC_000001.10:g.169519049T\x3d,NC_000001.10:g.169519049T>C;CLNSRC=OMIM_Allelic_Variant,PharmGKB_Clinical_Annotation|PharmGKB;CLNORIGIN=1,1;CLNSRCID=612309.0001,1183689558|1183689558;CLNSIG=5|255|255|255|5,6;CLNDSDB=MedGen|.|.|MedGen:OMIM:SNOMED_CT|MedGen:OMIM:ORPHA:SNOMED_CT,MedGen;CLNDSDBID=C2674152|.|.|C0000809:614389:102878001|C0015499:227400:326:4320005,CN236515;CLNDBN=Thrombophilia_due_to_factor_V_Leiden|Ischemic_stroke\x2c_susceptibility_to|Budd-Chiari_syndrome\x2c_susceptibility_to|Recurrent_abortion|Factor_V_deficiency,hormonal_contraceptives_for_systemic_use_response_-_Toxicity/ADR;CLNREVSTAT=no_criteria|no_criteria|no_criteria|no_criteria|single,exp;CLNACC=RCV000000674.2|RCV000000675.3|RCV000000676.2|RCV000023935.2|RCV000205002.3,RCV000211384.1;CAF=0.00599,0.994;COMMON=1
+
+    See top of ClinVar VCF file for description of inner INFO columns
+    '''
+    columns = line.strip().split("\t")
+
+    rsid = columns[2]
+
+    info = columns[7]
+    clinallele_indexes = clinallele_re.search(info).group(1).split(",")
+    diseases = disease_re.search(info).group(1).split(",")
+    clinsigs = clinsig_re.search(info).group(1).split(",")
+    clinrevstats = clinrevstat_re.search(info).group(1).split(",")
+    clinaccs = clinacc_re.search(info).group(1).split(",")
+
+    ref = columns[3] # Reference allele, e.g. "A"
+    alt = columns[4].split(",") # Alternate allele(s), e.g. ["T","C"]
+    alleles = alt
+    alleles.insert(0, ref) # Ref + alts, e.g. ["A", "T", "C"]
+
+    gene_group = gene_re.search(info)
+    if gene_group:
+        gene = gene_group.group(1)
+    else:
+        gene = ""
+
+    clinalleles = []
+    if len(clinallele_indexes) > 1:
+        for i in clinallele_indexes:
+            clinalleles.append(alleles[int(i)])
+    else:
+        clinalleles.append(alleles[int(clinallele_indexes[0])])
+
+    tmp = []
+    # Mapping cardinalities:
+    # 1 RS ID : 1+ clinical alleles (one-to-many)
+    # 1 allele : 1+ diseases (one-to-many)
+    # 1 disease : 1 clinical significance (one-to-one)
+    # In other words, each RS ID can have multiple alleles, and each allele
+    # can be associated multiple one of more diseases,
+    # each of which has one clinical significance
+    for i, clinsig_list in enumerate(clinsigs):
+        for j, clinsig in enumerate(clinsig_list.split("|")):
+
+            disease = diseases[i].split("|")[j]
+            disease = disease.replace("_", " ")
+            # TODO: Properly decode non-Python-Unicode Unicode hex codes
+            disease = disease.replace("\\x2c", ",")
+
+            clinacc = clinaccs[i].split("|")[j]
+
+            clinrevstat = clinrevstats[i].split("|")[j]
+
+            tmp.append([int(clinsig), disease, clinrevstat, clinacc])
+    clinsigs = tmp
+
+    record = {
+        "clinalleles": clinalleles,
+        "clinsigs": clinsigs,
+        "gene": gene
+    }
+
+    return [rsid, record]
+
+def get_rsid_number(rsid):
+    '''Convert e.g. "rs6025" to 6025, or return None for other IDs'''
+    if rsid[:2] != "rs" or not rsid[2:].isdigit():
+        return None
+    return int(rsid[2:])
+
+def build_clinvar_index(vcf_path, index_path):
+    '''Scan a ClinVar VCF once, and write its rsID index'''
+    offsets_by_rsid = {}
+    num_records = 0
+    num_skipped = 0
+
+    with open(vcf_path, "rb") as f:
+        offset = 0
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+
+            # Skip header lines
+            if line[:1] == b"#":
+                continue
+
+            num_records += 1
+            columns = line.split(b"\t", 8)
+            info = columns[7].decode("utf-8")
+            if clinallele_re.search(info).group(1) == "-1":
+                num_skipped += 1
+
+            rs_number = get_rsid_number(columns[2].decode("utf-8"))
+            if rs_number is not None:
+                # As with a dict of records, the last record for an rsID wins
+                offsets_by_rsid[rs_number] = line_offset
+
+    rsids = array("Q", sorted(offsets_by_rsid.keys()))
+    offsets = array("Q", [offsets_by_rsid[rsid] for rsid in rsids])
+    if sys.byteorder == "big":
+        rsids.byteswap()
+        offsets.byteswap()
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack(
+            header_format, magic, len(rsids), num_records, num_skipped
+        ))
+        rsids.tofile(f)
+        offsets.tofile(f)
+    os.replace(tmp_path, index_path)
+
+class ClinvarIndex():
+    '''Look up ClinVar records by rsID, parsing only the records requested
+    '''
+
+    def __init__(self, vcf_path, index_path):
+        self.vcf_path = vcf_path
+
+        with open(index_path, "rb") as f:
+            header = f.read(struct.calcsize(header_format))
+            [file_magic, num_rsids, num_records, num_skipped] =\
+                struct.unpack(header_format, header)
+            if file_magic != magic:
+                raise ValueError("Not a ClinVar rsID index: " + index_path)
+            self.rsids = array("Q")
+            self.rsids.fromfile(f, num_rsids)
+            self.offsets = array("Q")
+            self.offsets.fromfile(f, num_rsids)
+        if sys.byteorder == "big":
+            self.rsids.byteswap()
+            self.offsets.byteswap()
+
+        self.num_records = num_records
+        self.num_skipped = num_skipped
+        self.vcf = None
+        self.pid = None
+
+    def get_vcf(self):
+        '''Get VCF file handle, opened once per process
+
+        Forked worker processes share the index arrays copy-on-write, but
+        must not share a file offset with their parent, so each reopens.
+        '''
+        if self.pid != os.getpid():
+            self.vcf = open(self.vcf_path, "rb")
+            self.pid = os.getpid()
+        return self.vcf
+
+    def __len__(self):
+        return len(self.rsids)
+
+    def get(self, rsid):
+        '''Get ClinVar record for an rsID (e.g. "rs6025"), or None'''
+        rs_number = get_rsid_number(rsid)
+        if rs_number is None:
+            return None
+
+        i = bisect.bisect_left(self.rsids, rs_number)
+        if i == len(self.rsids) or self.rsids[i] != rs_number:
+            return None
+
+        vcf = self.get_vcf()
+        vcf.seek(self.offsets[i])
+        line = vcf.readline().decode("utf-8")
+        return parse_clinvar_record(line)[1]
+
+    def close(self):
+        if self.vcf is not None and self.pid == os.getpid():
+            self.vcf.close()
+        self.vcf = None
+        self.pid = None
+
+def get_clinvar_index(vcf_path):
+    '''Get index for a ClinVar VCF, building it first if needed'''
+    index_path = vcf_path + ".rsidx"
+    if (
+        os.path.exists(index_path) == False or
+        os.path.getmtime(index_path) < os.path.getmtime(vcf_path)
+    ):
+        print("Building ClinVar rsID index: " + index_path)
+        build_clinvar_index(vcf_path, index_path)
+    return ClinvarIndex(vcf_path, index_path)
@@ -1,56 +1,338 @@
-''' Converts gene data from Ensembl Biomart to JSON-formatted annotations'''
+''' Converts gene data from Ensembl BioMart to JSON-formatted annotations
 
-import json, random
+Streams any BioMart TSV export, e.g. with "Gene start (bp)", "Gene end (bp)",
+"Gene name", "Gene type" and "Chromosome/scaffold name" columns.  Track values
+come from real attributes: categorical columns (e.g. gene type) are
+dictionary-encoded, and numeric columns are binned.  Category labels and bin
+edges are written to the output's metadata.
 
-annots = []
+Each input's organism, e.g. "homo-sapiens" for "homo-sapiens.tsv" or
+"Homo_sapiens,_Ensembl_80.tsv", selects its chromosomes from Ideogram's band
+data.  Several inputs, or directories of them, are converted in parallel.
 
-chrs = [
-	"1", "2", "3", "4", "5", "6", "7", "8", "9", "10",
-	"11", "12", "13", "14", "15", "16", "17", "18", "19", "20",
-	"21", "22", "X", "Y"
-]
+Examples:
 
-file_name = "data/annotations/Homo_sapiens,_Ensembl_80.tsv"
-file = open(file_name, "r").readlines()
+	# Convert the Ensembl 80 human genes export
+	python3 convert_biomart_to_annots.py --input "../../data/annotations/Homo_sapiens,_Ensembl_80.tsv"
 
-for chr in chrs:
-	annots.append({"chr": chr, "annots": []});
+	# Convert exports for all organisms in a directory, as columnar files
+	python3 convert_biomart_to_annots.py --input biomart/ --format columnar
 
-for line in file[1:]:
+	# Use a custom column for names, and bin a numeric column into 7 tracks
+	python3 convert_biomart_to_annots.py --input mouse.tsv --organism mus-musculus --name_column "Gene stable ID" --numeric_columns "Transcript count" --num_bins 7
+'''
 
-	columns = line.strip().split("\t")
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
-	chr = columns[4]
+from annots_io import AnnotsWriter, formats, get_annots_path
 
-	if chr not in chrs:
-		# E.g. chrMT, alternate loci scaffolds
-		continue
+# Header names of standard columns, across BioMart versions, in lower case
+default_columns = {
+	"chr": ["chromosome/scaffold name", "chromosome name"],
+	"start": ["gene start (bp)"],
+	"end": ["gene end (bp)"],
+	"name": ["gene name", "associated gene name"]
+}
 
-	if chr == "X":
-		chr = 22
-	elif chr == "Y":
-		chr = 23
-	else:
-		chr = int(chr) - 1
+parser = argparse.ArgumentParser(
+	description=__doc__,
+	formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--input",
+	help="BioMart TSV files, or directories of them",
+	nargs="+",
+	default=["../../data/annotations/Homo_sapiens,_Ensembl_80.tsv"])
+parser.add_argument("--organism",
+	help="Organism of input, e.g. homo-sapiens.  Default: from file name",
+	default=None)
+parser.add_argument("--bands_dir",
+	help="Directory of Ideogram band data, for chromosome lists",
+	default="../../data/bands/native/")
+parser.add_argument("--output_dir",
+	help="Directory to send output data to, e.g. homo-sapiens-genes.json",
+	default="../../data/annotations/")
+parser.add_argument("--chr_column",
+	help="Header or 0-based index of chromosome column")
+parser.add_argument("--start_column",
+	help="Header or 0-based index of start column")
+parser.add_argument("--end_column",
+	help="Header or 0-based index of end column")
+parser.add_argument("--name_column",
+	help="Header or 0-based index of name column")
+parser.add_argument("--category_columns",
+	help="Headers or indexes of columns to dictionary-encode as tracks.  " +
+		"Default: Gene type",
+	nargs="*",
+	default=["Gene type"])
+parser.add_argument("--numeric_columns",
+	help="Headers or indexes of numeric columns to bin as tracks",
+	nargs="*",
+	default=[])
+parser.add_argument("--num_bins",
+	help="Number of equal-width bins for numeric columns.  Default: 5",
+	type=int,
+	default=5)
+parser.add_argument("--format",
+	help="Output format: json, or columnar for int32 columns.  Default: json",
+	choices=formats,
+	default="json")
+parser.add_argument("--processes",
+	help="Number of inputs to convert concurrently.  " +
+		"Default: number of CPUs",
+	type=int,
+	default=os.cpu_count())
 
-	start = int(columns[0])
-	length = int(columns[1]) - start
-	gene_symbol = columns[2]
-	gene_type = columns[3]
+def get_organism(input_path):
+	'''Get organism slug from a file name, e.g. "homo-sapiens" from
+	"Homo_sapiens,_Ensembl_80.tsv" or "homo-sapiens.tsv"
+	'''
+	name = os.path.splitext(os.path.basename(input_path))[0]
+	return name.split(",")[0].lower().replace("_", "-")
 
-	annot = [
-		gene_symbol,
-		start,
-		length,
-		random.randint(1,7),
-		random.randint(1,5),
-	]
+def read_chrs(organism, bands_dir):
+	'''Get organism's chromosome names, in order, from Ideogram band data
+	'''
+	with open(bands_dir + organism + ".json") as f:
+		chr_bands = json.loads(f.read())["chrBands"]
+	chrs = []
+	for band in chr_bands:
+		chr = band.split(" ")[0]
+		if chr not in chrs:
+			chrs.append(chr)
+	return chrs
 
-	annots[chr]["annots"].append(annot)
+def get_track_key(header):
+	'''Get annotation key for a column, e.g. "gene-type" for "Gene type"'''
+	return header.strip().lower().replace(" ", "-")
 
-top_annots = {}
-top_annots["keys"] = ["name", "start", "length", "expression-level", "gene-type"]
-top_annots["annots"] = annots
-annots = json.dumps(top_annots)
+def find_column(headers, column, candidates=None):
+	'''Get index of a column given its header (any case) or 0-based index,
+	or of the first of several candidate headers
+	'''
+	lower_headers = [header.strip().lower() for header in headers]
+	if column is None:
+		for candidate in candidates:
+			if candidate in lower_headers:
+				return lower_headers.index(candidate)
+		raise ValueError(
+			"No column named any of " + ", ".join(candidates) +
+			" in headers: " + ", ".join(headers)
+		)
+	if column.isdigit():
+		return int(column)
+	if column.strip().lower() in lower_headers:
+		return lower_headers.index(column.strip().lower())
+	raise ValueError(
+		"No column named " + column + " in headers: " + ", ".join(headers)
+	)
 
-open("data/annotations/all_human_genes.json", "w").write(annots)
+def read_biomart(input_path):
+	'''Yield headers, then columns of each row, of a BioMart TSV file'''
+	with open(input_path) as f:
+		for line in f:
+			yield line.rstrip("\r\n").split("\t")
+
+def parse_number(value):
+	try:
+		return float(value)
+	except ValueError:
+		return None
+
+def get_numeric_ranges(input_path, column_indexes):
+	'''Get [min, max] of each numeric column, in an initial streaming pass'''
+	ranges = [[None, None] for i in column_indexes]
+	rows = read_biomart(input_path)
+	next(rows)
+	for columns in rows:
+		for i, column_index in enumerate(column_indexes):
+			value = parse_number(columns[column_index])
+			if value is None:
+				continue
+			lo, hi = ranges[i]
+			if lo is None or value < lo:
+				ranges[i][0] = value
+			if hi is None or value > hi:
+				ranges[i][1] = value
+	return ranges
+
+def get_bin(value, lo, hi, num_bins):
+	'''Get 0-based equal-width bin of value, or -1 if value is missing'''
+	value = parse_number(value)
+	if value is None:
+		return -1
+	if hi == lo:
+		return 0
+	return min(int((value - lo) / (hi - lo) * num_bins), num_bins - 1)
+
+def get_bin_edges(lo, hi, num_bins):
+	if lo is None:
+		return []
+	width = (hi - lo) / num_bins
+	return [lo + width * i for i in range(num_bins + 1)]
+
+def convert_biomart(
+	input_path, chrs, output_path, column_options=None,
+	category_columns=["Gene type"], numeric_columns=[], num_bins=5,
+	format="json", metadata=None
+):
+	'''Convert a BioMart TSV file into annotations, streaming it
+
+	Reads the file once, or twice if there are numeric columns to bin.
+
+	:return: [num_annots, num_skipped] list, where skipped rows are on
+	         sequences that aren't chromosomes, e.g. scaffolds
+	'''
+	if column_options is None:
+		column_options = {}
+
+	rows = read_biomart(input_path)
+	headers = next(rows, None)
+	if headers is None:
+		raise ValueError("Empty BioMart file: " + input_path)
+
+	indexes = {}
+	for key in default_columns:
+		indexes[key] = find_column(
+			headers, column_options.get(key), default_columns[key]
+		)
+	category_indexes = [find_column(headers, c) for c in category_columns]
+	numeric_indexes = [find_column(headers, c) for c in numeric_columns]
+
+	numeric_ranges = []
+	if len(numeric_indexes) > 0:
+		numeric_ranges = get_numeric_ranges(input_path, numeric_indexes)
+
+	# Dictionary-encode categories in order of first appearance
+	category_codes = [{} for i in category_indexes]
+
+	track_headers = (
+		[headers[i] for i in category_indexes] +
+		[headers[i] for i in numeric_indexes]
+	)
+	keys = ["name", "start", "length"] +\
+		[get_track_key(header) for header in track_headers]
+
+	chr_set = set(chrs)
+	num_skipped = 0
+
+	with AnnotsWriter(keys) as writer:
+		writer.add_chrs(chrs)
+
+		for columns in rows:
+			chr = columns[indexes["chr"]]
+			if chr not in chr_set:
+				# E.g. chrMT, alternate loci scaffolds
+				num_skipped += 1
+				continue
+
+			start = int(columns[indexes["start"]])
+			length = int(columns[indexes["end"]]) - start
+
+			annot = [columns[indexes["name"]], start, length]
+
+			for i, column_index in enumerate(category_indexes):
+				value = columns[column_index]
+				codes = category_codes[i]
+				if value not in codes:
+					codes[value] = len(codes)
+				annot.append(codes[value])
+
+			for i, column_index in enumerate(numeric_indexes):
+				lo, hi = numeric_ranges[i]
+				annot.append(get_bin(columns[column_index], lo, hi, num_bins))
+
+			writer.add(chr, annot)
+
+		if metadata is None:
+			metadata = {}
+		metadata["categories"] = {}
+		for i, column_index in enumerate(category_indexes):
+			key = get_track_key(headers[column_index])
+			metadata["categories"][key] = list(category_codes[i].keys())
+		metadata["bins"] = {}
+		for i, column_index in enumerate(numeric_indexes):
+			key = get_track_key(headers[column_index])
+			metadata["bins"][key] = get_bin_edges(*numeric_ranges[i], num_bins)
+		writer.metadata = metadata
+
+		writer.write(output_path, format)
+		num_annots = writer.num_annots
+
+	return [num_annots, num_skipped]
+
+def get_input_paths(inputs):
+	'''Expand input files and directories into a list of TSV files'''
+	input_paths = []
+	for input in inputs:
+		if os.path.isdir(input):
+			for leaf in sorted(os.listdir(input)):
+				if leaf[-4:] == ".tsv":
+					input_paths.append(os.path.join(input, leaf))
+		else:
+			input_paths.append(input)
+	return input_paths
+
+def convert_input(input_path, organism, args):
+	'''Convert one input, in a worker process
+
+	:return: [input_path, output_path, num_annots, num_skipped, error] list
+	'''
+	try:
+		if organism is None:
+			organism = get_organism(input_path)
+		chrs = read_chrs(organism, args.bands_dir)
+		output_path = get_annots_path(
+			args.output_dir + organism + "-genes", args.format
+		)
+		column_options = {
+			"chr": args.chr_column,
+			"start": args.start_column,
+			"end": args.end_column,
+			"name": args.name_column
+		}
+		num_annots, num_skipped = convert_biomart(
+			input_path, chrs, output_path, column_options,
+			args.category_columns, args.numeric_columns, args.num_bins,
+			args.format, {"organism": organism}
+		)
+		return [input_path, output_path, num_annots, num_skipped, None]
+	except Exception as e:
+		# E.g. missing bands, unknown columns, or rows with too few columns
+		return [input_path, None, 0, 0, repr(e)]
+
+def main():
+	args = parser.parse_args()
+
+	input_paths = get_input_paths(args.input)
+	if args.organism is not None and len(input_paths) > 1:
+		parser.error("--organism can only be used with a single input")
+
+	num_errors = 0
+	with ProcessPoolExecutor(max_workers=args.processes) as pool:
+		futures = [
+			pool.submit(convert_input, input_path, args.organism, args)
+			for input_path in input_paths
+		]
+		for future in futures:
+			input_path, output_path, num_annots, num_skipped, error =\
+				future.result()
+			if error is not None:
+				num_errors += 1
+				print("Error converting " + input_path + ": " + error)
+				continue
+			print(
+				"Converted " + str(num_annots) + " genes in " + input_path +
+				" to annotations in " + output_path + ", skipping " +
+				str(num_skipped) + " not on chromosomes"
+			)
+
+	if num_errors > 0:
+		raise SystemExit(
+			"Failed to convert " + str(num_errors) + " of " +
+			str(len(input_paths)) + " inputs"
+		)
+
+if __name__ == "__main__":
+	main()
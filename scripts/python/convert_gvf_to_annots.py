@@ -1,84 +1,205 @@
-''' Converts GVF data from dbVar to JSON-formatted annotations'''
-
-import re, json, random
-
-annots = []
-
-chrs = [
-    "1", "2", "3", "4", "5", "6", "7", "8", "9", "10",
-    "11", "12", "13", "14", "15", "16", "17", "18", "19", "20",
-    "21", "22", "X", "Y"
-]
-
-lengths_GRCh37 = {
-    "1": 249250621, "2": 243199373, "3": 198022430,
-    "4": 191154276, "5": 180915260, "6": 171115067,
-    "7": 159138663, "8": 146364022, "9": 141213431,
-    "10": 135534747, "11": 135006516, "12": 133851895,
-    "13": 115169878, "14": 107349540, "15": 102531392,
-    "16": 90354753, "17": 81195210, "18": 78077248,
-    "19": 59128983, "20": 63025520, "21": 48129895,
-    "22": 51304566, "X": 155270560, "Y": 59373566
+""" Converts GVF data from dbVar to JSON-formatted annotations
+
+Reads GVF in one streaming pass, so multi-GB dbVar germline GVFs (plain or
+gzipped) convert in bounded memory.  RefSeq sequence accessions in GVFs
+(e.g. NC_000001.11) are mapped to chromosome names (e.g. 1) via the NCBI
+assembly report for the GVF's assembly.
+
+Examples:
+
+    # Convert a dbVar GVF on GRCh38, e.g. from
+    # https://ftp.ncbi.nlm.nih.gov/pub/dbVar/data/Homo_sapiens/by_study/gvf/
+    python3 convert_gvf_to_annots.py --input estd214_1000_Genomes_Consortium_Phase_3.GRCh38.remap.all.germline.ucsc.gvf.gz
+
+    # Convert a GRCh37 GVF into columnar annotations
+    python3 convert_gvf_to_annots.py --input nstd186.GRCh37.variant_call.vcf.gvf --assembly GRCh37 --format columnar
+"""
+
+import argparse
+import gzip
+import os
+import re
+import urllib.request as request
+
+from annots_io import AnnotsWriter, formats, get_annots_path
+
+assembly_report_urls = {
+    "GRCh38": (
+        "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/405/" +
+        "GCF_000001405.40_GRCh38.p14/" +
+        "GCF_000001405.40_GRCh38.p14_assembly_report.txt"
+    ),
+    "GRCh37": (
+        "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/405/" +
+        "GCF_000001405.25_GRCh37.p13/" +
+        "GCF_000001405.25_GRCh37.p13_assembly_report.txt"
+    )
 }
 
-lengths_GRCh38 = {
-    "1": 248956422, "2": 242193529, "3": 198295559,
-    "4": 190214555, "5": 181538259, "6": 170805979,
-    "7": 159345973, "8": 145138636, "9": 138394717,
-    "10": 133797422, "11": 135086622, "12": 133275309,
-    "13": 114364328, "14": 107043718, "15": 101991189,
-    "16": 90338345,	"17": 83257441, "18": 80373285,
-    "19": 58617616, "20": 64444167, "21": 46709983,
-    "22": 50818468, "X": 156040895, "Y": 57227415
-}
-
-file_name = "../data/annotations/estd214_1000_Genomes_Consortium_Phase_3.GRCh38.remap.var.germline.gvf"
-file = open(file_name, "r").readlines()
-
-for chr in chrs:
-    annots.append({"chr": chr, "annots": []});
-
-for line in file[1:]:
-    if line[0] == "#":
-        continue
-
-    columns = line.strip().split("\t")
-
-    chr = columns[0]
-
-    # E.g. NC_000001.11 -> 1
-    # This RefSeq hack only works for human chromosomes 1-22
-    chr = str(int(chr.split(".")[0][-2:]))
-
-    if chr == "23":
-    	chr = "X"
-    elif chr == "24":
-    	chr = "Y"
-
-    if chr not in chrs:
-		# E.g. chrMT, alternate loci scaffolds
-        continue
-
-    name = ""
-    gff_attrs = columns[8].split(";")
-    for attr in gff_attrs:
-        tmp = attr.split("=")
-        if tmp[0] == "Name":
-            name = tmp[1]
-
-    start = int(columns[3])
-    stop = int(columns[4]) - start
-
-    annot = [
-        name,
-        start,
-        stop,
-        1 # placeholder for future use
-    ]
-
-    annots[chr]["annots"].append(annot)
-
-annots = json.dumps(annots)
-annots = '{"annots":' + annots + '}'
-
-open("../data/annotations/dbvar_estd214.var.json", "w").write(annots)
+name_re = re.compile(r"(?:^|;)Name=([^;]*)")
+
+parser = argparse.ArgumentParser(
+    description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--input",
+    help="Input GVF file, optionally gzipped",
+    default="../../data/annotations/estd214_1000_Genomes_Consortium_Phase_3.GRCh38.remap.var.germline.gvf")
+parser.add_argument("--output",
+    help="Output path, without extension.  " +
+         "Default: ../../data/annotations/dbvar_estd214.var",
+    default="../../data/annotations/dbvar_estd214.var")
+parser.add_argument("--assembly",
+    help="Genome assembly of input GVF: GRCh38 or GRCh37.  Default: GRCh38",
+    choices=list(assembly_report_urls.keys()),
+    default="GRCh38")
+parser.add_argument("--assembly_report",
+    help="Path to NCBI assembly report, e.g. for non-human GVFs.  " +
+         "Default: download report for --assembly")
+parser.add_argument("--cache_dir",
+    help="Directory to cache downloaded assembly reports in",
+    default="../../data/cache/")
+parser.add_argument("--format",
+    help="Output format: json, or columnar for int32 columns.  Default: json",
+    choices=formats,
+    default="json")
+parser.add_argument("--max_buffered",
+    help="Max annotations to hold in memory before spilling to disk",
+    type=int,
+    default=500000)
+
+def get_assembly_report(assembly, cache_dir):
+    """Get path to NCBI assembly report for assembly, downloading if needed
+    """
+    url = assembly_report_urls[assembly]
+    path = cache_dir + url.split("/")[-1]
+    if os.path.exists(path) == False:
+        if os.path.exists(cache_dir) == False:
+            os.makedirs(cache_dir)
+        with request.urlopen(url) as response:
+            data = response.read()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return path
+
+def read_chr_map(report_path):
+    """Map sequence accessions and names to chromosomes, per assembly report
+
+    Example assembly report row, with some columns omitted:
+    # Sequence-Name  Sequence-Role  Assigned-Molecule  Assigned-Molecule-Location/Type  GenBank-Accn  Relationship  RefSeq-Accn  ...  UCSC-style-name
+    1  assembled-molecule  1  Chromosome  CM000663.2  =  NC_000001.11  ...  chr1
+
+    Only chromosomes are mapped, so e.g. mitochondrial DNA, unplaced
+    scaffolds, and alternate loci are omitted.
+
+    :return: [chr_map, chrs] list, with dict of accessions and names to
+             chromosomes, and list of chromosomes in report order
+    """
+    chr_map = {}
+    chrs = []
+    with open(report_path) as f:
+        for line in f:
+            if line[0] == "#":
+                continue
+            columns = line.rstrip("\r\n").split("\t")
+            if columns[1] != "assembled-molecule" or columns[3] != "Chromosome":
+                continue
+            chr = columns[2]
+            chrs.append(chr)
+            # Sequence name, GenBank and RefSeq accessions, and UCSC name
+            for seq_id in [columns[0], columns[4], columns[6], columns[-1]]:
+                if seq_id not in ("", "na"):
+                    chr_map[seq_id] = chr
+    return [chr_map, chrs]
+
+def open_gvf(path):
+    """Open GVF, whether plain or gzipped, as text
+    """
+    with open(path, "rb") as f:
+        is_gzipped = f.read(2) == b"\x1f\x8b"
+    if is_gzipped:
+        return gzip.open(path, "rt")
+    return open(path)
+
+def read_gvf(path, chunk_size=1 << 20):
+    """Yield columns of each GVF feature, reading about chunk_size at a time
+    """
+    with open_gvf(path) as f:
+        while True:
+            lines = f.readlines(chunk_size)
+            if len(lines) == 0:
+                break
+            for line in lines:
+                if line[0] == "#":
+                    continue
+                yield line.rstrip("\r\n").split("\t")
+
+def get_gvf_name(attributes):
+    """Get value of the Name attribute in GVF column 9, e.g. "esv3575445"
+    """
+    match = name_re.search(attributes)
+    if match:
+        return match.group(1)
+    return ""
+
+def convert_gvf(
+    gvf_path, chr_map, chrs, output_path, format="json", max_buffered=500000
+):
+    """Convert GVF features into annotations, in one streaming pass
+
+    :return: [num_annots, num_skipped] list, where skipped features are on
+             sequences that aren't chromosomes, e.g. alternate loci
+    """
+    num_skipped = 0
+
+    keys = ["name", "start", "length", "trackIndex"]
+    with AnnotsWriter(keys, max_buffered=max_buffered) as writer:
+        writer.add_chrs(chrs)
+
+        for columns in read_gvf(gvf_path):
+            chr = chr_map.get(columns[0])
+            if chr is None:
+                # E.g. chrMT, alternate loci scaffolds
+                num_skipped += 1
+                continue
+
+            name = get_gvf_name(columns[8])
+            start = int(columns[3])
+            length = int(columns[4]) - start
+
+            annot = [
+                name,
+                start,
+                length,
+                1 # placeholder for future use
+            ]
+
+            writer.add(chr, annot)
+
+        writer.write(output_path, format)
+        num_annots = writer.num_annots
+
+    return [num_annots, num_skipped]
+
+def main():
+    args = parser.parse_args()
+
+    report_path = args.assembly_report
+    if report_path is None:
+        report_path = get_assembly_report(args.assembly, args.cache_dir)
+    chr_map, chrs = read_chr_map(report_path)
+
+    output_path = get_annots_path(args.output, args.format)
+    num_annots, num_skipped = convert_gvf(
+        args.input, chr_map, chrs, output_path, args.format, args.max_buffered
+    )
+
+    print(
+        "Converted " + str(num_annots) + " GVF features to annotations in " +
+        output_path + ", skipping " + str(num_skipped) +
+        " not on chromosomes"
+    )
+
+if __name__ == "__main__":
+    main()
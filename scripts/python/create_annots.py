@@ -12,6 +12,12 @@ Examples:
 
     # Create 90000 annots evenly distributed among 3 tracks
     python3 create_annots.py --num_annots 90000 --num_tracks 5
+
+    # Create 5 million annots clustered in hotspots, reproducibly
+    python3 create_annots.py --num_annots 5000000 --distribution clustered --seed 1
+
+    # Create 1 million annots where genes are dense, e.g. for benchmarks
+    python3 create_annots.py --num_annots 1000000 --distribution gene-density
 """
 
 # TODO:
@@ -25,9 +31,14 @@ Examples:
 
 
 import argparse
-import json
+import gzip
 import math
-import random
+
+import numpy as np
+
+from annots_io import (
+    write_annots, ColumnarWriter, formats, get_annots_path
+)
 
 parser = argparse.ArgumentParser(
     description=__doc__,
@@ -65,26 +76,42 @@ parser.add_argument('--density',
                       'where each feature has an annotation on only one track.'
                     ),
                     default='sparse')
-
-args = parser.parse_args()
-output_dir = args.output_dir
-num_annots = args.num_annots
-assembly = args.assembly
-num_tracks = args.num_tracks
-include_metadata = args.include_metadata
-track_annot_percents = args.track_annot_percents
-density = args.density
-
-track_index_pool = []
-if track_annot_percents is None:
-    track_annot_percents = []
-    for i in range(0, num_tracks):
-        track_annot_percents.append(math.ceil(100/num_tracks))
-
-for i, track_annot_percent in enumerate(track_annot_percents):
-    track_index_pool += [i]*track_annot_percent
-
-annots = []
+parser.add_argument('--distribution',
+                    help=(
+                      'How annotations are positioned.  "even" spaces them ' +
+                      'evenly across each chromosome.  "uniform" places ' +
+                      'them at random.  "clustered" groups them around ' +
+                      'random hotspots.  "gene-density" groups them ' +
+                      'around genes, so they are densest where genes are.  ' +
+                      'Default: even'
+                    ),
+                    choices=['even', 'uniform', 'clustered', 'gene-density'],
+                    default='even')
+parser.add_argument('--num_clusters',
+                    help='Number of hotspots per chromosome, for "clustered"',
+                    type=int,
+                    default=10)
+parser.add_argument('--cluster_width',
+                    help=(
+                      'Standard deviation, in base pairs, of positions ' +
+                      'around each hotspot or gene.  Default: 1000000'
+                    ),
+                    type=int,
+                    default=1000000)
+parser.add_argument('--genes_path',
+                    help='Ideogram gene cache, for "gene-density".  GRCh38.',
+                    default='../../dist/data/cache/genes/homo-sapiens-genes.tsv.gz')
+parser.add_argument('--format',
+                    help=(
+                      'Output format.  "columnar" writes int32 columns ' +
+                      'and a names table, for loading into typed arrays.  ' +
+                      'Default: json'
+                    ),
+                    choices=formats,
+                    default='json')
+parser.add_argument('--seed',
+                    help='Seed for random values, for reproducible output',
+                    type=int)
 
 alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
@@ -116,52 +143,157 @@ lengths_GRCh37 = {
     '22': 51304566, 'X': 155270560, 'Y': 59373566
 }
 
-if assembly == 'GRCh38':
-    chr_lengths = lengths_GRCh38
-else:
-    chr_lengths = lengths_GRCh37
+def get_track_index_pool(num_tracks, track_annot_percents):
+    """Get track indexes, each repeated by its percent of annotations
+    """
+    if track_annot_percents is None or len(track_annot_percents) == 0:
+        track_annot_percents = []
+        for i in range(0, num_tracks):
+            track_annot_percents.append(math.ceil(100/num_tracks))
 
-for chr in chrs:
-    annots.append({'chr': chr, 'annots': []})
+    track_index_pool = []
+    for i, track_annot_percent in enumerate(track_annot_percents):
+        track_index_pool += [i]*track_annot_percent
 
-for i in range(0, num_annots):
-    j = str(i + 1)
+    return np.array(track_index_pool)
 
-    chr = i % 24
-    chr_length = chr_lengths[chrs[chr]]
+def read_gene_starts(genes_path):
+    """Get start positions of genes in an Ideogram gene cache, by chromosome
+    """
+    gene_starts = {}
+    with gzip.open(genes_path, 'rt') as f:
+        for line in f:
+            if line[0] == '#':
+                continue
+            columns = line.split('\t', 2)
+            chr = columns[0]
+            if chr in gene_starts:
+                gene_starts[chr].append(int(columns[1]))
+            else:
+                gene_starts[chr] = [int(columns[1])]
 
-    # Distribute annotations evenly across this chromosome
-    start = int((i * chr_length)/num_annots + 1)
+    for chr in gene_starts:
+        gene_starts[chr] = np.array(gene_starts[chr])
+    return gene_starts
 
-    length = 0
+def get_even_starts(chr_index, chr_length, num_annots):
+    """Distribute annotations evenly across this chromosome
 
-    annot = [
-        'rs' + j,
-        start,
-        length
-    ]
+    As in earlier versions, the i-th annotation goes on chromosome i % 24.
+    Returns [annotation numbers, starts].
+    """
+    i = np.arange(chr_index, num_annots, len(chrs), dtype=np.int64)
+    starts = (i * chr_length) // num_annots + 1
+    return [i + 1, starts]
 
-    if density == 'sparse':
-        random_index = random.randrange(0, 99)
-        track_index = track_index_pool[random_index]
-        annot.append(track_index)
+def get_random_starts(
+    distribution, rng, count, chr_length, gene_starts=None,
+    num_clusters=10, cluster_width=1000000
+):
+    """Get sorted random starts on a chromosome, per the distribution
+    """
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    if distribution == 'uniform':
+        starts = rng.integers(1, chr_length + 1, size=count)
     else:
-        for k in range(0, num_tracks):
-            annot_value = random.randrange(0, 99)
-            annot.append(annot_value)
+        if distribution == 'clustered':
+            centers = rng.integers(1, chr_length + 1, size=num_clusters)
+        else:
+            centers = gene_starts
+        starts = centers[rng.integers(0, len(centers), size=count)]
+        starts = starts + rng.normal(0, cluster_width, size=count)
+        starts = np.clip(starts, 1, chr_length).astype(np.int64)
+    starts.sort()
+    return starts
+
+def generate_annots(
+    num_annots, chr_lengths, num_tracks, track_index_pool, density='sparse',
+    distribution='even', rng=None, gene_starts=None, num_clusters=10,
+    cluster_width=1000000
+):
+    """Generate annotation columns in bulk, one chromosome at a time
+
+    Yields [chr, numbers, starts, lengths, track_values] per chromosome.
+    Numbers are 1-based and unique, e.g. 6025 names "rs6025".  Track
+    values are a 1D array of track indexes for sparse annotations, and a
+    2D array of values per track for dense annotations.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
 
-    annots[chr]['annots'].append(annot)
+    if distribution != 'even':
+        # Spread annotations among chromosomes by length, or by gene count
+        if distribution == 'gene-density':
+            weights = [len(gene_starts.get(chr, [])) for chr in chrs]
+        else:
+            weights = [chr_lengths[chr] for chr in chrs]
+        weights = np.array(weights, dtype=np.float64)
+        chr_counts = rng.multinomial(num_annots, weights / weights.sum())
 
-if density == 'sparse':
-    track_keys = ['trackIndex']
-else:
+    offset = 0
+    for chr_index, chr in enumerate(chrs):
+        chr_length = chr_lengths[chr]
+
+        if distribution == 'even':
+            numbers, starts = get_even_starts(chr_index, chr_length, num_annots)
+        else:
+            count = chr_counts[chr_index]
+            chr_gene_starts = None
+            if distribution == 'gene-density':
+                chr_gene_starts = gene_starts.get(chr)
+            starts = get_random_starts(
+                distribution, rng, count, chr_length, chr_gene_starts,
+                num_clusters, cluster_width
+            )
+            numbers = np.arange(offset + 1, offset + count + 1)
+            offset += count
+
+        count = len(starts)
+        lengths = np.zeros(count, dtype=np.int64)
+
+        # randrange(0, 99) in earlier versions, i.e. 0 to 98
+        if density == 'sparse':
+            pool_indexes = rng.integers(0, 99, size=count)
+            track_values = track_index_pool[pool_indexes]
+        else:
+            track_values = rng.integers(0, 99, size=(count, num_tracks))
+
+        yield [chr, numbers, starts, lengths, track_values]
+
+def get_chr_rows(numbers, starts, lengths, track_values):
+    """Convert one chromosome's annotation columns into rows, for JSON
+    """
+    names = ['rs' + str(number) for number in numbers.tolist()]
+    track_values = track_values.tolist()
+    if track_values and not isinstance(track_values[0], list):
+        track_values = [[value] for value in track_values]
+    return [
+        [name, start, length] + values
+        for name, start, length, values
+        in zip(names, starts.tolist(), lengths.tolist(), track_values)
+    ]
+
+def get_chr_columns(numbers, starts, lengths, track_values):
+    """Get one chromosome's names and int columns, for columnar output
+    """
+    names = ['rs' + str(number) for number in numbers.tolist()]
+    if track_values.ndim == 1:
+        track_columns = [track_values]
+    else:
+        track_columns = list(track_values.T)
+    return [names, [starts, lengths] + track_columns]
+
+def get_track_keys(density, num_tracks):
+    if density == 'sparse':
+        return ['trackIndex']
     track_keys = []
     for i in range(0, num_tracks):
         track_keys.append('track_' + str(i + 1))
+    return track_keys
 
-top_annots = {}
-if include_metadata:
-    top_annots['metadata'] = {
+def get_metadata(assembly, num_tracks, num_annots):
+    metadata = {
         'species': 'human',
         'assembly': assembly,
         'numTracks': num_tracks,
@@ -170,19 +302,69 @@ if include_metadata:
     trackLabels = []
     for i in range(num_tracks):
         trackLabels.append('Sample ' + alphabet[i])
-    top_annots['metadata']['trackLabels'] = trackLabels
-top_annots['keys'] = ['name', 'start', 'length'] + track_keys
-top_annots['annots'] = annots
+    metadata['trackLabels'] = trackLabels
+    return metadata
 
-annots = json.dumps(top_annots)
+def main():
+    args = parser.parse_args()
+    output_dir = args.output_dir
+    num_annots = args.num_annots
+    assembly = args.assembly
+    num_tracks = args.num_tracks
+    density = args.density
+    distribution = args.distribution
 
-num_annots = str(num_annots)
-output_path = output_dir + num_annots + '_virtual_snvs.json'
+    if assembly == 'GRCh38':
+        chr_lengths = lengths_GRCh38
+    else:
+        chr_lengths = lengths_GRCh37
 
-open(output_path, 'w').write(annots)
-print(
-    'Output ' + num_annots + ' ' + density + ' annotations ' +
-    'on ' + str(num_tracks) + ' tracks ' +
-    'on assembly ' + assembly + ' ' +
-    'to ' + output_path
-)
+    gene_starts = None
+    if distribution == 'gene-density':
+        gene_starts = read_gene_starts(args.genes_path)
+
+    track_index_pool =\
+        get_track_index_pool(num_tracks, args.track_annot_percents)
+
+    annots_by_chr = generate_annots(
+        num_annots, chr_lengths, num_tracks, track_index_pool, density,
+        distribution, np.random.default_rng(args.seed), gene_starts,
+        args.num_clusters, args.cluster_width
+    )
+
+    metadata = None
+    if args.include_metadata:
+        metadata = get_metadata(assembly, num_tracks, num_annots)
+    keys = ['name', 'start', 'length'] + get_track_keys(density, num_tracks)
+
+    num_annots = str(num_annots)
+    leaf = num_annots + '_virtual_snvs'
+    if distribution != 'even':
+        leaf = num_annots + '_' + distribution + '_virtual_snvs'
+    output_path = get_annots_path(output_dir + leaf, args.format)
+
+    if args.format == 'columnar':
+        # Write NumPy columns as-is, without converting them into rows
+        with ColumnarWriter(output_path, keys, metadata) as writer:
+            for [chr, *columns] in annots_by_chr:
+                writer.add_columns(chr, *get_chr_columns(*columns))
+    else:
+        write_annots(
+            output_path,
+            keys,
+            (
+                [chr, get_chr_rows(*columns)]
+                for [chr, *columns] in annots_by_chr
+            ),
+            metadata
+        )
+
+    print(
+        'Output ' + num_annots + ' ' + density + ' annotations ' +
+        'on ' + str(num_tracks) + ' tracks ' +
+        'on assembly ' + assembly + ' ' +
+        'to ' + output_path
+    )
+
+if __name__ == '__main__':
+    main()
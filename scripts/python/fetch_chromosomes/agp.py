@@ -0,0 +1,92 @@
+"""Streaming download and parsing of AGP (A Golden Path) files
+"""
+
+import codecs
+import zlib
+
+class AgpParser:
+    """Incrementally parses AGP text into a chromosome object, in one pass
+
+    Only the accession, centromere, and final length are kept, so memory
+    stays constant however large the AGP is, e.g. for heavily scaffolded
+    wheat or axolotl chromosomes.
+    """
+
+    def __init__(self):
+        self.chr = {}
+        self.has_centromere = False
+        self.partial_line = ''
+
+    def feed(self, text):
+        lines = (self.partial_line + text).split('\n')
+        self.partial_line = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def parse_line(self, line):
+        if len(line) == 0 or line[0] == '#':
+            return
+        if 'centromere' in line:
+            self.has_centromere = True
+        tabs = line.split("\t")
+        acc = tabs[0]
+        start = int(tabs[1])
+        stop = int(tabs[2])
+        comp_type = tabs[6]
+        chr = self.chr
+        if 'accession' not in chr:
+            chr['accession'] = acc
+            chr['type'] = 'nuclear'
+        if comp_type == 'centromere':
+            chr['centromere'] = {
+                'start': start,
+                'length': stop - start
+            }
+        # Object end of the last line is the chromosome length
+        chr['length'] = stop
+
+    def close(self):
+        self.parse_line(self.partial_line)
+        self.partial_line = ''
+        return self.chr
+
+
+def get_chromosome_object(agp):
+    """Extracts centromere coordinates and chromosome length from AGP data,
+    and returns a chromosome object formatted in JSON"""
+    parser = AgpParser()
+    parser.feed(agp)
+    return parser.close()
+
+
+def stream_gzipped_ftp(ftp, file_name, handle_text):
+    """Downloads gzipped FTP data, passing decompressed text to `handle_text`
+    chunk by chunk as it arrives, without buffering the whole file
+
+    Raises EOFError if the download ends partway through a gzip member, as
+    GzipFile does, so the FTP pool retries rather than accepting partial data.
+    """
+    # 16 + MAX_WBITS: expect gzip header and trailer
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    in_member = False
+
+    def handle_binary(data):
+        nonlocal decompressor, in_member
+        while len(data) > 0:
+            in_member = True
+            handle_text(decoder.decode(decompressor.decompress(data)))
+            data = b''
+            if decompressor.eof:
+                # Start next member, if any, of a multi-member gzip file
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                in_member = False
+
+    ftp.retrbinary('RETR ' + file_name, callback=handle_binary)
+    if in_member:
+        raise EOFError(
+            'Compressed file ended before the end-of-stream marker was ' +
+            'reached: ' + file_name
+        )
+    handle_text(decoder.decode(b'', final=True))
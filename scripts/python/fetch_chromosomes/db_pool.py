@@ -0,0 +1,208 @@
+"""Reusable, bounded pools of MySQL connections, with timeouts and retries
+
+UCSC and Ensembl Genomes host hundreds of assembly databases per MySQL
+server.  Rather than each worker thread opening its own connection and
+walking databases with `USE db` and `SHOW TABLES`, workers borrow pooled
+connections and run fully-qualified queries (e.g. `SELECT * FROM
+hg38.cytoBandIdeo`), and `get_dbs_with_table` finds which databases have
+a table of interest in one `information_schema` round-trip.
+"""
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+from . import settings
+from .utils import db_connect
+
+logger = settings.get_logger('db_pool')
+
+# Defaults for new pools; see `configure`
+pool_size = 8
+timeout = 60
+retries = 3
+
+# Errors worth reconnecting and retrying for, e.g. dropped connections and
+# timeouts.  Errors in SQL itself (pymysql.err.ProgrammingError) are not,
+# nor are other OSErrors, e.g. FileNotFoundError for a query missing from
+# the cache in replay mode, which should fail at once.
+transient_errors = (
+    pymysql.err.OperationalError, pymysql.err.InterfaceError,
+    ConnectionError, socket.timeout
+)
+
+class DbPool:
+    """Pool of MySQL connections to one host
+
+    At most `max_connections` connections are open at once, so concurrent
+    callers share the host politely.  Idle connections are pinged before
+    reuse, and broken ones are transparently replaced.  Query latency is
+    tallied per pool, i.e. per host.
+
+    Example:
+        pool = get_db_pool('genome-mysql.soe.ucsc.edu', user='genome')
+        rows = pool.query('SELECT name FROM hgcentral.dbDb')
+    """
+
+    def __init__(
+        self, host, user='anonymous', port=None,
+        max_connections=8, retries=3, timeout=60
+    ):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.max_connections = max_connections
+        self.retries = retries
+        self.timeout = timeout
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.num_queries = 0
+        self.total_ms = 0
+        self.max_ms = 0
+
+    def connect(self):
+        return db_connect(
+            self.host, user=self.user, port=self.port, timeout=self.timeout
+        )
+
+    def is_healthy(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Borrow a healthy connection; return it to the pool when done
+        """
+        with self.semaphore:
+            connection = None
+            with self.lock:
+                if len(self.idle) > 0:
+                    connection = self.idle.pop()
+            if connection is not None and not self.is_healthy(connection):
+                self.discard(connection)
+                connection = None
+            if connection is None:
+                connection = self.connect()
+
+            try:
+                yield connection
+            except Exception:
+                # State of a connection that raised is unknown, so drop it
+                self.discard(connection)
+                raise
+            with self.lock:
+                self.idle.append(connection)
+
+    def record_latency(self, ms):
+        with self.lock:
+            self.num_queries += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def query(self, sql):
+        """Run `sql` on a pooled connection and return all rows, retrying on
+        transient errors with a fresh connection each time
+        """
+        for attempt in range(1, self.retries + 1):
+            t0 = time.time()
+            try:
+                with self.connection() as connection:
+                    cursor = connection.cursor()
+                    cursor.execute(sql)
+                    rows = cursor.fetchall()
+                    cursor.close()
+                self.record_latency((time.time() - t0) * 1000)
+                return rows
+            except transient_errors as e:
+                if attempt == self.retries:
+                    raise
+                delay = 2 ** (attempt - 1)
+                logger.warning(
+                    f'Caught MySQL error on {self.host} ' +
+                    f'({type(e).__name__}: {e}); ' +
+                    f'reconnecting and retrying in {delay} s ' +
+                    f'(attempt {attempt} of {self.retries})'
+                )
+                time.sleep(delay)
+
+    def latency_summary(self):
+        with self.lock:
+            if self.num_queries == 0:
+                return f'{self.host}: 0 queries'
+            mean = round(self.total_ms / self.num_queries)
+            return (
+                f'{self.host}: {self.num_queries} queries, ' +
+                f'mean {mean} ms, max {round(self.max_ms)} ms'
+            )
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for connection in idle:
+            self.discard(connection)
+
+pools = {}
+pools_lock = threading.Lock()
+
+def configure(_pool_size=None, _timeout=None, _retries=None):
+    """Set pool size, per-query timeout (seconds), and retries for new pools
+    """
+    global pool_size, timeout, retries
+    if _pool_size is not None:
+        pool_size = _pool_size
+    if _timeout is not None:
+        timeout = _timeout
+    if _retries is not None:
+        retries = _retries
+
+def get_db_pool(host, user='anonymous', port=None):
+    """Get the process-wide connection pool for a MySQL host"""
+    with pools_lock:
+        if host not in pools:
+            pools[host] = DbPool(
+                host, user=user, port=port,
+                max_connections=pool_size, retries=retries, timeout=timeout
+            )
+        return pools[host]
+
+def close_pools():
+    """Close and forget all MySQL pools, e.g. before forking workers
+
+    Forked processes would otherwise inherit open sockets and lock state.
+    Pools requested afterwards start fresh.
+    """
+    with pools_lock:
+        closing = list(pools.values())
+        pools.clear()
+    for pool in closing:
+        pool.close()
+
+def get_dbs_with_table(pool, table, nonempty=False):
+    """Get names of all databases on a host that have the given table
+
+    If `nonempty`, only include databases where the table has rows.  Row
+    counts come from table statistics, which are exact for MyISAM tables as
+    used by UCSC and Ensembl.
+    """
+    sql = (
+        'SELECT TABLE_SCHEMA FROM information_schema.TABLES ' +
+        f'WHERE TABLE_NAME = "{table}"'
+    )
+    if nonempty:
+        sql += ' AND TABLE_ROWS > 0'
+    rows = pool.query(sql)
+    return set([row[0] for row in rows])
@@ -2,47 +2,45 @@ from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 from .utils import *
+from .db_pool import get_db_pool, get_dbs_with_table
 
-def get_ensembl_cursor():
-    connection = db_connect(
-        host='mysql-eg-publicsql.ebi.ac.uk',
+def get_ensembl_pool():
+    return get_db_pool(
+        'mysql-eg-publicsql.ebi.ac.uk',
         user='anonymous',
         port=4157
     )
-    cursor = connection.cursor()
-    return cursor
 
-def get_ensembl_chr_ids(cursor, db):
+def get_ensembl_chr_ids(pool, db):
     """Get a map of Ensembl seq_region_ids to familiar chromosome names.
     Helper function for query_ensembl_karyotype_db.
 
-    :param cursor: Cursor connected to Ensembl Genomes DB of interest
+    :param pool: Connection pool for the Ensembl Genomes MySQL server
+    :param db: Ensembl Genomes DB of interest
     :return: chr_id: Dictionary mapping seq_region_id to chromosome names
     """
 
     chr_ids = {}
     logger.info(f'Started get_ensembl_chr_ids, db: {db}')
-    cursor.execute('''
-      SELECT coord_system_id FROM coord_system
+    fetched = pool.query(f'''
+      SELECT coord_system_id FROM {db}.coord_system
       WHERE name="chromosome" AND attrib="default_version"
     ''')
-    fetched = cursor.fetchall()
     if len(fetched) == 0:
         return None
     coord_system_id = str(fetched[0][0])
-    cursor.execute(
-        'SELECT name, seq_region_id FROM seq_region ' +
+    rows = pool.query(
+        f'SELECT name, seq_region_id FROM {db}.seq_region ' +
         'WHERE coord_system_id = ' + coord_system_id
     )
-    rows = cursor.fetchall()
     for row in rows:
         chr, seq_region_id = row
         chr_ids[seq_region_id] = chr
 
     return chr_ids
 
-def get_ensembl_asm_data(cursor, rows, db):
-    chr_ids = get_ensembl_chr_ids(cursor, db)
+def get_ensembl_asm_data(pool, rows, db):
+    chr_ids = get_ensembl_chr_ids(pool, db)
     if chr_ids == None:
         return None
 
@@ -55,60 +53,47 @@ def get_ensembl_asm_data(cursor, rows, db):
             bands_by_chr, chr, band_name, start, stop, stain
         )
 
-    cursor.execute('''
-        SELECT meta_value FROM meta
+    genbank_accession = pool.query(f'''
+        SELECT meta_value FROM {db}.meta
         where meta_key = "assembly.accession"
-    ''')
-    genbank_accession = cursor.fetchone()[0]
+    ''')[0][0]
 
     asm_data = [genbank_accession, db, bands_by_chr]
 
     return asm_data
 
-def query_ensembl_karyotype_db(db_tuples_list):
-    """Query for karyotype data in Ensembl Genomes.
+def query_ensembl_karyotype_db(db_tuple, pool):
+    """Query for karyotype data in an Ensembl Genomes DB.
     This function is launched many times simultaneously in a thread pool.
 
-    :param db_tuples_list: List of (db, name_slug) tuples
-    :return: List of [name_slug, asm_data] lists
+    :param db_tuple: (db, name_slug) tuple
+    :param pool: Connection pool for the Ensembl Genomes MySQL server
+    :return: [name_slug, asm_data] list, or None if DB has no cytobands
     """
-    cursor = get_ensembl_cursor()
-    pq_results = []
-
-    logger.info(
-        'Connected to Ensembl Genomes MySQL server, ' +
-        f'querying for karyotypes in {len(db_tuples_list)} databases'
-    )
-
-    for db_tuple in db_tuples_list:
-        db, name_slug = db_tuple
-        # Example for debugging: "USE zea_mays_core_35_88_7;"
-        cursor.execute('USE ' + db)
-        # Schema: https://www.ensembl.org/info/docs/api/core/core_schema.html#karyotype
-        # | karyotype_id | seq_region_id | seq_region_start | seq_region_end | band | stain |
-        cursor.execute('SELECT * FROM karyotype')
-        rows = cursor.fetchall()
-        # Omit assemblies that don't have cytoband data
-        if len(rows) == 0:
-            continue
-        asm_data = get_ensembl_asm_data(cursor, rows, db)
+    db, name_slug = db_tuple
+    # Example for debugging: "SELECT * FROM zea_mays_core_35_88_7.karyotype;"
+    # Schema: https://www.ensembl.org/info/docs/api/core/core_schema.html#karyotype
+    # | karyotype_id | seq_region_id | seq_region_start | seq_region_end | band | stain |
+    rows = pool.query(f'SELECT * FROM {db}.karyotype')
+    # Omit assemblies that don't have cytoband data
+    if len(rows) == 0:
+        return None
+    asm_data = get_ensembl_asm_data(pool, rows, db)
 
-        # Omit cases that lack needed assembly data
-        if asm_data == None:
-            msg = f'Lacks needed assembly data for db "{db}", name_slug "{name_slug}"'
-            logger.info(msg)
-            asm_data = ['', '', {}]
-        pq_results.append([name_slug, asm_data])
+    # Omit cases that lack needed assembly data
+    if asm_data == None:
+        msg = f'Lacks needed assembly data for db "{db}", name_slug "{name_slug}"'
+        logger.info(msg)
+        asm_data = ['', '', {}]
 
-    return pq_results
+    return [name_slug, asm_data]
 
-def query_db_tuples(cursor):
+def query_db_tuples(pool):
     """Get a list of databases we want to query for karyotype data
     """
     db_map = {}
 
-    cursor.execute('show databases like "%core_%"')
-    for row in cursor.fetchall():
+    for row in pool.query('show databases like "%core_%"'):
         db = row[0]
         if 'collection' in db:
             continue
@@ -121,20 +106,31 @@ def query_db_tuples(cursor):
 def pool_fetch_org_map(db_tuples):
     org_map = {}
 
-    # Take the list of DBs we want to query for karyotype data,
-    # split it into 100 smaller lists,
-    # then launch a new thread for each of those small new DB lists
-    # to divide up the work of querying remote DBs.
-    num_threads = 100
-    db_tuples_lists = chunkify(db_tuples, num_threads)
-    with ThreadPoolExecutor(max_workers=num_threads) as pool:
-        for result in pool.map(query_ensembl_karyotype_db, db_tuples_lists):
-            for db_tuple in result:
-                name_slug, asm_data = db_tuple
-                if name_slug in org_map:
-                    org_map[name_slug].append(asm_data)
-                else:
-                    org_map[name_slug] = [asm_data]
+    pool = get_ensembl_pool()
+
+    # Find all DBs with a non-empty karyotype table in one round-trip, then
+    # query only those DBs, concurrently over pooled connections
+    karyotype_dbs = get_dbs_with_table(pool, 'karyotype', nonempty=True)
+    db_tuples = [
+        db_tuple for db_tuple in db_tuples if db_tuple[0] in karyotype_dbs
+    ]
+    logger.info(
+        f'Querying karyotypes in {len(db_tuples)} Ensembl Genomes DBs'
+    )
+
+    num_threads = pool.max_connections
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = executor.map(
+            partial(query_ensembl_karyotype_db, pool=pool), db_tuples
+        )
+        for result in results:
+            if result is None:
+                continue
+            name_slug, asm_data = result
+            if name_slug in org_map:
+                org_map[name_slug].append(asm_data)
+            else:
+                org_map[name_slug] = [asm_data]
 
     return org_map
 
@@ -150,17 +146,14 @@ def fetch_from_ensembl_genomes(times_obj, logger_obj):
     t0 = time_ms()
     logger.info('Entering fetch_from_ensembl_genomes')
 
-    cursor = get_ensembl_cursor()
-
-    db_tuples = query_db_tuples(cursor)
+    pool = get_ensembl_pool()
 
-    cursor.close()
+    db_tuples = query_db_tuples(pool)
 
     logger.info('In ensembly.py, db_tuples:')
     logger.info(db_tuples)
     org_map = pool_fetch_org_map(db_tuples)
-
-    logger.info('before exiting with clause')
+    logger.info('MySQL latency: ' + pool.latency_summary())
 
     times['ensembl'] += time_ms() - t0
     return [org_map, times]
@@ -0,0 +1,170 @@
+"""Rate-limited, process-wide access to NCBI E-utilities (EUtils)
+
+NCBI allows 3 EUtils requests per second per client, or 10 per second with an
+API key.  Rather than sleeping a fixed time after each call, all EUtils traffic
+in this process shares one thread-safe token bucket sized to that limit.  HTTP
+429 responses pause the bucket for any Retry-After period, and request
+latencies are tallied in a histogram for logging.
+
+Docs: https://www.ncbi.nlm.nih.gov/books/NBK25497/#chapter2.Usage_Guidelines_and_Requiremen
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from . import settings
+
+logger = settings.get_logger('eutils')
+
+eutils_base = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+
+# Requests per second allowed by NCBI, by whether an API key is used
+unkeyed_rate = 3
+keyed_rate = 10
+
+api_key = os.environ.get('NCBI_API_KEY', '7e33ac6a08a6955ec3b83d214d22b21a2808')
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `acquire` blocks until a request may be sent
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.updated
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(
+                    self.paused_until - now, (1 - self.tokens) / self.rate
+                )
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop all requests for `seconds`, e.g. per a Retry-After header"""
+        with self.lock:
+            self.paused_until = max(
+                self.paused_until, time.monotonic() + seconds
+            )
+            self.tokens = 0
+
+
+class LatencyHistogram:
+    """Thread-safe tally of request latencies, in millisecond buckets
+    """
+
+    bounds = [100, 250, 500, 1000, 2000, 5000, 10000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total_ms = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        i = 0
+        while i < len(self.bounds) and ms > self.bounds[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.total_ms += ms
+
+    def summary(self):
+        with self.lock:
+            num = sum(self.counts)
+            if num == 0:
+                return 'EUtils requests: 0'
+            labels = [f'<={b} ms' for b in self.bounds] + [f'>{self.bounds[-1]} ms']
+            buckets = ', '.join([
+                f'{label}: {count}' for label, count in zip(labels, self.counts)
+            ])
+            mean = round(self.total_ms / num)
+            return f'EUtils requests: {num}, mean {mean} ms; {buckets}'
+
+
+limiter = TokenBucket(keyed_rate if api_key else unkeyed_rate)
+latencies = LatencyHistogram()
+
+
+def configure(key=None, rate=None):
+    """Set API key and rate limit for all EUtils requests in this process
+
+    Without an explicit rate, the rate is NCBI's limit for keyed or unkeyed
+    clients.
+    """
+    global api_key, limiter
+    api_key = key
+    if rate is None:
+        rate = keyed_rate if api_key else unkeyed_rate
+    limiter = TokenBucket(rate)
+
+
+def get_eutils_urls():
+    key_param = '' if not api_key else '&api_key=' + api_key
+
+    esearch = eutils_base + 'esearch.fcgi?retmode=json' + key_param
+    esummary = eutils_base + 'esummary.fcgi?retmode=json' + key_param
+    elink = eutils_base + 'elink.fcgi?retmode=json' + key_param
+
+    return {
+        'elink': elink,
+        'esummary': esummary,
+        'esearch': esearch
+    }
+
+
+def open_url(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read().decode('utf-8')
+
+
+def get_retry_after(e, attempt):
+    """Get seconds to wait before retrying, per HTTP error or attempt number"""
+    retry_after = e.headers.get('Retry-After') if e.headers else None
+    if retry_after is not None and retry_after.isdigit():
+        return int(retry_after)
+    return 2 ** attempt
+
+
+def request(url, opener=open_url, max_retries=5):
+    """Send a rate-limited EUtils request, return response body as text
+
+    `opener` does the actual transfer; e.g. `utils.request` adds caching.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        t0 = time.monotonic()
+        try:
+            return opener(url)
+        except urllib.error.HTTPError as e:
+            if e.code not in (429, 503) or attempt == max_retries:
+                raise
+            wait = get_retry_after(e, attempt)
+            logger.warning(
+                f'EUtils returned HTTP {e.code}; pausing {wait} s before ' +
+                f'retry {attempt + 1} of {max_retries} for {url}'
+            )
+            limiter.pause(wait)
+        finally:
+            latencies.record(time.monotonic() - t0)
+
+
+def fetch_json(url, opener=open_url):
+    """Send a rate-limited EUtils request, return parsed JSON response"""
+    return json.loads(request(url, opener=opener))
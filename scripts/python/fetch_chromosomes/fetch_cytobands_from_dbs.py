@@ -6,7 +6,8 @@
 
 import os
 import json
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 import argparse
 
 from . import settings
@@ -17,14 +18,36 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--output_dir',
     help='Directory to send output data to',
     default='../../data/bands/native/')
-# parser.add_argument('--fresh_run',
-#     help='Do you want to use cached data, or fresh data fetched over ' +
-#          'the Internet?',
-#     default='True')
-# parser.add_argument('--fill_cache',
-#     help='Do you want to populate the cache?  Only applicable for fresh runs.',
-#     default='False')
-args = parser.parse_args()
+parser.add_argument('--db_pool_size',
+    help='Max concurrent MySQL connections per host',
+    type=int,
+    default=8)
+parser.add_argument('--db_timeout',
+    help='Seconds to wait for a MySQL connection or query result',
+    type=int,
+    default=60)
+parser.add_argument('--processes',
+    help='Number of processes for refining and writing bands.  ' +
+         '(default: number of CPUs)',
+    type=int,
+    default=os.cpu_count())
+parser.add_argument('--fresh_run',
+    help='Do you want to use cached data, or fresh data fetched over ' +
+         'the Internet?',
+    default='True')
+parser.add_argument('--fill_cache',
+    help='Do you want to populate the cache?  Only applicable for fresh runs.',
+    default='False')
+parser.add_argument('--record',
+    metavar='FIXTURE_DIR',
+    help='Record all HTTP, MySQL and Genomaize data from a full run ' +
+         'into this directory, for later replay')
+parser.add_argument('--replay',
+    metavar='FIXTURE_DIR',
+    help='Replay a run recorded via --record.  Needs no Internet.')
+
+# Tolerate arguments for scripts that import this module, e.g. get_chromosomes
+args = parser.parse_known_args()[0]
 
 def t_or_f(arg):
     ua = str(arg).upper()
@@ -35,15 +58,21 @@ def t_or_f(arg):
     else:
         pass  #error condition maybe?
 
-# eweitz, 2017-12-01:
-# The arguments '--fresh_run=False and --fresh_run=False' do not yet work.
-# The code related to these arguments is a work in progress.
-# They are intended to speed up development by enabling runs to
-# bypass remote querying and download.
-fresh_run = True # t_or_f(args.fresh_run)
-fill_cache = False #t_or_f(args.fill_cache)
+# --record and --replay are shorthands for caching scenarios A and D (below),
+# with the cache in a versioned fixture directory.  Replays are
+# deterministic, so band processing (e.g. refine_bands) can be profiled and
+# regression-tested in seconds, offline.
+fresh_run = t_or_f(args.fresh_run)
+fill_cache = t_or_f(args.fill_cache)
 output_dir = args.output_dir
 cache_dir = output_dir + 'cache/'
+if args.record:
+    fresh_run, fill_cache = True, True
+    cache_dir = os.path.join(args.record, '')
+elif args.replay:
+    fresh_run, fill_cache = False, False
+    cache_dir = os.path.join(args.replay, '')
+
 log_name = 'fetch_cytobands_from_dbs'
 
 from . import settings
@@ -54,6 +83,10 @@ from .ucsc import *
 from .ensembl import *
 from .genomaize import *
 from .centromeres import *
+from . import db_pool
+from . import ftp_pool
+
+db_pool.configure(args.db_pool_size, args.db_timeout)
 
 times = {'ncbi': 0, 'ucsc': 0, 'ensembl': 0}
 unfound_dbs = []
@@ -84,13 +117,16 @@ if fresh_run is False and fill_cache:
 
 if os.path.exists(cache_dir) is False:
     if fill_cache:
-        os.mkdir(cache_dir)
+        os.makedirs(cache_dir)
     if fresh_run is False:
         raise ValueError(
             'No cache available.  ' +
             'Run with "--fresh_run=True --fill_cache=True" then try again.'
         )
 
+if args.replay:
+    check_fixture_manifest(cache_dir)
+
 def patch_telomeres(bands_by_chr):
     """Account for special case with Drosophila melanogaster
 
@@ -215,6 +251,56 @@ def write_chr_bands(org, nr_org_map, maize_centromeres):
 
     return [genbank_accession, db]
 
+def refine_and_write(org, asm_data_list, maize_centromeres):
+    """ Refine and write bands for one organism, in a worker process
+    """
+    t0 = time_ms()
+    entry = write_chr_bands(org, {org: asm_data_list}, maize_centromeres)
+    return [org, entry, time_ms() - t0]
+
+def get_mp_context():
+    """ Prefer forking workers, which inherit logging and module state
+    without re-running this module's setup, e.g. creating directories.
+    Parsed arguments are available either way, as they're parsed on import.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+def pool_write_chr_bands(nr_org_map, maize_centromeres):
+    """ Refine and write bands for all organisms across CPU cores
+
+    Returns manifest entries in the same order as `nr_org_map`,
+    regardless of which worker finishes first.
+    """
+    manifest = {}
+    t0 = time_ms()
+
+    # Workers don't query databases, and mustn't inherit open connections
+    db_pool.close_pools()
+    ftp_pool.close_pools()
+
+    with ProcessPoolExecutor(
+        max_workers=args.processes, mp_context=get_mp_context()
+    ) as pool:
+        futures = [
+            pool.submit(refine_and_write, org, nr_org_map[org], maize_centromeres)
+            for org in nr_org_map
+        ]
+        for future in futures:
+            org, entry, org_time = future.result()
+            logger.info(
+                f'Refined and wrote bands for {org} in {org_time} ms: {entry}'
+            )
+            manifest[org] = entry
+
+    logger.info(
+        f'Refined and wrote bands for {len(manifest)} organisms ' +
+        f'in {time_ms() - t0} ms, across {args.processes} processes'
+    )
+
+    return manifest
+
 def fetch_parties():
     """ Request cytoband data from all relevant institutes, simultaneously
     """
@@ -249,18 +335,19 @@ def main():
 
     logger.info('In fetch_cytobands_from_dbs, list(nr_org_map.keys()):')
     logger.info(str(list(nr_org_map.keys())))
-    manifest = {}
 
-    for org in nr_org_map:
-        entry = write_chr_bands(org, nr_org_map, maize_centromeres)
-        logger.info('In fetch_cytobands_from_dbs. org, entry:')
-        logger.info(org)
-        logger.info(entry)
-        manifest[org] = entry
+    manifest = pool_write_chr_bands(nr_org_map, maize_centromeres)
 
     logger.info('In fetch_cytobands_from_dbs, manifest: ')
     logger.info(manifest)
 
+    if fresh_run is False or fill_cache:
+        logger.info('SQL result cache stats: ' + str(query_cache.get_stats()))
+
+    if args.record:
+        write_fixture_manifest(cache_dir)
+        logger.info('Recorded fixtures in ' + cache_dir)
+
     return manifest
 
 if __name__ == '__main__':
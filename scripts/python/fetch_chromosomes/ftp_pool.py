@@ -0,0 +1,133 @@
+"""Reusable, bounded pools of FTP connections, with health checks and retries
+"""
+
+import ftplib
+import threading
+import time
+from contextlib import contextmanager
+
+from . import settings
+
+logger = settings.get_logger('ftp_pool')
+
+# Errors worth reconnecting and retrying for, e.g. dropped control
+# connections, timeouts, and "425 EPSV: Address already in use".
+# Permanent errors like "550 No such file" (ftplib.error_perm) are not retried.
+transient_errors = (
+    ftplib.error_temp, ftplib.error_reply, EOFError, OSError
+)
+
+class FtpPool:
+    """Pool of logged-in FTP connections to one host
+
+    At most `max_connections` connections are open at once, so concurrent
+    callers share the host politely.  Idle connections are health-checked
+    before reuse, and broken ones are transparently replaced.
+
+    Example:
+        pool = get_ftp_pool('ftp.ncbi.nlm.nih.gov')
+        names = pool.run(lambda ftp: ftp.nlst('/genomes/all/'))
+    """
+
+    def __init__(self, host, max_connections=8, retries=3, timeout=60):
+        self.host = host
+        self.retries = retries
+        self.timeout = timeout
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def connect(self):
+        ftp = ftplib.FTP(self.host, timeout=self.timeout)
+        ftp.login()
+        return ftp
+
+    def is_healthy(self, ftp):
+        try:
+            ftp.voidcmd('NOOP')
+            return True
+        except Exception:
+            return False
+
+    def discard(self, ftp):
+        try:
+            ftp.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Borrow a healthy connection; return it to the pool when done
+        """
+        with self.semaphore:
+            ftp = None
+            with self.lock:
+                if len(self.idle) > 0:
+                    ftp = self.idle.pop()
+            if ftp is not None and not self.is_healthy(ftp):
+                self.discard(ftp)
+                ftp = None
+            if ftp is None:
+                ftp = self.connect()
+
+            try:
+                yield ftp
+            except Exception:
+                # State of a connection that raised is unknown, so drop it
+                self.discard(ftp)
+                raise
+            with self.lock:
+                self.idle.append(ftp)
+
+    def run(self, func, *args):
+        """Call `func(ftp, *args)` on a pooled connection, retrying on
+        transient errors with a fresh connection each time
+        """
+        for attempt in range(1, self.retries + 1):
+            try:
+                with self.connection() as ftp:
+                    return func(ftp, *args)
+            except ftplib.error_perm:
+                raise
+            except transient_errors as e:
+                if attempt == self.retries:
+                    raise
+                delay = 2 ** (attempt - 1)
+                logger.warning(
+                    f'Caught FTP error ({type(e).__name__}: {e}); ' +
+                    f'reconnecting and retrying in {delay} s ' +
+                    f'(attempt {attempt} of {self.retries})'
+                )
+                time.sleep(delay)
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for ftp in idle:
+            try:
+                ftp.quit()
+            except Exception:
+                self.discard(ftp)
+
+pools = {}
+pools_lock = threading.Lock()
+
+def get_ftp_pool(host, max_connections=8):
+    """Get the process-wide connection pool for an FTP host"""
+    with pools_lock:
+        if host not in pools:
+            pools[host] = FtpPool(host, max_connections=max_connections)
+        return pools[host]
+
+def close_pools():
+    """Close and forget all FTP pools, e.g. before forking workers
+
+    Forked processes would otherwise inherit open sockets and lock state.
+    Pools requested afterwards start fresh.
+    """
+    with pools_lock:
+        closing = list(pools.values())
+        pools.clear()
+    for pool in closing:
+        pool.close()
@@ -1,3 +1,4 @@
+from .utils import *
 
 # DEBUG
 '''
@@ -41,7 +42,17 @@ def fetch_maize_centromeres(output_dir):
     """
     centromeres_by_chr = {}
 
-    rows = open(output_dir + 'zea-mays-b73-v2-centromeres.tsv').readlines()
+    file_name = 'zea-mays-b73-v2-centromeres.tsv'
+    if fresh_run:
+        with open(output_dir + file_name, 'rb') as f:
+            content = f.read()
+        if fill_cache:
+            write_atomic(cache_dir + file_name, content)
+    else:
+        with open(cache_dir + file_name, 'rb') as f:
+            content = f.read()
+
+    rows = content.decode('utf-8').splitlines(keepends=True)
     for row in rows[1:]:
         chr, start, stop = row.split('\t')[:3]
         chr = chr.replace('chr', '')
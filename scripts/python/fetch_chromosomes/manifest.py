@@ -0,0 +1,102 @@
+"""Thread-safe, checkpointed accumulator for the assembly manifest
+
+get_chromosomes.py processes hundreds of assemblies concurrently, over about
+an hour.  As each assembly finishes, its manifest entry (or lack of one) is
+appended to a journal file, one JSON object per line.  If the run crashes,
+the next run loads the journal, skips assemblies it already finished, and
+still produces the same final manifest.
+
+The first line records the assembly UIDs to process, so a resumed run
+processes the same assemblies in the same order, even if search results
+have changed since the crash.
+"""
+
+import json
+import os
+import threading
+
+class ManifestJournal:
+    """Accumulates manifest entries by assembly, checkpointing each one
+
+    Example:
+        journal = ManifestJournal('assembly-manifest.journal.jsonl')
+        if journal.uids is None:
+            journal.set_uids(uids)
+        if not journal.is_done(acc):
+            journal.record(order, acc, organism, [acc, asm_name])
+        manifest = journal.get_manifest()
+        journal.remove()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+        self.uids = None
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+
+            # Drop any partial line from a crash mid-write, so new records
+            # start on their own line
+            complete_length = content.rfind(b'\n') + 1
+            if complete_length < len(content):
+                with open(path, 'r+b') as f:
+                    f.truncate(complete_length)
+
+            for line in content[:complete_length].decode('utf-8').splitlines():
+                record = json.loads(line)
+                if 'uids' in record:
+                    self.uids = record['uids']
+                else:
+                    self.records[record['acc']] = record
+
+    def __len__(self):
+        with self.lock:
+            return len(self.records)
+
+    def is_done(self, acc):
+        with self.lock:
+            return acc in self.records
+
+    def append(self, record):
+        line = json.dumps(record) + '\n'
+        with open(self.path, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def set_uids(self, uids):
+        """Checkpoint the assembly UIDs to process, in order"""
+        with self.lock:
+            self.append({'uids': uids})
+            self.uids = uids
+
+    def record(self, order, acc, organism, entry=None):
+        """Checkpoint a finished assembly and its manifest entry, if any
+
+        `order` is the assembly's position among all assemblies.  When several
+        assemblies of one organism have entries, the last in order wins, as
+        in a sequential run.
+        """
+        record = {
+            'order': order, 'acc': acc, 'organism': organism, 'entry': entry
+        }
+        with self.lock:
+            self.append(record)
+            self.records[acc] = record
+
+    def get_manifest(self):
+        """Get manifest of entries by organism, independent of finish order"""
+        with self.lock:
+            records = sorted(self.records.values(), key=lambda r: r['order'])
+        manifest = {}
+        for record in records:
+            if record['entry'] is not None:
+                manifest[record['organism']] = record['entry']
+        return manifest
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,96 +1,163 @@
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+import os
+from urllib.parse import quote
 
 from .utils import *
+from . import eutils
+from .db_pool import get_db_pool, get_dbs_with_table
 
+ucsc_host = 'genome-mysql.soe.ucsc.edu'
 
-eutils = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-esearch = eutils + 'esearch.fcgi?retmode=json'
-esummary = eutils + 'esummary.fcgi?retmode=json'
 
+def get_ucsc_pool():
+    return get_db_pool(ucsc_host, user='genome')
 
-def get_ucsc_cursor(logger):
-    cursor = get_cursor('genome-mysql.soe.ucsc.edu', 'genome', db='UCSC',
-        logger=logger)
-    return cursor
 
+# Max UCSC names OR'd together in one esearch query
+esearch_batch_size = 50
 
-def query_accession_from_eutils(assembly_uid, logger):
-    """Requests esummary from NCBI Assembly DB, returns assembly accession
+# Max assembly UIDs per esummary request, per EUtils guidance for HTTP GET
+esummary_batch_size = 200
+
+accession_map_file = 'ucsc_genbank_accessions.json'
+
+
+def get_genbank_accession(summary):
+    """Get GenBank accession (GCA_*) from an NCBI Assembly DB docsum
     """
-    global esummary
-
-    asm_summary = esummary + '&db=assembly&id=' + assembly_uid
-
-    # Example: https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?retmode=json&db=assembly&id=255628
-    response = request(asm_summary)
-    try:
-        data = json.loads(response)
-    except Exception as e:
-        logger.error('Exception in query_accession_from_eutils:')
-        logger.error(e)
-        logger.error('Response causing exception:')
-        logger.error(response)
-        raise e
-    time.sleep(3)
-    result = data['result'][assembly_uid]
-    acc = result['assemblyaccession'] # Accession.version
+    acc = summary['assemblyaccession'] # Accession.version
 
     # Return GenBank accession if it's default, else find and return it
     if "GCA_" not in acc:
-        acc = result['synonym']['genbank']
+        acc = summary['synonym']['genbank']
 
     return acc
 
 
-def get_genbank_accession_from_ucsc_name(db, times, unfound_dbs, logger):
-    """Queries NCBI EUtils for the GenBank accession of a UCSC asseembly name
+def search_assembly_uids(term, retmax):
+    """Queries esearch on NCBI Assembly DB, returns assembly UIDs
     """
-    global esearch
-    acc = None
-    t0 = time_ms()
-    logger.info('Fetching GenBank accession from NCBI EUtils for: ' + db)
-
-    asm_search = esearch + '&db=assembly&term=' + db
+    esearch = eutils.get_eutils_urls()['esearch']
+    asm_search = (
+        esearch + '&db=assembly&retmax=' + str(retmax) + '&term=' + quote(term)
+    )
 
     # Example: https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=assembly&retmode=json&term=panTro4
-    data = json.loads(request(asm_search))
-    time.sleep(3)
-    id_list = data['esearchresult']['idlist']
-    if len(id_list) > 0:
-        assembly_uid = id_list[0]
-        acc = query_accession_from_eutils(assembly_uid, logger)
-    else:
-        unfound_dbs.append(db)
+    data = eutils.fetch_json(asm_search, opener=request)
+    return data['esearchresult']['idlist']
+
+
+def fetch_assembly_summaries(assembly_uids, logger):
+    """Requests esummary from NCBI Assembly DB for many UIDs per request
+    """
+    esummary = eutils.get_eutils_urls()['esummary']
+    summaries = []
+
+    for i in range(0, len(assembly_uids), esummary_batch_size):
+        uids = assembly_uids[i:i + esummary_batch_size]
+        asm_summary = esummary + '&db=assembly&id=' + ','.join(uids)
+
+        # Example: https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?retmode=json&db=assembly&id=255628,733711
+        response = eutils.request(asm_summary, opener=request)
+        try:
+            result = json.loads(response)['result']
+        except Exception as e:
+            logger.error('Exception in fetch_assembly_summaries:')
+            logger.error(e)
+            logger.error('Response causing exception:')
+            logger.error(response)
+            raise e
+        summaries += [result[uid] for uid in result['uids']]
+
+    return summaries
+
+
+def read_accession_map():
+    path = cache_dir + accession_map_file
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_accession_map(accessions):
+    """Atomically persist UCSC name -> GenBank accession map
+    """
+    path = cache_dir + accession_map_file
+    content = json.dumps(accessions, indent=2, sort_keys=True)
+    write_atomic(path, content.encode('utf-8'))
+
+
+def resolve_genbank_accessions(dbs, times, unfound_dbs, logger):
+    """Map UCSC assembly names (e.g. panTro4) to GenBank accessions, in bulk
+
+    Names are OR'd into combined esearch queries, then their docsums are
+    fetched many per esummary request and matched by UCSC name.  Names that
+    no docsum claims fall back to one esearch each, still with batched
+    esummary.  Resolved names are persisted, so later runs skip EUtils.
+    """
+    t0 = time_ms()
+    accessions = read_accession_map()
+    pending = [db for db in dbs if db not in accessions]
+    logger.info(
+        f'Resolving GenBank accessions for {len(pending)} UCSC assemblies ' +
+        f'({len(dbs) - len(pending)} previously resolved)'
+    )
+
+    for i in range(0, len(pending), esearch_batch_size):
+        names = pending[i:i + esearch_batch_size]
+        term = ' OR '.join(names)
+        uids = search_assembly_uids(term, retmax=10 * len(names))
+        for summary in fetch_assembly_summaries(uids, logger):
+            ucsc_name = summary.get('ucscname', '')
+            if ucsc_name in names and ucsc_name not in accessions:
+                accessions[ucsc_name] = get_genbank_accession(summary)
+
+    unmatched = [db for db in pending if db not in accessions]
+    # Several names can share a top search result, e.g. aliases
+    dbs_by_uid = {}
+    for db in unmatched:
+        id_list = search_assembly_uids(db, retmax=1)
+        if len(id_list) > 0:
+            dbs_by_uid.setdefault(id_list[0], []).append(db)
+        else:
+            unfound_dbs.append(db)
+    summaries = fetch_assembly_summaries(list(dbs_by_uid.keys()), logger)
+    for summary in summaries:
+        for db in dbs_by_uid[summary['uid']]:
+            accessions[db] = get_genbank_accession(summary)
+
+    if len(pending) > 0:
+        write_accession_map(accessions)
 
     times['ncbi'] += time_ms() - t0
-    return [acc, times, unfound_dbs]
+    return {db: accessions.get(db) for db in dbs}
 
 
-def query_ucsc_cytobandideo_db(cursor):
+def query_ucsc_cytobandideo_db(pool, db):
     # Excludes unplaced and unlocalized chromosomes
-    query = ('''
-        SELECT * FROM cytoBandIdeo
+    query = (f'''
+        SELECT * FROM {db}.cytoBandIdeo
         WHERE chrom NOT LIKE "chrUn"
             AND chrom LIKE "chr%"
             AND chrom NOT LIKE "chr%\_%"
     ''')
-    r = cursor.execute(query)
-    if r <= 1:
+    rows = pool.query(query)
+    if len(rows) <= 1:
         # Skip if result contains only e.g. chrMT
         return None
-    return cursor
+    return rows
 
 
-def get_bands_by_chr(cursor):
+def get_bands_by_chr(pool, db):
     bands_by_chr = {}
 
-    cursor = query_ucsc_cytobandideo_db(cursor)
-    if cursor is None:
+    rows3 = query_ucsc_cytobandideo_db(pool, db)
+    if rows3 is None:
         return None
 
     has_bands = False
-    rows3 = cursor.fetchall()
     for row3 in rows3:
         chr, start, stop, band_name, stain = row3
         bands_by_chr = update_bands_by_chr(
@@ -103,56 +170,26 @@ def get_bands_by_chr(cursor):
 
     return bands_by_chr
 
-def get_cytobandideo_table(cursor, db):
-    """ Determine if cytobandIdeo table is present for this assembly DB
-    """
-    cytobandideo_table = None
-
-    cursor.execute('USE ' + db)
-    cursor.execute('SHOW TABLES; # for ' + db)
-    rows2 = cursor.fetchall()
-    for row2 in rows2:
-        if row2[0] == 'cytoBandIdeo':
-            cytobandideo_table = 1
-            break
 
-    return cytobandideo_table
-
-
-def fetch_assembly_data(db_tuples_list, times, unfound_dbs, logger):
-    """Queries UCSC DBs, called via a thread pool in fetch_ucsc_data
+def fetch_assembly_data(db_tuple, pool):
+    """Queries a UCSC DB, called via a thread pool in pool_fetch_org_map
     """
-    cursor = get_ucsc_cursor(logger)
-
-    for db_tuple in db_tuples_list:
-        db, name_slug = db_tuple
+    db, name_slug = db_tuple
 
-        cytobandideo_table = get_cytobandideo_table(cursor, db)
-        if cytobandideo_table is None:
-            continue
-
-        bands_by_chr = get_bands_by_chr(cursor)
-        if bands_by_chr is None:
-            continue
-
-        genbank_accession, times, unfound_dbs =\
-            get_genbank_accession_from_ucsc_name(db, times, unfound_dbs, logger)
-
-        asm_data = [db, genbank_accession, bands_by_chr]
+    bands_by_chr = get_bands_by_chr(pool, db)
+    if bands_by_chr is None:
+        return None
 
-        # logger.info('Got UCSC data: ' + str(asm_data))
-        return [name_slug, asm_data, times, unfound_dbs]
+    return [name_slug, db, bands_by_chr]
 
 
-def query_db_tuples(cursor, logger):
+def query_db_tuples(pool, logger):
     db_map = {}
 
-    cursor.execute('use hgcentral')
-    cursor.execute('''
-      SELECT name, scientificName FROM dbDb
+    rows = pool.query('''
+      SELECT name, scientificName FROM hgcentral.dbDb
         WHERE active = 1
     ''')
-    rows = cursor.fetchall()
 
     for row in rows:
         db = row[0]
@@ -168,25 +205,34 @@ def query_db_tuples(cursor, logger):
 def pool_fetch_org_map(db_tuples, times, unfound_dbs, logger):
     org_map = {}
 
-    # Take the list of DBs we want to query for cytoBandIdeo data, split it
-    # into 30 smaller lists, then launch a new thread for each of those small
-    # new DB lists to divide up the work of querying remote DBs.
-    num_threads = 1
-    db_tuples_lists = chunkify(db_tuples, num_threads)
-    with ThreadPoolExecutor(max_workers=num_threads) as pool:
-        results = pool.map(
-            partial(fetch_assembly_data,
-                logger=logger, times=times, unfound_dbs=unfound_dbs),
-            db_tuples_lists
+    pool = get_ucsc_pool()
+
+    # Find all DBs that have a cytoBandIdeo table in one round-trip, then
+    # query only those DBs for bands, concurrently over pooled connections
+    cytoband_dbs = get_dbs_with_table(pool, 'cytoBandIdeo')
+    db_tuples = [
+        db_tuple for db_tuple in db_tuples if db_tuple[0] in cytoband_dbs
+    ]
+    logger.info(
+        f'Querying bands in {len(db_tuples)} UCSC DBs with cytoBandIdeo'
+    )
+
+    num_threads = pool.max_connections
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = executor.map(
+            partial(fetch_assembly_data, pool=pool), db_tuples
         )
-        for result in results:
-            if result is None:
-                continue
-            name_slug, asm_data, times, unfound_dbs = result
-            if name_slug in org_map:
-                org_map[name_slug].append(asm_data)
-            else:
-                org_map[name_slug] = [asm_data]
+        assemblies = [result for result in results if result is not None]
+
+    dbs = [db for [name_slug, db, bands_by_chr] in assemblies]
+    accessions = resolve_genbank_accessions(dbs, times, unfound_dbs, logger)
+
+    for [name_slug, db, bands_by_chr] in assemblies:
+        asm_data = [db, accessions[db], bands_by_chr]
+        if name_slug in org_map:
+            org_map[name_slug].append(asm_data)
+        else:
+            org_map[name_slug] = [asm_data]
     return org_map
 
 
@@ -197,11 +243,12 @@ def fetch_from_ucsc(logger, times, unfound_dbs):
     mysql --user=genome --host=genome-mysql.soe.ucsc.edu -A
     """
     t0 = time_ms()
-    cursor = get_ucsc_cursor(logger)
+    pool = get_ucsc_pool()
 
-    db_tuples = query_db_tuples(cursor, logger)
+    db_tuples = query_db_tuples(pool, logger)
 
     org_map = pool_fetch_org_map(db_tuples, times, unfound_dbs, logger)
+    logger.info('MySQL latency: ' + pool.latency_summary())
 
     times['ucsc'] += time_ms() - t0
     return [org_map, times, unfound_dbs]
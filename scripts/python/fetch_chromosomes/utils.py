@@ -4,102 +4,303 @@ import pymysql
 import urllib.request
 import time
 import re
-import ast
 import json
+import os
+import hashlib
+import struct
+import tempfile
+import threading
+import datetime
+from decimal import Decimal
 
 fresh_run = settings.fresh_run
 fill_cache = settings.fill_cache
 output_dir = settings.output_dir
 cache_dir = settings.cache_dir
 
-_original_execute = pymysql.cursors.Cursor.execute
-_original_fetchall = pymysql.cursors.Cursor.fetchall
+# Type tags for values in cached SQL rows
+NULL, INT, FLOAT, STR, BYTES, DECIMAL, DATETIME, DATE = range(8)
 
-class Cursor:
+SQL_CACHE_MAGIC = b'IGSQL1'
 
-    def __init__(self):
-        self.query = ''
-        self._result = ''
-        self._original_close = pymysql.cursors.Cursor.close
 
-    def execute(self, query, args=None):
-        file_name = \
-            query.strip().replace('.', '_').replace('/', '_')\
-                .replace(':', '_').replace('?', '_').replace('=', '_')\
-                .replace('&', '_').replace(',', '').replace(' ', '_')\
-                .replace('\n', '')
+def encode_rows(rows):
+    """Serialize SQL result rows into compact, typed binary
+
+    Layout: magic, uint32 row count, then per row a uint16 value count and
+    per value a 1-byte type tag plus payload.  Integers are int64; strings,
+    bytes, decimals and dates are uint32-length-prefixed.
+    """
+    parts = [SQL_CACHE_MAGIC, struct.pack('<I', len(rows))]
+    for row in rows:
+        parts.append(struct.pack('<H', len(row)))
+        for value in row:
+            if value is None:
+                parts.append(bytes([NULL]))
+            elif isinstance(value, bool) or isinstance(value, int):
+                if -2**63 <= value < 2**63:
+                    parts.append(bytes([INT]) + struct.pack('<q', value))
+                else:
+                    payload = str(value).encode()
+                    parts.append(
+                        bytes([DECIMAL]) + struct.pack('<I', len(payload)) +
+                        payload
+                    )
+            elif isinstance(value, float):
+                parts.append(bytes([FLOAT]) + struct.pack('<d', value))
+            else:
+                if isinstance(value, str):
+                    tag, payload = STR, value.encode('utf-8')
+                elif isinstance(value, (bytes, bytearray)):
+                    tag, payload = BYTES, bytes(value)
+                elif isinstance(value, Decimal):
+                    tag, payload = DECIMAL, str(value).encode()
+                elif isinstance(value, datetime.datetime):
+                    tag, payload = DATETIME, value.isoformat().encode()
+                elif isinstance(value, datetime.date):
+                    tag, payload = DATE, value.isoformat().encode()
+                else:
+                    raise TypeError(
+                        f'Cannot cache SQL value of type {type(value)}'
+                    )
+                parts.append(
+                    bytes([tag]) + struct.pack('<I', len(payload)) + payload
+                )
+    return b''.join(parts)
+
+
+def decode_rows(data):
+    """Parse typed binary from `encode_rows` back into a tuple of row tuples
+    """
+    if not data.startswith(SQL_CACHE_MAGIC):
+        raise ValueError('Not a cached SQL result')
+    pos = len(SQL_CACHE_MAGIC)
+    num_rows = struct.unpack_from('<I', data, pos)[0]
+    pos += 4
+    rows = []
+    for i in range(num_rows):
+        num_values = struct.unpack_from('<H', data, pos)[0]
+        pos += 2
+        row = []
+        for j in range(num_values):
+            tag = data[pos]
+            pos += 1
+            if tag == NULL:
+                row.append(None)
+            elif tag == INT:
+                row.append(struct.unpack_from('<q', data, pos)[0])
+                pos += 8
+            elif tag == FLOAT:
+                row.append(struct.unpack_from('<d', data, pos)[0])
+                pos += 8
+            else:
+                length = struct.unpack_from('<I', data, pos)[0]
+                pos += 4
+                payload = data[pos:pos + length]
+                pos += length
+                if tag == STR:
+                    row.append(payload.decode('utf-8'))
+                elif tag == BYTES:
+                    row.append(payload)
+                elif tag == DECIMAL:
+                    row.append(Decimal(payload.decode()))
+                elif tag == DATETIME:
+                    row.append(datetime.datetime.fromisoformat(payload.decode()))
+                elif tag == DATE:
+                    row.append(datetime.date.fromisoformat(payload.decode()))
+                else:
+                    raise ValueError(f'Unknown type tag in cached SQL: {tag}')
+        rows.append(tuple(row))
+    return tuple(rows)
+
+
+class QueryCache:
+    """On-disk cache of SQL query results
+
+    Entries are keyed by a SHA-256 hash of host, database and query, so long
+    or similar queries never collide, and are written atomically.
+    """
 
-        cache_path = cache_dir + 'sql__' + file_name
+    def __init__(self, dir):
+        self.dir = dir
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def get_path(self, host, db, query):
+        key = f'{host}|{db}|{query.strip()}'
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.dir + 'sql__' + digest
+
+    def read(self, host, db, query):
+        path = self.get_path(host, db, query)
+        try:
+            with open(path, 'rb') as f:
+                rows = decode_rows(f.read())
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            raise FileNotFoundError(
+                f'No cached result for query on {host} (db: {db}): ' +
+                f'{query.strip()}\n' +
+                'Record one with "--record <fixture_dir>", then try again.'
+            )
+        with self.lock:
+            self.hits += 1
+        return rows
+
+    def write(self, host, db, query, rows):
+        path = self.get_path(host, db, query)
+        write_atomic(path, encode_rows(rows))
+        with self.lock:
+            self.writes += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes
+            }
+
+
+query_cache = QueryCache(cache_dir)
 
-        if fresh_run:
-            cursor = _original_execute(self, query, args=args)
-            if fill_cache:
 
-                result = str(self.fetchall())
-                open(cache_path, 'w').write(result)
-            return cursor
+class Cursor:
+    """DB-API cursor that reads or fills the SQL result cache
+
+    When filling the cache, queries run on a real pymysql cursor and results
+    are saved.  When offline, `cursor` is None and results come only from
+    the cache.
+    """
+
+    def __init__(self, connection, cursor=None):
+        self.connection = connection
+        self.cursor = cursor
+        self._rows = ()
+        self._index = 0
+
+    def execute(self, query, args=None):
+        # Track current database, as cache keys include it
+        if query.strip().upper().startswith('USE '):
+            self.connection.db = query.strip()[4:].strip().strip(';`')
+            if self.cursor is not None:
+                self.cursor.execute(query)
+            return 0
+
+        host = self.connection.host
+        db = self.connection.db
+        key = query if args is None else f'{query} -- args: {args!r}'
+        if self.cursor is None:
+            self._rows = query_cache.read(host, db, key)
         else:
-            result = open(cache_path, 'r').read()
-            _result = ast.literal_eval(result)
-            if _result is None:
-                num_results = 0
-            else:
-                num_results = len(_result)
-            self._result = _result
-            return num_results
+            self.cursor.execute(query, args)
+            self._rows = tuple(self.cursor.fetchall())
+            query_cache.write(host, db, key, self._rows)
+        self._index = 0
+        return len(self._rows)
+
+    def fetchone(self):
+        if self._index >= len(self._rows):
+            return None
+        row = self._rows[self._index]
+        self._index += 1
+        return row
 
     def fetchall(self):
-        if fresh_run:
-            return self._rows
-        else:
-            return self._result
+        rows = self._rows[self._index:]
+        self._index = len(self._rows)
+        return rows
 
     def close(self):
-        if fresh_run:
-            return self._original_close
-        else:
-            return
+        if self.cursor is not None:
+            self.cursor.close()
 
 
 class Connection:
-    def __init__(self, host=None, user=None, port=None):
+    """DB connection whose cursors read or fill the SQL result cache
+    """
+
+    def __init__(self, host=None, user=None, port=None, connection=None):
         self.host = host
         self.user = user
         self.port = port
-        self.cursorclass = pymysql.cursors.Cursor
+        self.db = None
+        self.connection = connection
 
     def cursor(self):
-        return Cursor()
+        if self.connection is None:
+            return Cursor(self)
+        return Cursor(self, self.connection.cursor())
+
+    def ping(self, reconnect=False):
+        if self.connection is not None:
+            self.connection.ping(reconnect=reconnect)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
 
 
-def db_connect(host, user=None, port=None):
+def db_connect(host, user=None, port=None, timeout=None):
     """Wrapper for pymmsql.connect; enables caching
+
+    `timeout` (seconds) bounds connecting, and reading each query result.
     """
+    timeouts = {}
+    if timeout is not None:
+        timeouts = {
+            'connect_timeout': timeout,
+            'read_timeout': timeout,
+            'write_timeout': timeout
+        }
 
     if fresh_run and fill_cache is False:
         # Production run, fast; needs Internet
-        return pymysql.connect(host=host, user=user, port=port)
+        return pymysql.connect(host=host, user=user, port=port, **timeouts)
 
     elif fresh_run and fill_cache:
         # Production run, slower; needs Internet
-        connection = pymysql.connect(host, user=user, port=port)
-        connection.cursorclass.execute = Cursor.execute
-        connection.cursorclass.fetchall = Cursor.fetchall
-        return connection
+        connection = pymysql.connect(
+            host=host, user=user, port=port, **timeouts
+        )
+        return Connection(
+            host=host, user=user, port=port, connection=connection
+        )
 
     elif fresh_run is False and fill_cache is False:
         # Development run, fastest; does not need Internet
         return Connection(host=host, user=user, port=port)
 
 
+def get_request_cache_path(url, request_body=None):
+    """Get path of cached HTTP response, keyed by hash of URL and body
+
+    API keys are omitted from the key, so recorded fixtures replay for anyone.
+    """
+    key = re.sub(r'&api_key=[^&]*', '', url)
+    if request_body is not None:
+        key += '|' + request_body.decode('utf-8')
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return cache_dir + 'http__' + digest
+
+
+def write_atomic(path, content):
+    """Write bytes to a temp file, then rename it to `path`"""
+    dir = os.path.dirname(path) or '.'
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir, prefix='.tmp__')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
 def request(url, request_body=None):
     """Wrapper for urllib.request; includes caching
     """
-    file_name = \
-        url.replace('.', '_').replace('/', '_').replace(':', '_') \
-            .replace('?', '_').replace('=', '_').replace('&', '_')
-
-    cache_path = cache_dir + file_name
+    cache_path = get_request_cache_path(url, request_body)
 
     if fresh_run:
         if request_body is not None:
@@ -109,15 +310,61 @@ def request(url, request_body=None):
             with urllib.request.urlopen(url) as response:
                 data = response.read().decode('utf-8')
         if fill_cache:
-            with open(cache_path, 'w') as file:
-                file.write(data)
+            write_atomic(cache_path, data.encode('utf-8'))
     else:
-        with open(cache_path) as file:
-            data = file.read()
+        try:
+            with open(cache_path, encoding='utf-8') as file:
+                data = file.read()
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                f'No cached response for request: {url}\n' +
+                'Record one with "--record <fixture_dir>", then try again.'
+            )
 
     return data
 
 
+# Version of the layout of files in fixture (i.e. cache) directories.
+# Increment upon changing how requests or queries are keyed or stored.
+FIXTURE_VERSION = 1
+
+fixture_manifest_file = 'fixture-manifest.json'
+
+
+def write_fixture_manifest(fixture_dir):
+    """Describe a recorded run, so replays can check compatibility"""
+    file_names = sorted([
+        name for name in os.listdir(fixture_dir)
+        if name != fixture_manifest_file and not name.startswith('.')
+    ])
+    manifest = {
+        'version': FIXTURE_VERSION,
+        'recorded': datetime.datetime.now().isoformat(timespec='seconds'),
+        'num_files': len(file_names),
+        'files': file_names
+    }
+    content = json.dumps(manifest, indent=2).encode('utf-8')
+    write_atomic(fixture_dir + fixture_manifest_file, content)
+
+
+def check_fixture_manifest(fixture_dir):
+    """Raise if a fixture directory is missing or from another version"""
+    manifest_path = fixture_dir + fixture_manifest_file
+    if os.path.exists(manifest_path) is False:
+        raise ValueError(
+            f'No recorded run found in {fixture_dir}.  ' +
+            f'Run with "--record {fixture_dir}" then try again.'
+        )
+    with open(manifest_path) as f:
+        version = json.load(f)['version']
+    if version != FIXTURE_VERSION:
+        raise ValueError(
+            f'Fixtures in {fixture_dir} are version {version}, but this ' +
+            f'script needs version {FIXTURE_VERSION}.  ' +
+            f'Run with "--record {fixture_dir}" then try again.'
+        )
+
+
 def get_cursor(host, user='anonymous', port=None, db=None, logger=None):
     connection = db_connect(host=host, user=user, port=port)
     cursor = connection.cursor()
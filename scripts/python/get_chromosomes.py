@@ -1,14 +1,12 @@
 """Download AGPs from NCBI and format chromosome data, including centromeres"""
 
-import urllib.request as request
-import urllib.error
 from urllib.parse import quote
 import ftplib
 import os
 import json
-import gzip
 import io
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
 import time
 import traceback
 import pprint
@@ -17,6 +15,10 @@ import fetch_chromosomes.settings as settings
 import fetch_chromosomes.convert_band_data as convert_band_data
 import fetch_chromosomes.fetch_cytobands_from_dbs as fetch_cytobands_from_dbs
 import fetch_chromosomes.utils as utils
+from fetch_chromosomes.ftp_pool import get_ftp_pool
+from fetch_chromosomes.agp import AgpParser, stream_gzipped_ftp
+import fetch_chromosomes.eutils as eutils
+from fetch_chromosomes.manifest import ManifestJournal
 
 output_dir = '../../data/bands/native/'
 
@@ -29,52 +31,17 @@ orgs_with_centromere_data = {}
 
 ftp_domain = 'ftp.ncbi.nlm.nih.gov'
 
-manifest = {}
-asms = []
+# Max concurrent FTP connections to NCBI, across all threads
+ftp_max_connections = 10
 
-def get_eutils_urls():
+# Max concurrent chromosome AGP downloads within one assembly
+agp_threads_per_assembly = 4
 
-    api_key = '&api_key=7e33ac6a08a6955ec3b83d214d22b21a2808'
-
-    eutils = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-    esearch = eutils + 'esearch.fcgi?retmode=json' + api_key
-    esummary = eutils + 'esummary.fcgi?retmode=json' + api_key
-    elink = eutils + 'elink.fcgi?retmode=json' + api_key
-
-    return {
-        'elink': elink,
-        'esummary': esummary,
-        'esearch': esearch
-    }
-
-def get_chromosome_object(agp):
-    """Extracts centromere coordinates and chromosome length from AGP data,
-    and returns a chromosome object formatted in JSON"""
-
-    chr = {}
-
-    agp = agp.split('\n')
-
-    for i, line in enumerate(agp):
-        if len(line) == 0 or line[0] == '#':
-            continue
-        tabs = line.split("\t")
-        acc = tabs[0]
-        start = int(tabs[1])
-        stop = int(tabs[2])
-        comp_type = tabs[6]
-        if 'acc' not in chr:
-            chr['accession'] = acc
-            chr['type'] = 'nuclear'
-        if comp_type == 'centromere':
-            chr['centromere'] = {
-                'start': start,
-                'length': stop - start
-            }
-        if i == len(agp) - 2:
-            chr['length'] = stop
-    return chr
+# Max assembly UIDs per esummary request, per EUtils guidance for HTTP GET
+esummary_batch_size = 200
 
+# Checkpoints of finished assemblies, to resume from if a run crashes
+journal_path = output_dir + 'assembly-manifest.journal.jsonl'
 
 def fetch_ftp(ftp, file_name):
 
@@ -83,34 +50,13 @@ def fetch_ftp(ftp, file_name):
     def handle_binary(data):
         bytesio_object.write(data)
 
-    try:
-        ftp.retrbinary('RETR ' + file_name, callback=handle_binary)
-    except ftplib.error_temp as e:
-        # E.g. "ftplib.error_temp: 425 EPSV: Address already in use"
-        logger.warning(
-            'Caught FTP error (ftplib.error_temp); ' +
-            f'retrying in 1 second for {file_name}'
-        )
-        time.sleep(1)
-        ftp.retrbinary('RETR ' + file_name, callback=handle_binary)
-    except EOFError as e:
-        logger.warning(
-            f'Raising FTP error (EOFError); for {file_name}'
-        )
-        raise e
+    # Transient errors, e.g. "ftplib.error_temp: 425 EPSV: Address already
+    # in use", are retried on a fresh connection by the FTP pool
+    ftp.retrbinary('RETR ' + file_name, callback=handle_binary)
 
     return bytesio_object
 
 
-# Downloads gzipped FTP data in binary format, returns plain text content
-def fetch_gzipped_ftp(ftp, file_name):
-    bytesio_object = fetch_ftp(ftp, file_name)
-    bytesio_object.seek(0) # Go back to the start
-    zip_data = gzip.GzipFile(fileobj=bytesio_object)
-    content = zip_data.read().decode('utf-8')
-    return content
-
-
 def change_ftp_dir(ftp, wd):
 
     logger.info('Changing FTP working directory to: ' + wd)
@@ -120,6 +66,9 @@ def change_ftp_dir(ftp, wd):
         raise e
 
 
+def list_ftp_dir(ftp, wd):
+    change_ftp_dir(ftp, wd)
+    return ftp.nlst()
 
 
 # GRCh38 defines centromeres and heterochromatin in regions files, not AGP gaps
@@ -158,8 +107,7 @@ def download_genome_regions(ftp, regions_ftp):
 
 
 def write_centromere_data(organism, asm_name, asm_acc, output_dir, chrs):
-    global manifest
-
+    """Write bands for an assembly, return its manifest entry"""
     logger.info(
         'Centromeres found for ' + organism + ' ' +
         'in genome assembly ' + asm_name + ' (' + asm_acc + ')'
@@ -220,10 +168,22 @@ def write_centromere_data(organism, asm_name, asm_acc, output_dir, chrs):
 
     logger.info(f"Wrote Ideogram bands for {organism} to output_path: {output_path}")
     logger.info(f"Wrote Ideogram bands for {organism} to long_output_path: {long_output_path}")
-    manifest[organism] = [asm_acc, asm_name]
+    return [asm_acc, asm_name]
 
 
-def download_genome_agp(ftp, asm):
+def fetch_chromosome_agp(ftp, agp_ftp_wd, file_name):
+    """Download and parse one chromosome's AGP; helper for download_genome_agp
+
+    Returns the chromosome object, and whether the AGP has centromere data.
+    """
+    parser = AgpParser()
+    # Use full path, so connections in the pool need no working directory
+    stream_gzipped_ftp(ftp, agp_ftp_wd + file_name, parser.feed)
+    chr = parser.close()
+    return [chr, parser.has_centromere]
+
+
+def download_genome_agp(asm):
     global orgs_with_centromere_data
     logger.info('Entering download_genome_agp')
 
@@ -240,46 +200,44 @@ def download_genome_agp(ftp, asm):
 
     has_centromere_data = False
 
-    try:
-        change_ftp_dir(ftp, agp_ftp_wd)
-    except Exception as e:
-        logger.warning(e)
-        logger.warning('Returning from change_ftp_dir due to error')
-        # time.sleep(3)
-        return
+    ftp_pool = get_ftp_pool(ftp_domain, ftp_max_connections)
 
-    file_names = ftp.nlst()
+    # Let listing errors propagate, so the assembly is retried and reported
+    # as failed, rather than checkpointed as lacking centromere data
+    file_names = ftp_pool.run(list_ftp_dir, agp_ftp_wd)
 
     logger.info(f'List of files in FTP working directory for ({organism}, {asm_name})')
     logger.info(file_names)
-    for file_name in file_names:
-        # Download each chromomsome's compressed AGP file
-        # We retrieve both agp.gz and comp.agp.gz files
-        # Former is more common, latter used for some organisms (e.g. platypus)
 
-        # Example full URL of file:
-        # https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/515/GCF_000001515.7_Pan_tro_3.0/GCF_000001515.7_Pan_tro_3.0_assembly_structure/Primary_Assembly/assembled_chromosomes/AGP/chr1.agp.gz
+    # Download each chromomsome's compressed AGP file concurrently.
+    # We retrieve both agp.gz and comp.agp.gz files
+    # Former is more common, latter used for some organisms (e.g. platypus)
+    #
+    # Example full URL of file:
+    # https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/515/GCF_000001515.7_Pan_tro_3.0/GCF_000001515.7_Pan_tro_3.0_assembly_structure/Primary_Assembly/assembled_chromosomes/AGP/chr1.agp.gz
+    def fetch_agp(file_name):
         logger.info(
             f'Retrieving from FTP ({organism}, {asm_name}, {asm_acc}): ' +
             file_name
         )
-
         try:
-            agp = fetch_gzipped_ftp(ftp, file_name)
+            return ftp_pool.run(fetch_chromosome_agp, agp_ftp_wd, file_name)
         except EOFError as e:
             logger.warning(
                 f'Raising error (EOFError) for ({organism}, {asm_name}, {asm_acc}): {file_name}'
             )
             raise e
 
+    with ThreadPoolExecutor(max_workers=agp_threads_per_assembly) as pool:
+        parsed_agps = list(pool.map(fetch_agp, file_names))
 
-        chr = get_chromosome_object(agp)
+    # Process in listed order, so output does not depend on download order
+    for file_name, [chr, agp_has_centromere] in zip(file_names, parsed_agps):
 
         if (organism in ['homo-sapiens', 'mus-musculus']):
-            logger.info('in download_genome_agp. organism, chr, agp:')
+            logger.info('in download_genome_agp. organism, chr:')
             logger.info(organism)
             logger.info(chr)
-            logger.info(agp)
 
         chr_acc = chr['accession']
         if chr_acc not in chrs_seen:
@@ -287,7 +245,7 @@ def download_genome_agp(ftp, asm):
             chrs.append(chr)
             chrs_seen[chr_acc] = 1
 
-        if "centromere" in str(agp):
+        if agp_has_centromere:
             has_centromere_data = True
             orgs_with_centromere_data[organism] = 1
             logger.info(
@@ -309,7 +267,7 @@ def download_genome_agp(ftp, asm):
         )
 
         if regions_ftp != '':
-            centromeres = download_genome_regions(ftp, regions_ftp)
+            centromeres = ftp_pool.run(download_genome_regions, regions_ftp)
             if len(centromeres) > 0:
                 has_centromere_data = True
                 orgs_with_centromere_data[organism] = 1
@@ -323,156 +281,178 @@ def download_genome_agp(ftp, asm):
             'Writing centromeres for ' + organism + ' ' +
             'genome assembly ' + asm_name
         )
-        write_centromere_data(organism, asm_name, asm_acc, output_dir, chrs)
-
-
-def find_genomes_with_centromeres(asm_summary_response):
-    global asms
+        return write_centromere_data(
+            organism, asm_name, asm_acc, output_dir, chrs
+        )
 
-    ftp = ftplib.FTP(ftp_domain)
-    ftp.login()
 
-    data = asm_summary_response
+def get_assembly(result):
+    """Get assembly task parameters from an NCBI Assembly esummary result
+    """
+    acc = result['assemblyaccession'] # Accession.version
+    name = result['assemblyname']
+    taxid = result['taxid']
+    organism = result['speciesname'].lower().replace(' ', '-').strip()
+
+    # one fully banded (downstream), one not
+    # if organism != 'homo-sapiens' and organism != 'pongo-abelii':
+    #     continue
+    asm_segment = acc + '_' + name.replace(' ', '_').replace('-', '_')
+
+    # NCBI genomes FTP directories have path segments corresponding to a split
+    # assembly accession, e.g. GCF_000001515 -> GCF/000/001/515.
+    split_acc = ''
+    for i, char in enumerate(acc.split('.')[0].replace('_', '')):
+        split_acc += char
+        if (i + 1) % 3 == 0:
+            split_acc += '/'
+
+    # Example: ftp://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/515/GCF_000001515.7_Pan_tro_3.0/GCF_000001515.7_Pan_tro_3.0_assembly_structure/Primary_Assembly/assembled_chromosomes/AGP/chr1.agp.gz
+    # FTP working directory of AGP files
+    agp_ftp_wd = (
+        '/genomes/all/' + split_acc +
+        asm_segment + '/' + asm_segment + '_assembly_structure/' +
+        'Primary_Assembly/assembled_chromosomes/AGP/'
+    )
 
-    logger.info('In find_genomes_with_centromeres, number of keys in asm_summary_response:')
-    logger.info(len(data['result'].keys()))
+    regions_ftp = result['ftppath_regions_rpt']
+    if regions_ftp != '':
+        regions_ftp = regions_ftp.split('nih.gov')[1]
 
-    organisms = []
-    for uid in data['result']:
-        if uid == 'uids':
-            continue
-        result = data['result'][uid]
-        organism = result['speciesname'].lower().replace(' ', '-').strip()
-        organisms.append(organism)
-    logger.info('In find_genomes_with_centromeres, organisms:')
-    logger.info(organisms)
+    asm_output_dir = output_dir + organism + '/' + asm_segment + '/'
 
-    for uid in data['result']:
+    return {
+        'acc': acc,
+        'name': name,
+        'taxid': taxid,
+        'organism': organism,
+        'agp_ftp_wd': agp_ftp_wd,
+        'asm_output_dir': asm_output_dir,
+        'asm_segment': asm_segment,
+        'regions_ftp': regions_ftp
+    }
 
-        # Omit list of UIDs
-        if uid == 'uids':
-            continue
 
-        result = data['result'][uid]
-        acc = result['assemblyaccession'] # Accession.version
-        name = result['assemblyname']
-        taxid = result['taxid']
-        organism = result['speciesname'].lower().replace(' ', '-').strip()
-
-        # one fully banded (downstream), one not
-        # if organism != 'homo-sapiens' and organism != 'pongo-abelii':
-        #     continue
-        asm_segment = acc + '_' + name.replace(' ', '_').replace('-', '_')
-
-        # NCBI genomes FTP directories have path segments corresponding to a split
-        # assembly accession, e.g. GCF_000001515 -> GCF/000/001/515.
-        split_acc = ''
-        for i, char in enumerate(acc.split('.')[0].replace('_', '')):
-            split_acc += char
-            if (i + 1) % 3 == 0:
-                split_acc += '/'
-
-        # Example: ftp://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/000/001/515/GCF_000001515.7_Pan_tro_3.0/GCF_000001515.7_Pan_tro_3.0_assembly_structure/Primary_Assembly/assembled_chromosomes/AGP/chr1.agp.gz
-        # FTP working directory of AGP files
-        agp_ftp_wd = (
-            '/genomes/all/' + split_acc +
-            asm_segment + '/' + asm_segment + '_assembly_structure/' +
-            'Primary_Assembly/assembled_chromosomes/AGP/'
-        )
+def fetch_assembly_summaries(uids):
+    """Fetch esummary results for assembly UIDs, many UIDs per request
 
-        regions_ftp = result['ftppath_regions_rpt']
-        if regions_ftp != '':
-            regions_ftp = regions_ftp.split('nih.gov')[1]
+    Yields one list of results per batch, so work on early batches can
+    start while later batches are fetched.
+    """
+    esummary = eutils.get_eutils_urls()['esummary']
+    for i in range(0, len(uids), esummary_batch_size):
+        batch = uids[i:i + esummary_batch_size]
 
-        asm_output_dir = output_dir + organism + '/' + asm_segment + '/'
+        # Example: https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?retmode=json&db=assembly&id=733711
+        asm_summary = esummary + '&db=assembly&id=' + ','.join(batch)
+        logger.info(f'Fetching esummary for {len(batch)} assembly UIDs')
+        result = eutils.fetch_json(asm_summary)['result']
+        yield [result[uid] for uid in result['uids']]
 
-        asm = {
-            'acc': acc,
-            'name': name,
-            'taxid': taxid,
-            'organism': organism,
-            'agp_ftp_wd': agp_ftp_wd,
-            'asm_output_dir': asm_output_dir,
-            'asm_segment': asm_segment,
-            'regions_ftp': regions_ftp
-        }
 
+def process_assembly(asm, order, journal, retries):
+    """Download and write centromeres for one assembly, retrying on error,
+    then checkpoint it in the manifest journal
+    """
+    for attempt in range(1, retries + 2):
         try:
-            download_genome_agp(ftp, asm)
+            entry = download_genome_agp(asm)
+            journal.record(order, asm['acc'], asm['organism'], entry)
+            return
         except Exception as e:
-            logger.warning(f'Caught Exception; sleep then reconnect FTP.  Exception')
-            logger.warning(e)
-            ftp = ftplib.FTP(ftp_domain)
-            ftp.login()
-            download_genome_agp(ftp, asm)
-
-        asms.append(asm)
-
-    ftp.quit()
-
-
-def chunkify(lst, n):
-    return [lst[i::n] for i in range(n)]
-
-
-def pool_processing(uid_list):
-    logger.info(f'In get_chromosomes.py pool_processing.  len(uid_list): {len(uid_list)}, raw uid_list:')
-    logger.info(uid_list)
-
-    # If uid_list is nested list, as with chunked use case in multi-thread mode
-    if hasattr(uid_list[0], '__len__') and (not isinstance(uid_list[0], str)):
-        uid_list = uid_list[0]
-
-    logger.info(f'In get_chromosomes.py pool_processing.  processed len(uid_list): {len(uid_list)}, processed uid_list:')
-    logger.info(uid_list)
-
-    uid_list = ','.join(uid_list)
-    num_uids = len(uid_list)
+            if attempt == retries + 1:
+                raise
+            delay = 2 ** attempt
+            logger.warning(
+                f'Error processing assembly {asm["name"]} ({asm["acc"]}) ' +
+                f'for {asm["organism"]}: {type(e).__name__}: {e}; ' +
+                f'retrying in {delay} s (attempt {attempt} of {retries + 1})'
+            )
+            time.sleep(delay)
+
+
+def process_assemblies(uids, journal, num_workers, retries):
+    """Process assemblies via a shared work queue
+
+    Each assembly is its own task, and each worker takes the next task as
+    soon as it finishes one, so a few slow assemblies (e.g. large plant
+    genomes) do not leave other workers idle.  Errors are collected and
+    logged with tracebacks, rather than lost.  Assemblies already
+    checkpointed in the journal are skipped.
+    """
+    # Order by search results, not esummary results, for stable resumes
+    orders = {uid: i + 1 for i, uid in enumerate(uids)}
+    futures = {}
+    num_skipped = 0
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for results in fetch_assembly_summaries(uids):
+            for result in results:
+                asm = get_assembly(result)
+                order = orders[result['uid']]
+                if journal.is_done(asm['acc']):
+                    num_skipped += 1
+                    continue
+                future = pool.submit(
+                    process_assembly, asm, order, journal, retries
+                )
+                futures[future] = asm
+
+        if num_skipped > 0:
+            logger.info(
+                f'Skipped {num_skipped} assemblies finished in a prior run'
+            )
 
-    asm_summary = get_eutils_urls()['esummary'] + '&db=assembly&id=' + uid_list
+        errors = []
+        num_tasks = len(futures)
+        for i, future in enumerate(as_completed(futures)):
+            asm = futures[future]
+            label = f'{asm["organism"]}, {asm["name"]} ({asm["acc"]})'
+            try:
+                future.result()
+            except Exception as e:
+                trace = "".join(
+                    traceback.TracebackException.from_exception(e).format()
+                )
+                logger.error(f'Failed to process assembly {label}:\n{trace}')
+                errors.append(label)
+            logger.info(f'Processed {i + 1} of {num_tasks} assemblies: {label}')
+
+    if len(errors) > 0:
+        logger.error(
+            f'Failed to process {len(errors)} of {num_tasks} assemblies: ' +
+            '; '.join(errors)
+        )
 
-    logger.info(f'In get_chromosomes.py pool_processing.  Now fetching {num_uids} UIDs: {asm_summary}')
-    # breakpoint()
-    # Example: https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?retmode=json&db=assembly&id=733711
-    try:
-        with request.urlopen(asm_summary) as response:
-            logger.info('response.status')
-            logger.info(response.status)
-            esummary_data = json.loads(response.read().decode('utf-8'))
-    except urllib.error.HTTPError as e:
-        # msg = (
-        #     f"Encountered HTTP error status code {response.status} "
-        #     f"in request for {asm_summary}"
-        # )
-        logger.error(e)
-        raise ValueError(e)
-    time.sleep(3) # Delay for 3 seconds
-
-    # logger.info('In get_chromosomes.py, esummary_data:')
-    # logger.info(esummary_data)
-    try:
-        find_genomes_with_centromeres(esummary_data)
-    except Exception as e:
-        logger.error('Error in pool_processing, find_genomes_with_centromeres.  e:')
-        logger.error(e)
+    return errors
 
-def main():
-    global manifest
 
+def search_assemblies():
+    """Get UIDs of latest chromosome-level RefSeq assemblies"""
     term = quote(
         '("latest refseq"[filter]) AND '
         '("chromosome level"[filter] OR "complete genome"[filter]) AND ' +
         '(animals[filter] OR plants[filter] OR fungi[filter] OR protists[filter])'
     )
 
-    asm_search = get_eutils_urls()['esearch'] + '&db=assembly&term=' + term + '&retmax=10000'
+    asm_search = eutils.get_eutils_urls()['esearch'] + '&db=assembly&term=' + term + '&retmax=10000'
 
     # Example: https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?retmode=json&db=assembly&term=("latest refseq"[filter] AND "chromosome level"[filter]) AND (animals[filter] OR plants[filter] OR fungi[filter] OR protists[filter])&retmax=10000
-    with request.urlopen(asm_search) as response:
-        data = json.loads(response.read().decode('utf-8'))
+    data = eutils.fetch_json(asm_search)
 
     # Returns ~1000 ids
-    top_uid_list = data['esearchresult']['idlist']
+    return data['esearchresult']['idlist']
+
+
+def main(num_workers=5, retries=2):
+
+    journal = ManifestJournal(journal_path)
+    if journal.uids is not None:
+        # Reuse the crashed run's UIDs, so assembly order is unchanged
+        top_uid_list = journal.uids
+        logger.info(f'Resuming from journal of {len(journal)} assemblies')
+    else:
+        top_uid_list = search_assemblies()
+        journal.set_uids(top_uid_list)
 
     logger.info('Assembly UIDs returned in search results: ' + str(len(top_uid_list)))
 
@@ -481,26 +461,12 @@ def main():
     logger.info('in get_chromosomes.py, non_ncbi_manifest')
     logger.info(non_ncbi_manifest)
 
-    # TODO: Make this configurable
-    num_threads = 5
-
-    uid_lists = chunkify(top_uid_list, num_threads)
-
-    with ThreadPoolExecutor(max_workers=num_threads) as pool:
-        pool.map(pool_processing, uid_lists)
-        # future = pool.submit(pool_processing, uid_lists)
-        # try:
-        #     future.result()
-        # except Exception as e:
-        #     logger.error('In main, error:')
-        #     logger.error(e)
-        #     trace = "".join(traceback.TracebackException.from_exception(e).format())
-        #     logger.error(trace)
+    errors = process_assemblies(top_uid_list, journal, num_workers, retries)
 
     # logger.info('non_ncbi_manifest')
     # logger.info(non_ncbi_manifest)
 
-    non_ncbi_manifest.update(manifest)
+    non_ncbi_manifest.update(journal.get_manifest())
 
     manifest = non_ncbi_manifest
 
@@ -518,10 +484,32 @@ def main():
         f.write(manifest)
     print(f'Wrote {manifest_path}')
 
+    # Keep journal if any assembly failed, so a rerun retries only those
+    if len(errors) == 0:
+        journal.remove()
+
+    logger.info(eutils.latencies.summary())
+
     logger.info('Calling convert_band_data.py')
     convert_band_data.main()
 
     logger.info('Ending get_chromosomes.py')
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers',
+        help='Number of assemblies to process concurrently.  ' +
+             '(default: %(default)s)',
+        type=int,
+        default=5)
+    parser.add_argument('--retries',
+        help='Times to retry processing an assembly after an error.  ' +
+             '(default: %(default)s)',
+        type=int,
+        default=2)
+    # Tolerate arguments for fetch_cytobands_from_dbs, e.g. --replay
+    args = parser.parse_known_args()[0]
+
+    main(args.workers, args.retries)
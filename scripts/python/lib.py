@@ -1,21 +1,40 @@
 
 
 
+import bisect
 import gzip
 import os
+import shutil
 import ssl
+import struct
 import urllib.request
+import zlib
 
 ctx = ssl.create_default_context()
 ctx.check_hostname = False
 ctx.verify_mode = ssl.CERT_NONE
 
+# In offline mode, downloads only use cached copies, and never the network
+offline = False
+
+def set_offline(value):
+    """Enable or disable offline mode for all downloads in this process"""
+    global offline
+    offline = value
+
 def is_cached(path, cache, threshold):
     """Determine if file path is already available, per cache and threshold.
     `cache` level is set by pipeline user; `threshold` by the calling function.
     See `--help` CLI output for description of `cache` levels.
     """
 
+    if offline and threshold == 1:
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"Offline mode, but no cached copy exists of {path}"
+            )
+        cache = threshold
+
     if cache >= threshold:
         if threshold == 1:
             action = "download"
@@ -60,10 +79,135 @@ def download(url, output_path, cache=0):
     print(f"Requesting {url}")
     request = urllib.request.Request(url)
     response = urllib.request.urlopen(request, context=ctx)
-    content = response.read().decode()
 
-    # print('content')
-    # print(content)
+    # Stream the response to disk, rather than reading it all into memory.
+    # Large BioMart TSVs can be hundreds of MB.
+    with open(output_path, "wb") as f:
+        shutil.copyfileobj(response, f)
 
-    with open(output_path, "w") as f:
-        f.write(content)
+# BGZF (blocked gzip) constants, per the SAM/BAM spec:
+# https://samtools.github.io/hts-specs/SAMv1.pdf, section 4.1
+BGZF_MAX_INPUT = 0xff00 # Max uncompressed bytes per block, as in htslib
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+def compress_bgzf_block(data):
+    """Compress bytes into one BGZF block, i.e. a standalone gzip member
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = len(cdata) + 26 # 18-byte header, 8-byte footer
+    header = struct.pack(
+        "<BBBBIBBHBBHH",
+        31, 139, 8, 4, # gzip magic, deflate, FEXTRA flag
+        0, 0, 255, # mtime, extra flags, OS
+        6, 66, 67, 2, # XLEN, "BC" subfield, subfield length
+        block_size - 1
+    )
+    footer = struct.pack("<II", zlib.crc32(data), len(data))
+    return header + cdata + footer
+
+class BgzfWriter():
+    """Write text as BGZF, a gzip variant that supports random access
+
+    BGZF files are a series of independently-compressed gzip members of at
+    most 64 KB, so plain `gzip -d` reads them as usual.  Alongside each file,
+    this writes a `.gzi` index (as `bgzip --reindex` does) that maps the
+    uncompressed offset of each block to its compressed offset.  Clients can
+    thus seek to, and decompress, only the block that contains a given row.
+
+    Example:
+        with BgzfWriter("homo-sapiens-genes.tsv.gz") as f:
+            f.write(content)
+    """
+
+    def __init__(self, output_path, write_index=True):
+        self.output_path = output_path
+        self.write_index = write_index
+        self.file = open(output_path, "wb")
+        self.buffer = bytearray()
+        self.compressed_offset = 0
+        self.uncompressed_offset = 0
+        self.index = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, text):
+        self.buffer += text.encode()
+        while len(self.buffer) >= BGZF_MAX_INPUT:
+            self.flush_block(bytes(self.buffer[:BGZF_MAX_INPUT]))
+            del self.buffer[:BGZF_MAX_INPUT]
+
+    def flush_block(self, data):
+        if self.compressed_offset > 0:
+            self.index.append((self.compressed_offset, self.uncompressed_offset))
+        block = compress_bgzf_block(data)
+        self.file.write(block)
+        self.compressed_offset += len(block)
+        self.uncompressed_offset += len(data)
+
+    def tell_virtual(self):
+        """Get BGZF virtual offset of the next byte to be written
+
+        Virtual offsets pack the compressed offset of a block and the
+        uncompressed offset within that block into one 64-bit integer.
+        """
+        return (self.compressed_offset << 16) | len(self.buffer)
+
+    def close(self):
+        if self.file.closed:
+            return
+        if len(self.buffer) > 0:
+            self.flush_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.file.write(BGZF_EOF)
+        self.file.close()
+
+        if self.write_index:
+            with open(self.output_path + ".gzi", "wb") as f:
+                f.write(struct.pack("<Q", len(self.index)))
+                for offsets in self.index:
+                    f.write(struct.pack("<QQ", *offsets))
+
+def read_bgzf_index(index_path):
+    """Parse a `.gzi` index into a list of (compressed, uncompressed) offsets
+    """
+    with open(index_path, "rb") as f:
+        content = f.read()
+    num_entries = struct.unpack_from("<Q", content)[0]
+    index = [(0, 0)]
+    for i in range(num_entries):
+        index.append(struct.unpack_from("<QQ", content, 8 + i * 16))
+    return index
+
+def read_bgzf_range(path, offset, length, index=None):
+    """Read `length` uncompressed bytes at `offset` in a BGZF file
+
+    Only the blocks that overlap the requested range are decompressed.
+    """
+    if index is None:
+        index = read_bgzf_index(path + ".gzi")
+
+    # Find the last block that starts at or before the requested offset
+    block_starts = [entry[1] for entry in index]
+    block = bisect.bisect_right(block_starts, offset) - 1
+    [compressed_offset, uncompressed_offset] = index[block]
+
+    data = bytearray()
+    with open(path, "rb") as f:
+        f.seek(compressed_offset)
+        while uncompressed_offset + len(data) < offset + length:
+            header = f.read(18)
+            if len(header) < 18:
+                break
+            block_size = struct.unpack_from("<H", header, 16)[0] + 1
+            cdata = f.read(block_size - 18)
+            data += zlib.decompress(cdata[:-8], -15)
+
+    start = offset - uncompressed_offset
+    return bytes(data[start:start + length])
@@ -14,9 +14,12 @@ python3 list_assemblies.py
 
 import argparse
 import json
-import math
 import os
+import shutil
 import urllib.request as request
+from concurrent.futures import ThreadPoolExecutor
+
+import fetch_chromosomes.eutils as eutils
 
 parser = argparse.ArgumentParser(
     description=__doc__,
@@ -34,13 +37,19 @@ if len(output_dir) > 0 and output_dir[0] != '':
 asms_path = 'assembly_summary.txt'
 asms_path_historical = 'assembly_summary_historical.txt'
 
-eutils_base = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
-esummary_base = eutils_base + '/esummary.fcgi'
+# Persistent cache of NCBI Taxonomy common names, by taxid
+taxonomy_cache_path = 'taxonomy_common_names.json'
+
+# NCBI EUtils limits parameters to 500 values each
+eutils_limit = 500
+
+# Concurrent taxonomy requests; all EUtils requests share a rate limiter
+taxonomy_threads = 4
 
 def fetch_asm_summary(group, group_asms_path, group_asms_historical_path):
     '''Retrieve NCBI assembly summary TSV file by organism group
 
-    Fetched files are written locally as a cache
+    Fetched files are streamed to disk, and kept locally as a cache
     '''
 
     path_versions = {
@@ -49,7 +58,7 @@ def fetch_asm_summary(group, group_asms_path, group_asms_historical_path):
     }
     for version in path_versions:
         path = path_versions[version]
-        if version is 'current':
+        if version == 'current':
             leaf = f'{group}/{asms_path}'
         else:
             leaf = f'{group}/{asms_path_historical}'
@@ -58,183 +67,199 @@ def fetch_asm_summary(group, group_asms_path, group_asms_historical_path):
             # Example URL:
             # https://ftp.ncbi.nlm.nih.gov/genomes/genbank/vertebrate_mammalian/assembly_summary.txt
             url = f'https://ftp.ncbi.nlm.nih.gov/genomes/genbank/{leaf}'
+            tmp_path = path + '.tmp'
             with request.urlopen(url) as response:
-                data = response.read().decode('utf-8')
-            with open(path, 'w') as f:
-                f.write(data)
+                with open(tmp_path, 'wb') as f:
+                    shutil.copyfileobj(response, f)
+            os.replace(tmp_path, path)
 
 def get_taxid_chunks(taxids):
-    '''Return taxids in comma-delimited lists of 500
+    '''Return taxids in lists of at most 500
     Needed because NCBI EUtils limits parameters to 500 values each.
     '''
-    taxid_chunks = []
+    return [
+        taxids[i:i + eutils_limit] for i in range(0, len(taxids), eutils_limit)
+    ]
 
-    eutils_limit = 500
+def read_taxonomy_cache():
+    if os.path.exists(taxonomy_cache_path) == False:
+        return {}
+    with open(taxonomy_cache_path) as f:
+        return json.load(f)
 
-    num_requests = math.ceil(len(taxids) / eutils_limit)
-    for num in range(0, num_requests):
-        pos = num * eutils_limit
-        upper = (num + 1) * eutils_limit
-        if upper < len(taxids):
-            size = upper
-        else:
-            size = pos + upper - len(taxids)
-        taxids_segment = taxids[pos:size]
-        taxids_chunk = ','.join(taxids_segment)
-        taxid_chunks.append(taxids_chunk)
+def write_taxonomy_cache(names_by_taxid):
+    tmp_path = taxonomy_cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(names_by_taxid, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, taxonomy_cache_path)
+
+def fetch_common_names(taxids):
+    '''Request common names for up to 500 taxids from NCBI Taxonomy
+    '''
+    esummary = eutils.get_eutils_urls()['esummary']
+    eutils_url = f'{esummary}&db=taxonomy&id={",".join(taxids)}'
+    taxid_json = eutils.fetch_json(eutils_url)['result']
+    del taxid_json['uids'] # Remove placeholder from relevant data
+
+    # Cache taxids without a common name too, so they aren't requested again
+    return {
+        taxid: taxid_json[taxid].get('commonname', '') for taxid in taxid_json
+    }
+
+names_by_taxid = read_taxonomy_cache()
 
-    return taxid_chunks
+def resolve_common_names(taxids):
+    '''Get common names for taxids, requesting only those not yet cached
+
+    Uncached taxids are deduplicated, then fetched in concurrent batches.
+    '''
+    unknown_taxids = sorted(set(taxids) - set(names_by_taxid.keys()))
+
+    if len(unknown_taxids) > 0:
+        taxid_chunks = get_taxid_chunks(unknown_taxids)
+        with ThreadPoolExecutor(max_workers=taxonomy_threads) as pool:
+            for names in pool.map(fetch_common_names, taxid_chunks):
+                names_by_taxid.update(names)
+        write_taxonomy_cache(names_by_taxid)
+
+    return names_by_taxid
 
 def add_common_names(asms):
     '''Add organism common names (e.g. human) to genome assembly objects
     '''
     # NCBI Taxonomy identifiers, an organism ID.  Human: 9606, etc.
     taxids = [asm['taxid'] for asm in asms]
-    taxids = list(set(taxids)) # deduplicate
 
-    names_by_taxid  = {}
-
-    taxid_chunks = get_taxid_chunks(taxids)
-
-    for taxid_chunk in taxid_chunks:
-        eutils_url = f'{esummary_base}?db=taxonomy&format=json&id={taxid_chunk}'
-        with request.urlopen(eutils_url) as response:
-            data = json.loads(response.read().decode('utf-8'))
-        taxid_json = data['result']
-        del taxid_json['uids'] # Remove placeholder from relevant data
-
-        for taxid in taxid_json:
-            names_by_taxid[taxid] = taxid_json[taxid]['commonname']
+    names = resolve_common_names(taxids)
 
     new_asms = []
     for asm in asms:
         new_asm = asm
-        new_asm['organism_common_name'] = names_by_taxid[asm['taxid']]
+        new_asm['organism_common_name'] = names.get(asm['taxid'], '')
         new_asms.append(new_asm)
 
     return new_asms
 
-def parse_current_assemblies(group, group_asms_path):
-    ''' Parse current genome assemblies
-    '''
+def parse_assemblies(group, path, filters):
+    ''' Stream assembly summary rows, keeping those that match all filters
 
+    Filters map column names to sets of allowed values.  They are checked by
+    column index on each raw line, so rows are only split into a dict if
+    they pass, which most rows do not.
+    '''
     asms = []
 
-    with open(group_asms_path) as f:
-        asms_file = f.readlines()
-
-    # For reference, expected headers are:
-    # assembly_accession, bioproject, biosample, wgs_master, refseq_category,
-    # taxid, species_taxid, organism_name, infraspecific_name, isolate,
-    # version_status, assembly_level, release_type, genome_rep, seq_rel_date,
-    # asm_name, submitter, gbrs_paired_asm, paired_asm_comp, ftp_path,
-    # excluded_from_refseq, relation_to_type_material
-    headers = asms_file[1].replace('# ', '').strip().split('\t')
-
-    for line in asms_file[2:]:
-        columns = line.strip().split('\t')
-        asm = dict(zip(headers, columns))
-
-        categories = ['representative genome', 'reference genome']
-
-        if (
-            asm['assembly_level'] != 'Chromosome' or
-            asm['release_type'] != 'Major' or
-            asm['refseq_category'] not in categories
-        ):
-            continue
-
-        asm['organism_group'] = group
-
-        asms.append(asm)
+    with open(path) as f:
+        next(f) # Skip "See <README URL>" comment line
+
+        # For reference, expected headers are:
+        # assembly_accession, bioproject, biosample, wgs_master,
+        # refseq_category, taxid, species_taxid, organism_name,
+        # infraspecific_name, isolate, version_status, assembly_level,
+        # release_type, genome_rep, seq_rel_date, asm_name, submitter,
+        # gbrs_paired_asm, paired_asm_comp, ftp_path, excluded_from_refseq,
+        # relation_to_type_material
+        headers = next(f).replace('# ', '').strip().split('\t')
+        index_filters = [
+            (headers.index(name), values) for name, values in filters.items()
+        ]
+        max_index = max([i for (i, values) in index_filters])
+
+        for line in f:
+            # Split only as far as the last filtered column
+            columns = line.split('\t', max_index + 1)
+            if len(columns) <= max_index or any(
+                columns[i] not in values for (i, values) in index_filters
+            ):
+                continue
+
+            columns = line.rstrip('\n').split('\t')
+            asm = dict(zip(headers, columns))
+            asm['organism_group'] = group
+            asms.append(asm)
 
     return asms
 
-def parse_historical_assemblies(group, group_asms_historical_path):
-    asms = []
-
-    with open(group_asms_historical_path) as f:
-        asms_file = f.readlines()
-
-    # See parse_current_assemblies for expected headers
-    headers = asms_file[1].replace('# ', '').strip().split('\t')
-
-    for line in asms_file[2:]:
-        columns = line.strip().split('\t')
-        asm = dict(zip(headers, columns))
-
-        if (
-            asm['assembly_level'] != 'Chromosome' or
-            asm['release_type'] != 'Major' or
-            asm['submitter'] != 'Genome Reference Consortium'
-        ):
-            continue
+def parse_current_assemblies(group, group_asms_path):
+    ''' Parse current genome assemblies
+    '''
+    filters = {
+        'assembly_level': {'Chromosome'},
+        'release_type': {'Major'},
+        'refseq_category': {'representative genome', 'reference genome'}
+    }
+    return parse_assemblies(group, group_asms_path, filters)
 
-        asm['organism_group'] = group
+def parse_historical_assemblies(group, group_asms_historical_path):
+    filters = {
+        'assembly_level': {'Chromosome'},
+        'release_type': {'Major'},
+        'submitter': {'Genome Reference Consortium'}
+    }
+    return parse_assemblies(group, group_asms_historical_path, filters)
 
-        asms.append(asm)
+def get_group_assemblies(group):
+    '''Fetch and parse current and historical assemblies for organism group
+    '''
+    group_asms = []
+    group_asms_path = f'{group}_{asms_path}'
+    group_asms_historical_path = f'{group}_{asms_path_historical}'
+    fetch_asm_summary(group, group_asms_path, group_asms_historical_path)
+
+    group_asms += parse_current_assemblies(group, group_asms_path)
+    group_asms +=\
+        parse_historical_assemblies(group, group_asms_historical_path)
+
+    return sorted(group_asms, key=lambda asm: asm['organism_name'])
+
+groups = [
+    'fungi',
+    'invertebrate',
+    'plant',
+    'protozoa',
+    'vertebrate_mammalian',
+    'vertebrate_other'
+]
 
-    return asms
+output_headers = [
+    'organism_name',
+    'organism_common_name',
+    'asm_name',
+    'assembly_accession'
+]
 
 def get_assemblies():
-    '''Fetch metadata on genome assemblies from NCBI, and write it locally
+    '''Fetch metadata on genome assemblies from NCBI, by organism group
 
     Background: Genome assemblies are sequenced chromosomes for an organism.
 
     Here, we get metadata on each assembly, like its name (e.g. GRCh38),
     accession (an identifier like GCA_000001405.15), the organism's scientific
     and common names (Homo sapiens, human) and more.
-    '''
-
-    groups = [
-        'fungi',
-        'invertebrate',
-        'plant',
-        'protozoa',
-        'vertebrate_mammalian',
-        'vertebrate_other'
-    ]
-
-    asms = []
-
-    for group in groups:
-        group_asms = []
-        group_asms_path = f'{group}_{asms_path}'
-        group_asms_historical_path = f'{group}_{asms_path_historical}'
-        fetch_asm_summary(group, group_asms_path, group_asms_historical_path)
-
-        group_asms += parse_current_assemblies(group, group_asms_path)
-        group_asms +=\
-            parse_historical_assemblies(group, group_asms_historical_path)
-
-        group_asms = sorted(group_asms, key=lambda asm: asm['organism_name'])
-        asms += group_asms
-
-    asms = add_common_names(asms)
 
-    return asms
-
-asms = get_assemblies()
-
-asm_list = []
+    Groups are downloaded and parsed concurrently, and yielded in order as
+    each becomes ready.
+    '''
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        for group_asms in pool.map(get_group_assemblies, groups):
+            yield add_common_names(group_asms)
 
-output_headers = [
-    'organism_name',
-    'organism_common_name',
-    'asm_name',
-    'assembly_accession'
-]
-for asm in asms:
-    asm_entry = [asm[header] for header in output_headers]
-    asm_list.append('\t'.join(asm_entry))
+def write_assemblies(output_file):
+    '''Write assemblies to a TSV file, one organism group at a time
+    '''
+    num_asms = 0
 
-header = '# ' + '\t'.join(output_headers)
-asm_list.insert(0, header)
+    with open(output_file, 'w') as f:
+        f.write('# ' + '\t'.join(output_headers))
+        for group_asms in get_assemblies():
+            for asm in group_asms:
+                asm_entry = [asm[header] for header in output_headers]
+                f.write('\n' + '\t'.join(asm_entry))
+            f.flush()
+            num_asms += len(group_asms)
 
-content = '\n'.join(asm_list)
+    print(f'Wrote list of {num_asms} assemblies to {output_file}')
 
 output_file = output_dir + 'assemblies.tsv'
 
-open(output_file, 'w').write(content)
-
-print(f'Wrote list of {len(asm_list)} assemblies to {output_file}')
+write_assemblies(output_file)
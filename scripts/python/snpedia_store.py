@@ -0,0 +1,118 @@
+'''SQLite store of SNPedia genotype comments, for fast per-sample lookups
+
+snpedia-archive.json is hundreds of MB, but a sample only needs comments for
+genotypes it has, and only for rsIDs that are also in ClinVar.  Rather than
+parsing the whole archive for each run, convert it once into a SQLite table
+keyed by rsID and genotype, then query only the rsIDs a sample needs.
+
+Schema:
+
+* snps: rsid TEXT PRIMARY KEY, orientation TEXT
+* genotypes: rsid TEXT, genotype TEXT, comment TEXT; keyed by (rsid, genotype)
+
+EXAMPLES
+
+store = get_snpedia_store("../../data/analysis/snpedia-archive.json")
+store.get("rs6025") # -> {"original_orientation": "plus", "genotypes": {...}}
+'''
+
+import json
+import os
+import sqlite3
+
+def build_snpedia_store(json_path, db_path):
+    '''Convert SNPedia archive JSON into a SQLite store, once'''
+    with open(json_path) as f:
+        snpedia_json = json.loads(f.read())
+
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite3.connect(tmp_path)
+    db.execute(
+        "CREATE TABLE snps (rsid TEXT PRIMARY KEY, orientation TEXT) " +
+        "WITHOUT ROWID"
+    )
+    db.execute(
+        "CREATE TABLE genotypes (" +
+        "rsid TEXT, genotype TEXT, comment TEXT, " +
+        "PRIMARY KEY (rsid, genotype)" +
+        ") WITHOUT ROWID"
+    )
+
+    snps = []
+    genotypes = []
+    for rsid, srs in snpedia_json.items():
+        # Some rsIDs in the archive have no SNPedia data
+        if not srs:
+            continue
+        snps.append((rsid, srs.get("original_orientation")))
+        for genotype, sg in srs.get("genotypes", {}).items():
+            genotypes.append((rsid, genotype, sg.get("comment", "")))
+
+    db.executemany("INSERT INTO snps VALUES (?, ?)", snps)
+    db.executemany("INSERT OR REPLACE INTO genotypes VALUES (?, ?, ?)", genotypes)
+    db.commit()
+    db.close()
+    os.replace(tmp_path, db_path)
+
+class SnpediaStore():
+    '''Look up SNPedia genotype comments by rsID, querying only as needed
+    '''
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = None
+        self.pid = None
+
+    def get_db(self):
+        '''Get SQLite connection, opened once per process
+
+        SQLite connections must not be used across a fork, so forked worker
+        processes each open their own, read-only.
+        '''
+        if self.pid != os.getpid():
+            uri = "file:" + self.db_path + "?mode=ro"
+            self.db = sqlite3.connect(uri, uri=True)
+            self.pid = os.getpid()
+        return self.db
+
+    def get(self, rsid):
+        '''Get SNPedia data for an rsID (e.g. "rs6025"), or None
+
+        The result has the same shape as in snpedia-archive.json, e.g.:
+        {"original_orientation": "plus", "genotypes": {"CT": {"comment": ...}}}
+        '''
+        db = self.get_db()
+        row = db.execute(
+            "SELECT orientation FROM snps WHERE rsid = ?", (rsid,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        rows = db.execute(
+            "SELECT genotype, comment FROM genotypes WHERE rsid = ?", (rsid,)
+        )
+        genotypes = {}
+        for genotype, comment in rows:
+            genotypes[genotype] = {"comment": comment}
+
+        return {"original_orientation": row[0], "genotypes": genotypes}
+
+    def close(self):
+        if self.db is not None and self.pid == os.getpid():
+            self.db.close()
+        self.db = None
+        self.pid = None
+
+def get_snpedia_store(json_path):
+    '''Get store for a SNPedia archive, converting it first if needed'''
+    db_path = os.path.splitext(json_path)[0] + ".sqlite"
+    if (
+        os.path.exists(db_path) == False or
+        os.path.getmtime(db_path) < os.path.getmtime(json_path)
+    ):
+        print("Building SNPedia store: " + db_path)
+        build_snpedia_store(json_path, db_path)
+    return SnpediaStore(db_path)
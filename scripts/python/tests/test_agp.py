@@ -0,0 +1,55 @@
+import gzip
+import sys
+
+import pytest
+
+sys.path += ['..']
+
+from fetch_chromosomes.agp import AgpParser, stream_gzipped_ftp
+
+agp = (
+    '# ORGANISM: Homo sapiens\n' +
+    'CM000663.2\t1\t10000\t1\tN\t10000\ttelomere\tno\tna\n' +
+    'CM000663.2\t10001\t207666\t2\tF\tAP006221.1\t36117\t233702\t-\n' +
+    'CM000663.2\t121700001\t125100000\t3\tN\t3400000\tcentromere\tno\tna\n' +
+    'CM000663.2\t125100001\t248956422\t4\tF\tAP006222.2\t1\t123856422\t+\n'
+)
+
+class FakeFtp():
+    '''Sends data to retrbinary's callback in small chunks, like ftplib'''
+
+    def __init__(self, data, chunk_size=7):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def retrbinary(self, cmd, callback):
+        for i in range(0, len(self.data), self.chunk_size):
+            callback(self.data[i:i + self.chunk_size])
+
+def parse(data):
+    parser = AgpParser()
+    stream_gzipped_ftp(FakeFtp(data), 'chr1.agp.gz', parser.feed)
+    return parser
+
+def test_multi_member_gzip():
+    """Members of a concatenated gzip file should all be parsed"""
+    lines = agp.split('\n')
+    data = (
+        gzip.compress(('\n'.join(lines[:3]) + '\n').encode()) +
+        gzip.compress('\n'.join(lines[3:]).encode())
+    )
+    parser = parse(data)
+    chr = parser.close()
+    assert parser.has_centromere
+    assert chr == {
+        'accession': 'CM000663.2',
+        'type': 'nuclear',
+        'centromere': {'start': 121700001, 'length': 3399999},
+        'length': 248956422
+    }
+
+def test_truncated_gzip():
+    """Truncated downloads should raise EOFError, so they get retried"""
+    data = gzip.compress(agp.encode())
+    with pytest.raises(EOFError):
+        parse(data[:-10])
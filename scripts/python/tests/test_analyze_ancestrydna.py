@@ -0,0 +1,77 @@
+"""Tests for reading and batching raw AncestryDNA and 23andMe data
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import gzip
+import sys
+
+import pytest
+
+# Ensures modules in parent directory can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+from analyze_ancestrydna import read_sample, get_output_dirs
+
+def test_read_sample(tmpdir):
+    ancestrydna_path = str(tmpdir) + "/AncestryDNA.txt"
+    with open(ancestrydna_path, "w") as f:
+        f.write(
+            "#AncestryDNA raw data download\n" +
+            "rsid\tchromosome\tposition\tallele1\tallele2\n" +
+            "rs4477212\t1\t82154\tT\tT\n" +
+            "rs6025\t1\t169519049\tC\tT\n"
+        )
+
+    twentythreeandme_path = str(tmpdir) + "/23andMe.txt"
+    with open(twentythreeandme_path, "w") as f:
+        f.write(
+            "# rsid\tchromosome\tposition\tgenotype\n" +
+            "rs4477212\t1\t82154\tTT\n" +
+            "rs6025\t1\t169519049\tCT\n" +
+            "rs2032651\tY\t2657176\tA\n" +
+            "i3000001\tX\t2700157\t--\n"
+        )
+
+    assert list(read_sample(ancestrydna_path)) == [
+        ["rs4477212", "1", "82154", "T", "T"],
+        ["rs6025", "1", "169519049", "C", "T"]
+    ]
+    assert list(read_sample(twentythreeandme_path)) == [
+        ["rs4477212", "1", "82154", "T", "T"],
+        ["rs6025", "1", "169519049", "C", "T"],
+        ["rs2032651", "24", "2657176", "A", "A"],
+        ["i3000001", "23", "2700157", "0", "0"]
+    ]
+
+def test_read_vcf(tmpdir):
+    vcf_path = str(tmpdir) + "/genome.vcf.gz"
+    with gzip.open(vcf_path, "wt") as f:
+        f.write(
+            "##fileformat=VCFv4.2\n" +
+            "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tJANE\n" +
+            "chr1\t169519049\trs6025\tT\tC\t50\tPASS\t.\tGT:GQ\t0/1:99\n" +
+            "chrUn_gl000220\t1000\t.\tA\tG\t50\tPASS\t.\tGT\t1/1\n" +
+            "chr2\t5000\t.\tA\tAT,G\t50\tPASS\t.\tGT\t1|2\n" +
+            "chrY\t2657176\trs2032651\tG\tA\t50\tPASS\t.\tGT\t1\n" +
+            "chrX\t100\t.\tAC\tGT\t50\tPASS\t.\tGT\t0/1\n"
+        )
+
+    assert list(read_sample(vcf_path)) == [
+        ["rs6025", "1", "169519049", "T", "C"],
+        ["chr2:5000", "2", "5000", "I", "G"],
+        ["rs2032651", "24", "2657176", "A", "A"]
+    ]
+
+def test_get_output_dirs():
+    assert get_output_dirs(["a/jane.txt"], "out/") == ["out/"]
+    assert get_output_dirs(["a/jane.txt", "b/john.txt"], "out/") == [
+        "out/jane/", "out/john/"
+    ]
+    with pytest.raises(ValueError):
+        get_output_dirs(["a/jane.txt", "b/jane.txt"], "out/")
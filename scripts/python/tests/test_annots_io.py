@@ -0,0 +1,99 @@
+"""Tests for streaming annotation output
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import json
+import os
+import sys
+
+# Ensures modules in parent directory can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+import pytest
+
+from annots_io import AnnotsWriter, write_annots, read_columnar_annots
+
+def test_write_unsorted(tmpdir):
+    path = str(tmpdir) + "/annots.json"
+    keys = ["name", "start", "length"]
+    rows = [
+        ["X", "rs3", 300, 1],
+        ["2", "rs2", 200, 1],
+        ["10", "rs4", 400, 1],
+        ["2", "rs5", 500, 1],
+        ["X", "rs6", 600, 1],
+        ["2", "rs7", 700, 1]
+    ]
+
+    # Spill to disk every other annotation
+    with AnnotsWriter(keys, max_buffered=2) as writer:
+        writer.add_chrs(["1"])
+        for [chr, name, start, length] in rows:
+            writer.add(chr, [name, start, length])
+        writer.write(path)
+        tmp_dir = writer.tmp_dir
+    assert os.path.exists(tmp_dir) == False
+
+    with open(path) as f:
+        content = f.read()
+    assert content == json.dumps({
+        "keys": keys,
+        "annots": [
+            {"chr": "1", "annots": []},
+            {"chr": "2", "annots": [
+                ["rs2", 200, 1], ["rs5", 500, 1], ["rs7", 700, 1]
+            ]},
+            {"chr": "10", "annots": [["rs4", 400, 1]]},
+            {"chr": "X", "annots": [["rs3", 300, 1], ["rs6", 600, 1]]}
+        ]
+    })
+
+def test_columnar_round_trip(tmpdir):
+    json_path = str(tmpdir) + "/annots.json"
+    columnar_path = str(tmpdir) + "/annots.columnar.json"
+    keys = ["name", "start", "length", "trackIndex"]
+    rows = [
+        ["X", "rs3", 300, 1, 2],
+        ["2", "rs2", 200, 1, 0],
+        ["2", "", 2**31 - 1, 0, -1],
+        ["X", "rs6", 600, 1, 1]
+    ]
+
+    with AnnotsWriter(keys, metadata={"species": "human"}, max_buffered=3) as writer:
+        writer.add_chrs(["1"])
+        for [chr, *annot] in rows:
+            writer.add(chr, annot)
+        writer.write(json_path)
+        writer.write(columnar_path, format="columnar")
+
+    with open(json_path) as f:
+        expected = json.loads(f.read())
+    assert read_columnar_annots(columnar_path) == expected
+
+    # Blob has 4 bytes per value, for each key after "name"
+    assert os.path.getsize(str(tmpdir) + "/annots.columnar.bin") == 4 * 4 * 3
+
+    with pytest.raises(OverflowError):
+        write_annots(
+            columnar_path, keys, [["1", [["rs1", 2**31, 1, 0]]]],
+            format="columnar"
+        )
+
+    # Failed writes leave earlier output intact
+    assert read_columnar_annots(columnar_path) == expected
+    assert sorted(os.listdir(str(tmpdir))) == [
+        "annots.columnar.bin", "annots.columnar.json",
+        "annots.columnar.names.txt", "annots.json"
+    ]
+
+    # Truncated blobs are detected, not read as empty
+    with open(str(tmpdir) + "/annots.columnar.bin", "r+b") as f:
+        f.truncate(4 * 4 * 3 - 4)
+    with pytest.raises(ValueError):
+        read_columnar_annots(columnar_path)
@@ -0,0 +1,78 @@
+"""Tests for rsID lookups in ClinVar via a prebuilt index
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Ensures modules in parent directory can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+from clinvar_index import get_clinvar_index
+
+def get_vcf():
+    header = "##fileformat=VCFv4.0\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    info = (
+        "RS=6025;GENEINFO=F5:2153;CLNALLE=1;CLNSIG=5|255;" +
+        "CLNDBN=Thrombophilia_due_to_factor_V_Leiden|Recurrent_abortion;" +
+        "CLNREVSTAT=no_criteria|single;CLNACC=RCV000000674.2|RCV000023935.2"
+    )
+    skipped_info = (
+        "RS=80357906;CLNALLE=-1;CLNSIG=0;CLNDBN=not_specified;" +
+        "CLNREVSTAT=single;CLNACC=RCV000031233.1"
+    )
+    return header + "\n".join([
+        "\t".join(["1", "169519049", "rs6025", "T", "C", ".", ".", info]),
+        "\t".join(["17", "41209079", "rs80357906", "T", "TG", ".", ".", skipped_info]),
+        ""
+    ])
+
+def test_lookup(tmpdir):
+    vcf_path = str(tmpdir) + "/clinvar.vcf"
+    with open(vcf_path, "w") as f:
+        f.write(get_vcf())
+
+    index = get_clinvar_index(vcf_path)
+
+    assert len(index) == 2
+    assert index.num_records == 2
+    assert index.num_skipped == 1
+
+    record = index.get("rs6025")
+    assert record["clinalleles"] == ["C"]
+    assert record["gene"] == "F5"
+    assert record["clinsigs"][0] == [
+        5, "Thrombophilia due to factor V Leiden", "no_criteria",
+        "RCV000000674.2"
+    ]
+
+    assert index.get("rs6026") is None
+    assert index.get("i3000001") is None
+
+# Set before forking, so workers share it as analyze_ancestrydna.py does
+forked_index = None
+
+def get_gene(rsid):
+    return forked_index.get(rsid)["gene"]
+
+def test_lookup_in_forked_processes(tmpdir):
+    vcf_path = str(tmpdir) + "/clinvar.vcf"
+    with open(vcf_path, "w") as f:
+        f.write(get_vcf())
+
+    global forked_index
+    forked_index = get_clinvar_index(vcf_path)
+    forked_index.get("rs6025")
+
+    # Each forked worker reopens the VCF, rather than sharing a file offset
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=2, mp_context=context) as pool:
+        genes = list(pool.map(get_gene, ["rs6025"] * 4))
+    assert genes == ["F5"] * 4
@@ -0,0 +1,70 @@
+"""Tests for converting BioMart TSV into annotations
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import json
+import sys
+
+# Ensures modules in parent directory can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+from convert_biomart_to_annots import get_organism, read_chrs, convert_biomart
+
+def test_convert_biomart(tmpdir):
+    bands_dir = str(tmpdir) + "/"
+    with open(bands_dir + "mus-musculus.json", "w") as f:
+        f.write(json.dumps({"chrBands": [
+            "1 p qA1 0 1 1 1000 gpos", "1 q qA2 1 2 1001 2000 gneg",
+            "X p qA1 0 1 1 1000 gpos", "Y p qA1 0 1 1 1000 gpos"
+        ]}))
+
+    input_path = str(tmpdir) + "/Mus_musculus,_Ensembl_110.tsv"
+    with open(input_path, "w") as f:
+        f.write("\n".join([
+            "Gene start (bp)\tGene end (bp)\tGene name\tGene type\t" +
+                "Chromosome/scaffold name\tTranscript count",
+            "3000\t4000\tXkr4\tprotein_coding\tX\t10",
+            "100\t500\tGm1992\tlncRNA\t1\t1",
+            "700\t900\tRp1\tprotein_coding\t1\t",
+            "50\t60\tGm123\tlncRNA\tJH584299.1\t3",
+            "10\t20\tSox17\tprotein_coding\t1\t5.5",
+            ""
+        ]))
+
+    organism = get_organism(input_path)
+    assert organism == "mus-musculus"
+    chrs = read_chrs(organism, bands_dir)
+    assert chrs == ["1", "X", "Y"]
+
+    output_path = str(tmpdir) + "/annots.json"
+    result = convert_biomart(
+        input_path, chrs, output_path,
+        category_columns=["gene type"], numeric_columns=["Transcript count"],
+        num_bins=3
+    )
+    assert result == [4, 1]
+
+    with open(output_path) as f:
+        annots = json.loads(f.read())
+    assert annots["keys"] == [
+        "name", "start", "length", "gene-type", "transcript-count"
+    ]
+    assert annots["metadata"]["categories"] == {
+        "gene-type": ["protein_coding", "lncRNA"]
+    }
+    assert annots["metadata"]["bins"] == {"transcript-count": [1, 4, 7, 10]}
+    assert annots["annots"] == [
+        {"chr": "1", "annots": [
+            ["Gm1992", 100, 400, 1, 0],
+            ["Rp1", 700, 200, 0, -1],
+            ["Sox17", 10, 10, 0, 1]
+        ]},
+        {"chr": "X", "annots": [["Xkr4", 3000, 1000, 0, 2]]},
+        {"chr": "Y", "annots": []}
+    ]
@@ -0,0 +1,71 @@
+"""Tests for converting dbVar GVF into annotations
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import gzip
+import json
+import sys
+
+# Ensures modules in parent directory can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+from convert_gvf_to_annots import read_chr_map, convert_gvf
+
+def write_assembly_report(path):
+    header = (
+        "# Assembly name:  GRCh38.p14\n" +
+        "# Sequence-Name\tSequence-Role\tAssigned-Molecule\t" +
+        "Assigned-Molecule-Location/Type\tGenBank-Accn\tRelationship\t" +
+        "RefSeq-Accn\tAssembly-Unit\tSequence-Length\tUCSC-style-name\n"
+    )
+    rows = [
+        ["1", "assembled-molecule", "1", "Chromosome", "CM000663.2", "=",
+            "NC_000001.11", "Primary Assembly", "248956422", "chr1"],
+        ["X", "assembled-molecule", "X", "Chromosome", "CM000685.2", "=",
+            "NC_000023.11", "Primary Assembly", "156040895", "chrX"],
+        ["MT", "assembled-molecule", "MT", "Mitochondrion", "J01415.2", "=",
+            "NC_012920.1", "non-nuclear", "16569", "chrM"],
+        ["HSCHR1_CTG3_UNLOCALIZED", "unlocalized-scaffold", "1",
+            "Chromosome", "KI270706.1", "=", "NT_187361.1",
+            "Primary Assembly", "175055", "chr1_KI270706v1_random"]
+    ]
+    with open(path, "w") as f:
+        f.write(header)
+        for row in rows:
+            f.write("\t".join(row) + "\r\n")
+
+def test_convert_gvf(tmpdir):
+    report_path = str(tmpdir) + "/assembly_report.txt"
+    write_assembly_report(report_path)
+    chr_map, chrs = read_chr_map(report_path)
+    assert chrs == ["1", "X"]
+    assert chr_map["NC_000023.11"] == "X"
+    assert chr_map["chr1"] == "1"
+    assert "NT_187361.1" not in chr_map
+
+    gvf_path = str(tmpdir) + "/study.gvf.gz"
+    with gzip.open(gvf_path, "wt") as f:
+        f.write(
+            "##gff-version 3\n" +
+            "NC_000023.11\tdbVar\tdeletion\t500\t1500\t.\t.\t.\t" +
+                "ID=1;Name=esv2;Alias=x\n" +
+            "NC_012920.1\tdbVar\tdeletion\t10\t20\t.\t.\t.\tName=esv3\n" +
+            "NC_000001.11\tdbVar\tcopy_number_variation\t10001\t22118\t.\t.\t.\t" +
+                "ID=2;Name=esv1\n" +
+            "NT_187361.1\tdbVar\tdeletion\t10\t20\t.\t.\t.\tName=esv4\n"
+        )
+
+    output_path = str(tmpdir) + "/annots.json"
+    assert convert_gvf(gvf_path, chr_map, chrs, output_path) == [2, 2]
+    with open(output_path) as f:
+        annots = json.loads(f.read())
+    assert annots["annots"] == [
+        {"chr": "1", "annots": [["esv1", 10001, 12117, 1]]},
+        {"chr": "X", "annots": [["esv2", 500, 1000, 1]]}
+    ]
@@ -0,0 +1,56 @@
+"""Tests for simulated annotation data
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import sys
+
+import numpy as np
+
+# Ensures modules in parent directory can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+from create_annots import (
+    generate_annots, get_chr_rows, get_track_index_pool, lengths_GRCh38
+)
+
+def get_annots(num_annots, distribution, seed, density='sparse'):
+    track_index_pool = get_track_index_pool(3, [5, 80, 15])
+    annots = generate_annots(
+        num_annots, lengths_GRCh38, 3, track_index_pool, density,
+        distribution, np.random.default_rng(seed)
+    )
+    return [[chr, get_chr_rows(*columns)] for [chr, *columns] in annots]
+
+def test_even():
+    num_annots = 1000
+    annots = get_annots(num_annots, 'even', 1)
+
+    # Matches positions from earlier, non-vectorized versions
+    chr, rows = annots[1]
+    assert chr == '2'
+    for row in rows:
+        i = int(row[0][2:]) - 1
+        assert i % 24 == 1
+        assert row[1] == int((i * lengths_GRCh38['2'])/num_annots + 1)
+        assert row[2] == 0
+        assert row[3] in (0, 1, 2)
+    assert sum(len(rows) for [chr, rows] in annots) == num_annots
+
+def test_seeded_clustered():
+    annots = get_annots(5000, 'clustered', 42, density='dense')
+    assert annots == get_annots(5000, 'clustered', 42, density='dense')
+    assert annots != get_annots(5000, 'clustered', 43, density='dense')
+
+    names = [row[0] for [chr, rows] in annots for row in rows]
+    assert len(set(names)) == 5000
+    for chr, rows in annots:
+        starts = [row[1] for row in rows]
+        assert starts == sorted(starts)
+        assert all(1 <= start <= lengths_GRCh38[chr] for start in starts)
+        assert all(len(row) == 6 for row in rows)
@@ -9,6 +9,8 @@ To run:
 
 import sys
 
+import pytest
+
 # Ensures `cache` package (and any subpackages) can be imported
 # TODO: Find way to avoid this kludge
 sys.path += ['..', '../cache']
@@ -51,3 +53,67 @@ def test_write(tmpdir):
     ]
     assert lines == expected_lines
 
+def test_fetch_interesting_genes_offline(tmpdir, monkeypatch):
+    import io
+    import lib
+    import gene_cache
+    import organisms
+
+    content = b"# gene\tviews\nTP53\t100\nBRCA1\t90\n"
+    requested_urls = []
+    def mock_urlopen(url):
+        requested_urls.append(url)
+        return io.BytesIO(content)
+
+    def clear_memoized():
+        monkeypatch.setattr(organisms, "artifacts", {})
+
+    monkeypatch.setattr(gene_cache.urllib.request, "urlopen", mock_urlopen)
+    monkeypatch.setattr(gene_cache, "rank_snapshot_dir", str(tmpdir) + "/")
+    clear_memoized()
+
+    # Online: fetch once, then reuse in-process copy
+    assert gene_cache.fetch_interesting_genes("Homo sapiens") == ("TP53", "BRCA1")
+    assert gene_cache.fetch_interesting_genes("Homo sapiens") == ("TP53", "BRCA1")
+    assert len(requested_urls) == 1
+
+    # Online with reuse, even after a non-reusing call: read from snapshot,
+    # not the network
+    assert gene_cache.fetch_interesting_genes("Homo sapiens", True) == ("TP53", "BRCA1")
+    assert len(requested_urls) == 1
+
+    # Offline: read from snapshot, never the network
+    clear_memoized()
+    monkeypatch.setattr(lib, "offline", True)
+    assert gene_cache.fetch_interesting_genes("Homo sapiens") == ("TP53", "BRCA1")
+    assert len(requested_urls) == 1
+
+    # Offline with a corrupted snapshot fails, rather than using bad data
+    clear_memoized()
+    with open(str(tmpdir) + "/homo-sapiens-gene-hints.tsv", "ab") as f:
+        f.write(b"EXTRA\t1\n")
+    with pytest.raises(FileNotFoundError):
+        gene_cache.fetch_interesting_genes("Homo sapiens")
+
+    # Online with reuse and a corrupted snapshot downloads a fresh copy
+    clear_memoized()
+    monkeypatch.setattr(lib, "offline", False)
+    assert gene_cache.fetch_interesting_genes("Homo sapiens", True) == ("TP53", "BRCA1")
+    assert len(requested_urls) == 2
+
+def test_sort_by_interest(monkeypatch):
+    import gene_cache
+
+    ranks = ("TP53", "BRCA1", "TP53")
+    monkeypatch.setattr(
+        gene_cache, "fetch_interesting_genes", lambda organism, reuse: ranks
+    )
+
+    # Ranked genes first, by rank; unranked genes last, in original order
+    genes = [["ACE2", "x"], ["BRCA1", "y"], ["ZZZ", "z"], ["TP53", "w"]]
+    sorted_genes = gene_cache.sort_by_interest(
+        genes, "Homo sapiens", gene_column=0
+    )
+    assert sorted_genes == [
+        ["TP53", "w"], ["BRCA1", "y"], ["ACE2", "x"], ["ZZZ", "z"]
+    ]
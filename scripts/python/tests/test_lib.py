@@ -0,0 +1,63 @@
+"""Tests for shared helpers in lib.py, e.g. BGZF writing and random access
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import gzip
+import subprocess
+import sys
+
+# Ensures `cache` package (and any subpackages) can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..', '../cache']
+
+from lib import BgzfWriter, BGZF_MAX_INPUT, read_bgzf_index, read_bgzf_range
+
+def get_content():
+    rows = [
+        "\t".join(["1", str(11869 + i), "2540", str(223972 + i), f"GENE{i}"])
+        for i in range(20000)
+    ]
+    return "## Ideogram.js gene cache for Homo sapiens\n" + "\n".join(rows)
+
+def test_bgzf_is_plain_gzip(tmpdir):
+    content = get_content()
+    output_path = str(tmpdir) + "/genes.tsv.gz"
+
+    with BgzfWriter(output_path) as f:
+        f.write(content)
+
+    # Multi-member gzip files are readable by Python and by `gzip -d`
+    with gzip.open(output_path, "rt") as f:
+        assert f.read() == content
+    gunzipped = subprocess.run(
+        ["gzip", "-dc", output_path], capture_output=True, check=True
+    ).stdout
+    assert gunzipped.decode() == content
+
+def test_bgzf_random_access(tmpdir):
+    content = get_content()
+    output_path = str(tmpdir) + "/genes.tsv.gz"
+
+    with BgzfWriter(output_path) as f:
+        f.write(content)
+
+    index = read_bgzf_index(output_path + ".gzi")
+    num_blocks = -(-len(content) // BGZF_MAX_INPUT) # ceiling division
+    assert len(index) == num_blocks
+    assert index[0] == (0, 0)
+    assert index[1][1] == BGZF_MAX_INPUT
+
+    # Read a row that straddles the boundary between the first two blocks
+    offset = BGZF_MAX_INPUT - 10
+    assert read_bgzf_range(output_path, offset, 30, index) == \
+        content.encode()[offset:offset + 30]
+
+    # Read the very last row
+    last_row = content.split("\n")[-1]
+    offset = len(content) - len(last_row)
+    assert read_bgzf_range(output_path, offset, 100).decode() == last_row
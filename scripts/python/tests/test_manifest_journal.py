@@ -0,0 +1,50 @@
+"""Tests for checkpointing and resuming the assembly manifest
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import sys
+
+# Ensures `fetch_chromosomes` package can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+from fetch_chromosomes.manifest import ManifestJournal
+
+def test_resume(tmpdir):
+    path = str(tmpdir) + '/assembly-manifest.journal.jsonl'
+
+    # Assemblies finish out of order; one has no centromeres
+    journal = ManifestJournal(path)
+    assert journal.uids is None
+    journal.set_uids(['1', '2', '3', '4'])
+    journal.record(3, 'GCF_3', 'pan-troglodytes', ['GCF_3', 'Clint_PTRv2'])
+    journal.record(1, 'GCF_1', 'pan-troglodytes', ['GCF_1', 'Pan_tro_3.0'])
+    journal.record(2, 'GCF_2', 'danio-rerio', None)
+
+    # Simulate crash partway through writing a record
+    with open(path, 'a') as f:
+        f.write('{"order": 4, "acc": "GCF_')
+
+    resumed = ManifestJournal(path)
+    assert len(resumed) == 3
+    assert resumed.uids == ['1', '2', '3', '4']
+    assert resumed.is_done('GCF_2')
+    assert not resumed.is_done('GCF_4')
+    resumed.record(4, 'GCF_4', 'danio-rerio', ['GCF_4', 'GRCz11'])
+    assert ManifestJournal(path).is_done('GCF_4')
+
+    # Last assembly in order wins, regardless of finish order
+    assert resumed.get_manifest() == {
+        'pan-troglodytes': ['GCF_3', 'Clint_PTRv2'],
+        'danio-rerio': ['GCF_4', 'GRCz11']
+    }
+
+    resumed.remove()
+    fresh = ManifestJournal(path)
+    assert len(fresh) == 0
+    assert fresh.uids is None
@@ -0,0 +1,41 @@
+"""Tests for SNPedia genotype lookups via a converted SQLite store
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import json
+import sys
+
+# Ensures modules in parent directory can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+from snpedia_store import get_snpedia_store
+
+def test_lookup(tmpdir):
+    json_path = str(tmpdir) + "/snpedia-archive.json"
+    snpedia_json = {
+        "rs6025": {
+            "original_orientation": "plus",
+            "genotypes": {
+                "CC": {"comment": "2 copies of factor V Leiden"},
+                "CT": {"comment": "1 copy of factor V Leiden"},
+                "TT": {"comment": "normal"}
+            }
+        },
+        "rs1801133": {"original_orientation": "minus", "genotypes": {}},
+        "rs53576": None
+    }
+    with open(json_path, "w") as f:
+        f.write(json.dumps(snpedia_json))
+
+    store = get_snpedia_store(json_path)
+
+    assert store.get("rs6025") == snpedia_json["rs6025"]
+    assert store.get("rs1801133") == snpedia_json["rs1801133"]
+    assert store.get("rs53576") is None
+    assert store.get("rs6026") is None
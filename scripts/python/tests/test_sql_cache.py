@@ -0,0 +1,102 @@
+"""Tests for cached SQL results and HTTP responses, i.e. recorded fixtures
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import datetime
+import sys
+from decimal import Decimal
+
+import pytest
+
+# Ensures `fetch_chromosomes` package can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..']
+
+import fetch_chromosomes.settings as settings
+
+@pytest.fixture
+def utils(tmpdir, monkeypatch):
+    """Get fetch_chromosomes.utils set for a development run, i.e. reading
+    SQL results only from cache, with a temporary cache directory
+    """
+    dir = str(tmpdir) + '/'
+    run_settings = {
+        'fresh_run': False,
+        'fill_cache': False,
+        'output_dir': dir,
+        'cache_dir': dir
+    }
+
+    # utils reads settings on first import, then keeps its own copies
+    for name, value in run_settings.items():
+        monkeypatch.setattr(settings, name, value, raising=False)
+    import fetch_chromosomes.utils as utils
+    for name, value in run_settings.items():
+        monkeypatch.setattr(utils, name, value)
+    monkeypatch.setattr(utils, 'query_cache', utils.QueryCache(dir))
+
+    return utils
+
+def test_encode_decode_rows(utils):
+    rows = (
+        ('chr1', 0, 2300000, 'p36.33', 'gneg'),
+        ('chrX', 2**40, -1, None, ''),
+        (1.5, Decimal('3.25'), b'\x00\xff', 'Schrödinger'),
+        (datetime.datetime(2023, 7, 1, 12, 30), datetime.date(2023, 7, 1)),
+        ()
+    )
+    assert utils.decode_rows(utils.encode_rows(rows)) == rows
+
+def test_offline_cursor(utils):
+    cache = utils.query_cache
+
+    host = 'genome-mysql.soe.ucsc.edu'
+    query = 'SELECT * FROM cytoBandIdeo'
+    rows = (('chr1', 0, 2300000, 'p36.33', 'gneg'),)
+    cache.write(host, 'hg38', query, rows)
+
+    # Results are keyed by host and current database, not just query
+    cursor = utils.Connection(host=host).cursor()
+    cursor.execute('USE hg38')
+    assert cursor.execute(query) == 1
+    assert cursor.fetchone() == rows[0]
+    assert cursor.fetchone() is None
+
+    cursor.execute('USE hg19')
+    with pytest.raises(FileNotFoundError):
+        cursor.execute(query)
+
+    assert cache.get_stats() == {'hits': 1, 'misses': 1, 'writes': 1}
+
+def test_replay_request(utils):
+    fixture_dir = utils.cache_dir
+
+    url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=assembly'
+    recorded_url = url + '&api_key=abc123'
+    utils.write_atomic(
+        utils.get_request_cache_path(recorded_url), b'{"esearchresult": {}}'
+    )
+    utils.write_fixture_manifest(fixture_dir)
+    utils.check_fixture_manifest(fixture_dir)
+
+    # Replays match regardless of API key
+    assert utils.request(url + '&api_key=xyz789') == '{"esearchresult": {}}'
+    with pytest.raises(FileNotFoundError):
+        utils.request(url + '&term=hg38')
+
+def test_replay_query_miss(utils, monkeypatch):
+    from fetch_chromosomes import db_pool
+
+    delays = []
+    monkeypatch.setattr(db_pool.time, 'sleep', delays.append)
+
+    # Missing fixtures fail at once, rather than being retried
+    pool = db_pool.DbPool('genome-mysql.soe.ucsc.edu', user='genome')
+    with pytest.raises(FileNotFoundError):
+        pool.query('SELECT * FROM hg38.cytoBandIdeo')
+    assert delays == []
@@ -0,0 +1,46 @@
+"""Tests for front-coded gene synonym search indexes
+
+To run:
+    $ pwd
+    python
+    $ cd tests
+    $ pytest -s
+"""
+
+import sys
+
+# Ensures `cache` package (and any subpackages) can be imported
+# TODO: Find way to avoid this kludge
+sys.path += ['..', '../cache']
+
+from cache.synonym_index import write_synonym_index, SynonymIndex
+
+def test_lookup_and_prefix_search(tmpdir):
+    # Simulate expected input data, in synonym cache order
+    synonyms = [
+        ["TP53", "P53", "LFS1", "BCC7"],
+        ["BRCA1", "BRCC1", "RNF53", "PPP1R53"],
+        ["BRCA2", "BRCC2", "FANCD1", "FAD1"],
+        ["CDKN2A", "P16", "P16INK4A", "P14ARF"],
+        ["TP73", "P73"],
+        ["PRKN", "PARK2", "PDJ"],
+        ["LRRK2", "PARK8", "DARDARIN"]
+    ] + [[f"GENE{i}", f"ALIAS{i}", "SHARED"] for i in range(40)]
+
+    output_path = str(tmpdir) + "/homo-sapiens-synonyms-index.tsv.gz"
+    write_synonym_index(synonyms, "Homo sapiens", output_path)
+    index = SynonymIndex.from_file(output_path)
+
+    assert index.lookup("p53") == [0]
+    assert index.lookup("FANCD1") == [2]
+    assert index.lookup("shared") == list(range(7, 47))
+    assert index.lookup("alias39") == [46]
+    assert index.lookup("nonexistent") == []
+
+    # Synonyms are lowercase and sorted, so prefix matches are contiguous
+    assert index.search_prefix("p1") == [
+        ["p14arf", [3]], ["p16", [3]], ["p16ink4a", [3]]
+    ]
+    assert index.search_prefix("park") == [["park2", [5]], ["park8", [6]]]
+    assert len(index.search_prefix("alias", limit=25)) == 25
+    assert index.search_prefix("zzz") == []